@@ -1,10 +1,109 @@
+import orjson as json
 import argparse
 import xml.etree.ElementTree as ET
 import ast
 import string
+import sys
+import batch_queries
 import card_analyzer as ca
+import card_groups
+import profiling
+import sharded_queries
+import columnar
+import partitions
 from datetime import datetime
 
+SEARCH_ARGS = ["dataset", "whitelist", "blacklist", "player", "start", "end", "event", "main", "side", "type", "archetype"]
+
+
+def applyPrefs(args: dict, prefs: str) -> None:
+    """
+    Fills the args that were not given as input from an XML preferences file (see -save)
+    """
+    try:
+        if ".xml" not in prefs:
+            prefs += ".xml"
+        tree = ET.parse(prefs)
+        root = tree.getroot()
+        for child in root:
+            # Input overwrites XML
+            if args[child.tag] == None and child.text != "None":
+                value = child.text
+                if "[" in value:
+                    value = ast.literal_eval(child.text)
+
+                args[child.tag] = value
+
+    except Exception as e:
+        print(f"Error: could not parse {prefs}. Please check that it exists and is valid.")
+        quit()
+
+
+def searchQuery(args: dict) -> dict:
+    """
+    Formats the search args into ca.getDecks keyword arguments, plus the showTypes of ca.getCardPrevalence
+    """
+    # Dataset
+    dataset = args["dataset"]
+
+    if dataset != None and ".json" not in dataset and not dataset.endswith((columnar.COLUMNAR_EXTENSION, partitions.PARTITIONED_EXTENSION)):
+        dataset += ".json"
+
+    if args["dsPath"] != None:
+        dsPath = args["dsPath"]
+        if dsPath[-1] != "/":
+            dsPath += "/"
+        dataset = dsPath + dataset
+
+    # Dates
+    start = args["start"] if args["start"] != None else "2010/01"
+    end = args["end"] if args["end"] != None else "2110/01"
+
+    # Deck / Event
+    searchIn = []
+    if args["main"]:
+        searchIn.append("main")
+    if args["side"]:
+        searchIn.append("side")
+
+    if len(searchIn) == 0:
+        searchIn = None
+
+    return {"dataset": dataset,
+            "whitelist": args["whitelist"],
+            "blacklist": args["blacklist"],
+            "player": args["player"],
+            "minDate": datetime.strptime(start, "%Y/%m").date(),
+            "maxDate": datetime.strptime(end, "%Y/%m").date(),
+            "searchIn": searchIn,
+            "eventType": args["event"],
+            "archetype": args["archetype"],
+            "showTypes": args["type"]}
+
+
+def batchSearches(args: dict, batchFile: str) -> list[dict]:
+    """
+    Returns the args of every search in a batch file: a json list of objects keyed like the options of this script
+    (e.g. [{"whitelist": ["bolt"], "event": ["league"], "main": true}, ...]) or an XML preferences file, i.e. one search
+    Args given as input apply to every search, as with -prefs
+    """
+    if batchFile.endswith(".json"):
+        try:
+            with open(batchFile, "rb") as f:
+                searches = json.loads(f.read())
+        except (OSError, json.JSONDecodeError):
+            print(f"Error: could not parse {batchFile}. Please check that it exists and is valid.")
+            quit()
+        return [dict(args, **{k: v for k, v in search.items() if args.get(k) == None}) for search in searches]
+
+    searchArgs = dict(args)
+    applyPrefs(searchArgs, batchFile)
+    return [searchArgs]
+
+
+def describeSearch(args: dict) -> str:
+    return " ".join(f"-{k} {v}" for k, v in args.items() if k in SEARCH_ARGS and v not in [None, False, []])
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("analyze")
@@ -23,35 +122,37 @@ if __name__ == "__main__":
     parser.add_argument("-whitelist", "-w", nargs="*", help="e.g. \"kappa cann\" \"thought monitor\" memnite ...")
     parser.add_argument("-blacklist", "-b", nargs="*", help="e.g. \"kappa cann\" \"thought monitor\" memnite ...")
     parser.add_argument("-player", nargs="?", help="Search only for decks from a specific player")
+    parser.add_argument("-archetype", "-a", nargs="*", help="Search only for decks of archetypes with these signature cards. e.g. murktide")
     parser.add_argument("-type", nargs="*", help="Return only cards of a specific type(s)")
     parser.add_argument("-main", action=argparse.BooleanOptionalAction, help="Search only when the card is in the maindeck")
     parser.add_argument("-side", action=argparse.BooleanOptionalAction, help="Search only when the card is in the sideboard")
     parser.add_argument("-fprops", action=argparse.BooleanOptionalAction, help="Forcefully update the Card Properties dataset")
     parser.add_argument("-event", nargs="*", help="'league' or 'scheduled'")
     parser.add_argument("-lists", "-l", action=argparse.BooleanOptionalAction, help="Show full decklists instead of card stats")
+    parser.add_argument("-events", action=argparse.BooleanOptionalAction, help="List the events of the matching decks instead of card stats")
+    parser.add_argument("-group", "-g", nargs="*", help="Show the share of decks running any/all/enough copies of these card groups by month instead of card stats. e.g. \"Modern Counters\"")
+    parser.add_argument("-copies", nargs="?", type=int, help=f"With -group, how many copies of a group's cards count as enough. Default {ca.GROUP_MIN_COPIES_DEFAULT}")
+    parser.add_argument("-archetypes", action=argparse.BooleanOptionalAction, help="Also list the archetypes of the matching decks after the card stats")
+    parser.add_argument("-with", nargs="?", help="Show the cards most played alongside this card instead of card stats. e.g. \"lightning bolt\"")
+    parser.add_argument("-top", nargs="?", type=int, help="With -with, how many cards to show. Default 20")
+    parser.add_argument("-lift", action=argparse.BooleanOptionalAction, help="With -with, rank the cards by lift (how much more often they are played together than by chance) instead of by # of decks")
+    parser.add_argument("-limit", nargs="?", type=int, help="With -lists, show at most this many decklists per page")
+    parser.add_argument("-page", nargs="?", type=int, help="With -lists and -limit, which page of decklists to show. e.g. '2'")
+    parser.add_argument("-profile", nargs="?", const="text", choices=["text", "json"], help="Print how long each stage of the search took to stderr, as a table (default) or json")
+    parser.add_argument("-profileMemory", action=argparse.BooleanOptionalAction, help="With -profile, also trace the memory each stage allocates (slower)")
+    parser.add_argument("-batch", nargs="*", help="Print the card stats of every search in these files at once: json lists of searches or XML preferences. e.g. report.json")
+    parser.add_argument("-jobs", "-j", nargs="?", type=int, const=sharded_queries.jobsDefault(), help="Compute card stats and -group over shards of a partitioned or columnar dataset in this many processes (every core if no number is given). e.g. 8")
+    parser.add_argument("-nocache", action=argparse.BooleanOptionalAction, help="Recompute the search instead of reusing the result of an identical one")
     
     args = vars(parser.parse_args())
 
     # Parse the XML tree if provided
     prefs = args["prefs"]
     if prefs != None:
-       try:
-            if ".xml" not in prefs:
-                prefs += ".xml"
-            tree = ET.parse(prefs)
-            root = tree.getroot()
-            for child in root:
-                # Input overwrites XML
-                if args[child.tag] == None and child.text != "None": 
-                    value = child.text
-                    if "[" in value:
-                        value = ast.literal_eval(child.text)
-                      
-                    args[child.tag] = value
-
-       except Exception as e: 
-           print(f"Error: could not parse {prefs}. Please check that it exists and is valid.")
-           quit()
+        applyPrefs(args, prefs)
+
+    if args["page"] is not None and not args["limit"]:
+        parser.error("-page needs -limit, the number of decklists per page")
 
     # Save the new XML tree including CLI args if requested by -save
     saveName = args["save"]
@@ -81,7 +182,7 @@ if __name__ == "__main__":
     # Check that mandatory values for getDecks were included either as input or in XML
     # First check that no operations that happen separately from these required args are enabled. In that case these are not actually required
 
-    if not args["fprops"] and not args["save"]:
+    if not args["fprops"] and not args["save"] and not args["batch"]:
         missing = []
         requiredArgs = ["dataset"]
         for arg in requiredArgs:
@@ -92,55 +193,79 @@ if __name__ == "__main__":
             quit()
 
 
-    # Format values to pass to CA:
-
-    # Dataset
-    dataset = args["dataset"]
-
-    if dataset != None and ".json" not in dataset:
-        dataset += ".json"
-    
-    if args["dsPath"] != None:
-        if args["dsPath"][-1] != "/":
-            args["dsPath"] += "/"
-        dataset = args["dsPath"] + dataset
-
-    # Dates
-    if args["start"] == None:
-        args["start"] = "2010/01"
+    # Format values to pass to CA
+    query = searchQuery(args)
+    dataset = query["dataset"]
 
-    if args["end"] == None:
-        args["end"] = "2110/01"
+    if args["fprops"]:
+        ca.loadCardProperties(True)
 
-    args["start"] = datetime.strptime(args["start"], "%Y/%m").date()
-    args["end"] = datetime.strptime(args["end"], "%Y/%m").date()
+    if args["nocache"]:
+        ca.QUERY_CACHE_ENABLED = False
 
-    # Deck / Event
-    searchIn = []
-    if args["main"]:
-        searchIn.append("main")
-    if args["side"]:
-        searchIn.append("side")
+    if args["profile"]:
+        profiling.enable(memory=bool(args["profileMemory"]))
 
-    if len(searchIn) == 0:
-        searchIn = None
+    if args["batch"]:
+        searches = [search for batchFile in args["batch"] for search in batchSearches(args, batchFile)]
+        queries = []
+        for search in searches:
+            query = searchQuery(search)
+            if query["dataset"] == None:
+                print(f"Error: no dataset for the search {describeSearch(search)}")
+                quit()
+            queries.append(query)
 
-    if args["fprops"]:
-        ca.loadCardProperties(True)
+        for search, output in zip(searches, batch_queries.getCardPrevalences(queries)):
+            print(f"=== {describeSearch(search)} ===")
+            print(output)
+            print()
 
-    if dataset != None:
-        decks = ca.getDecks(
-                        dataset=dataset,
-                        whitelist=args["whitelist"],
-                        blacklist=args["blacklist"],
-                        player=args["player"],
-                        minDate=args["start"],
-                        maxDate=args["end"],
-                        searchIn=searchIn,
-                        eventType=args["event"]
-                    )
+        if args["profile"] == "json":
+            print(profiling.jsonReport(profiling.report()), file=sys.stderr)
+        elif args["profile"]:
+            print(profiling.formatReport(profiling.report()), file=sys.stderr)
+    elif dataset != None:
+        decks = ca.getDecks(**{k: v for k, v in query.items() if k != "showTypes"})
     
         if args["lists"]:
-            print(ca.displayDecks(decks))
+            # Each decklist is printed as soon as it is found
+            page = int(args["page"] or 1)
+            limit = int(args["limit"]) if args["limit"] else None
+            start = (page - 1) * limit if limit else 0
+            shown = 0
+            with profiling.span("render decklists") as stage:
+                for text in ca.renderDecks(decks, start, limit + 1 if limit else None):
+                    if shown == limit:
+                        print(f"\nShowing decklists {start + 1}-{start + shown}. See the next ones with -page {page + 1}")
+                        break
+                    print(text, end="", flush=True)
+                    shown += 1
+                profiling.setDecksOut(stage, shown)
+            print()
+        elif args["events"]:
+            print(ca.formatEvents(ca.getEvents(decks)))
+        elif args["with"]:
+            print(ca.getPlayedWith(decks, args["with"], args["top"] or 20, "lift" if args["lift"] else "decks", query["searchIn"]))
+        elif args["group"]:
+            groupNames = {name.lower(): name for name in card_groups.CARD_GROUP_DICT}
+            groups = {}
+            for name in args["group"]:
+                if name.lower() not in groupNames:
+                    print(f"Error: no card group named {name}. Choose from: {', '.join(card_groups.CARD_GROUP_DICT)}")
+                    quit()
+                groups[groupNames[name.lower()]] = card_groups.CARD_GROUP_DICT[groupNames[name.lower()]]
+            minCopies = args["copies"] if args["copies"] != None else ca.GROUP_MIN_COPIES_DEFAULT
+            if args["jobs"]:
+                print(sharded_queries.getGroupPrevalence(decks, groups, query["searchIn"], int(minCopies), args["jobs"]))
+            else:
+                print(ca.getGroupPrevalence(decks, groups, query["searchIn"], int(minCopies)))
+        elif args["jobs"]:
+            print(sharded_queries.getCardPrevalence(decks, args["type"], bool(args["archetypes"]), args["jobs"]))
         else:
-            print(ca.getCardPrevalence(decks, args["type"]))   
+            print(ca.getCardPrevalence(decks, args["type"], bool(args["archetypes"])))
+
+        if args["profile"] == "json":
+            print(profiling.jsonReport(profiling.report()), file=sys.stderr)
+        elif args["profile"]:
+            print(profiling.formatReport(profiling.report()), file=sys.stderr)   
@@ -0,0 +1,252 @@
+import orjson as json
+import hashlib
+import numpy as np
+from os import path
+from datetime import *
+from typing import Optional
+import dataset_version
+import deck_matrix
+import partitions
+import profiling
+import segment_log
+
+'''
+Archetypes of a dataset, found by clustering its decklists and saved next to it (like rollups.py):
+    <dataset>_archetypes.json   e.g. Data/modern_archetypes.json, or archetypes.json inside .cols/.parts datasets
+
+{"version": 1, "dataset": <dataset_version.datasetVersion the archetypes were computed from>,
+ "archetypes": [{"signature": [card, ...], "decks": n}, ...],
+ "labels": {"": [archetype of every deck, in dataset order]}}
+Partitioned datasets keep one list of labels per month ({"YYYY-MM": [...]}), so loads of a date range can be labeled.
+Archetypes are numbered from the most played, decks in no archetype are labeled -1
+
+Each deck's card set is sketched with MinHash: main and side cards are distinct tokens, as is each copy of a card (up to
+MAX_COPIES), and the deck keeps the minimum of NUM_HASHES hash functions over its tokens, so two sketches agree on a hash with
+probability the Jaccard similarity of their sets.
+Locality-sensitive hashing splits the sketches into BANDS bands: decks with an identical band land in the same bucket, which
+similar decks do in at least one band with high probability. Each deck is linked to the first deck of its buckets when their
+sketches agree on at least MIN_SIMILARITY of the hashes, and archetypes are the connected groups of at least
+MIN_ARCHETYPE_DECKS decks. No pair of decks is compared outside of a bucket, so clustering stays linear in the # of decks
+An archetype's signature is the main deck cards its decks run most often relative to the whole dataset
+'''
+
+ARCHETYPE_VERSION = 1
+NUM_HASHES = 64
+BANDS = 16
+MAX_COPIES = 4
+MIN_SIMILARITY = 0.5
+MIN_ARCHETYPE_DECKS = 10
+SIGNATURE_CARDS = 3
+SEED = 1
+
+
+def archetypePath(dataset: str) -> str:
+    if path.isdir(dataset):
+        return path.join(dataset, "archetypes.json")
+    return path.splitext(dataset)[0] + "_archetypes.json"
+
+
+def tokenHashes(tokens: list[str]) -> np.ndarray:
+    """
+    Returns NUM_HASHES 32 bit hashes of every token (rows), from its name so they do not depend on vocabulary ids
+    """
+    base = np.array([int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little") for token in tokens],
+                    dtype=np.uint64)
+    rng = np.random.default_rng(SEED)
+    multipliers = rng.integers(1, 2 ** 63, NUM_HASHES, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    offsets = rng.integers(0, 2 ** 63, NUM_HASHES, dtype=np.uint64)
+    # Multiply-shift hashing, wrapping around 2^64
+    return ((base[:, None] * multipliers[None, :] + offsets[None, :]) >> np.uint64(32)).astype(np.uint32)
+
+
+def minhashSignatures(matrix: deck_matrix.DeckMatrix) -> np.ndarray:
+    """
+    Returns the MinHash sketch of every deck of matrix, (# of decks x NUM_HASHES)
+    Each copy of a card is its own token (up to MAX_COPIES), so core 4-ofs weigh more than a 1-of
+    """
+    # One row per hash function while sketching, so every gather and reduction runs over contiguous memory
+    signatures = np.full((NUM_HASHES, matrix.numDecks), np.iinfo(np.uint32).max, dtype=np.uint32)
+    for location in deck_matrix.LOCATIONS:
+        offsets = matrix.offsets[location]
+        cardIds = matrix.cardIds[location]
+        if len(cardIds) == 0:
+            continue
+        # Minimum hash of a card's first n copies, for n = 1..MAX_COPIES
+        hashes = tokenHashes([f"{location}:{card}:{copy}" for card in matrix.cards for copy in range(MAX_COPIES)])
+        hashes = np.minimum.accumulate(hashes.reshape(matrix.numCards, MAX_COPIES, NUM_HASHES), axis=1)
+        hashes = np.ascontiguousarray(hashes.reshape(matrix.numCards * MAX_COPIES, NUM_HASHES).T)
+        tokens = cardIds.astype(np.int64) * MAX_COPIES + np.clip(matrix.counts[location], 1, MAX_COPIES) - 1
+
+        # reduceat gives empty decks the entry at their offset, they keep the initial maximum instead
+        present = np.diff(offsets) > 0
+        starts = offsets[:-1][present]
+        for row in range(NUM_HASHES):
+            signatures[row, present] = np.minimum(signatures[row, present], np.minimum.reduceat(hashes[row][tokens], starts))
+    return np.ascontiguousarray(signatures.T)
+
+
+def similarPairs(signatures: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (deck, deck) pairs that share a band bucket and whose sketches agree on at least MIN_SIMILARITY of the hashes
+    Each deck is only paired with the first deck of its bucket, which is enough to connect the bucket
+    """
+    numDecks = len(signatures)
+    rows = NUM_HASHES // BANDS
+    mixers = np.random.default_rng(SEED + 1).integers(1, 2 ** 63, rows, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    first = []
+    second = []
+    for band in range(BANDS):
+        keys = (signatures[:, band * rows:(band + 1) * rows].astype(np.uint64) * mixers).sum(axis=1)
+        order = np.argsort(keys, kind="stable")
+        sortedKeys = keys[order]
+        bucketStarts = np.flatnonzero(np.r_[True, sortedKeys[1:] != sortedKeys[:-1]])
+        bucketSizes = np.diff(np.r_[bucketStarts, numDecks])
+        representatives = np.repeat(order[bucketStarts], bucketSizes)
+        candidates = representatives != order
+        decks = order[candidates]
+        representatives = representatives[candidates]
+        similar = np.count_nonzero(signatures[decks] == signatures[representatives], axis=1) >= MIN_SIMILARITY * NUM_HASHES
+        first.append(decks[similar])
+        second.append(representatives[similar])
+    return np.concatenate(first), np.concatenate(second)
+
+
+def connectedGroups(numDecks: int, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """
+    Returns, for every deck, the smallest deck id it is connected to through the pairs
+    """
+    groups = np.arange(numDecks)
+    while True:
+        linked = groups.copy()
+        np.minimum.at(linked, first, groups[second])
+        np.minimum.at(linked, second, groups[first])
+        linked = linked[linked]
+        if np.array_equal(linked, groups):
+            return groups
+        groups = linked
+
+
+def clusterDecks(matrix: deck_matrix.DeckMatrix) -> tuple[np.ndarray, list[dict]]:
+    """
+    Returns the archetype of every deck of matrix (-1 for none) and the archetypes, most played first
+    """
+    numDecks = matrix.numDecks
+    with profiling.span("minhash", numDecks):
+        signatures = minhashSignatures(matrix)
+    with profiling.span("lsh buckets", numDecks):
+        groups = connectedGroups(numDecks, *similarPairs(signatures))
+
+    roots, inverse, sizes = np.unique(groups, return_inverse=True, return_counts=True)
+    kept = np.flatnonzero(sizes >= MIN_ARCHETYPE_DECKS)
+    kept = kept[np.argsort(-sizes[kept], kind="stable")]
+    archetypeOf = np.full(len(roots), -1, dtype=np.int32)
+    archetypeOf[kept] = np.arange(len(kept), dtype=np.int32)
+    labels = archetypeOf[inverse.ravel()]
+    return labels, signatureCards(matrix, labels, sizes[kept])
+
+
+def signatureCards(matrix: deck_matrix.DeckMatrix, labels: np.ndarray, sizes: np.ndarray) -> list[dict]:
+    """
+    Names each archetype by the SIGNATURE_CARDS main deck cards whose share of its decks most exceeds their share of all decks
+    """
+    cardIds = matrix.cardIds["main"]
+    entryLabels = labels[matrix.deckIds("main")]
+    labeled = entryLabels >= 0
+    keys, counts = np.unique(entryLabels[labeled].astype(np.int64) * matrix.numCards + cardIds[labeled], return_counts=True)
+    archetypes, cards = np.divmod(keys, max(matrix.numCards, 1))
+    overall = matrix.decksContaining("main") / max(matrix.numDecks, 1)
+    scores = counts / sizes[archetypes] - overall[cards]
+
+    # Highest scores first within each archetype
+    order = np.lexsort((-scores, archetypes))
+    archetypes = archetypes[order]
+    cards = cards[order]
+    starts = np.searchsorted(archetypes, np.arange(len(sizes)))
+    ends = np.searchsorted(archetypes, np.arange(len(sizes)), side="right")
+    return [{"signature": [matrix.cards[card] for card in cards[start:min(end, start + SIGNATURE_CARDS)].tolist()],
+             "decks": int(size)}
+            for start, end, size in zip(starts.tolist(), ends.tolist(), sizes.tolist())]
+
+
+def buildArchetypes(dataset: str, decks) -> dict:
+    """
+    Clusters every deck in dataset (decks must be all of them, in dataset order, e.g. card_analyzer.loadDataset(dataset))
+    and saves the archetypes
+    """
+    version = dataset_version.datasetVersion(dataset)
+    with profiling.span("deck matrix", len(decks)):
+        matrix = deck_matrix.deckMatrixOf(decks)
+    labels, archetypes = clusterDecks(matrix)
+
+    if partitions.isPartitionedDataset(dataset):
+        months = partitions.monthsInRange(dataset)
+        bounds = np.cumsum([0] + [len(part) for part in decks.parts])
+        labelsByMonth = {month: labels[start:end] for month, start, end in zip(months, bounds[:-1], bounds[1:])}
+    else:
+        labelsByMonth = {"": labels}
+
+    saved = {"version": ARCHETYPE_VERSION, "dataset": version, "archetypes": archetypes, "labels": labelsByMonth}
+    segment_log.writeFileAtomic(archetypePath(dataset), json.dumps(saved, option=json.OPT_SERIALIZE_NUMPY))
+    return saved
+
+
+def readArchetypes(archetypeFile: str) -> dict:
+    with open(archetypeFile, "rb") as f:
+        saved = json.loads(f.read())
+    saved["labels"] = {month: np.array(labels, dtype=np.int32) for month, labels in saved.get("labels", {}).items()}
+    return saved
+
+
+def isCurrent(saved: dict, dataset: str) -> bool:
+    return saved.get("version") == ARCHETYPE_VERSION and saved["dataset"] == dataset_version.datasetVersion(dataset)
+
+
+def carryOver(dataset: str, previousVersion: list[int]) -> None:
+    """
+    Keeps the archetypes valid after an operation that changed the dataset's files but not its decks (e.g. compaction)
+    """
+    archetypeFile = archetypePath(dataset)
+    if not path.isfile(archetypeFile):
+        return
+    with open(archetypeFile, "rb") as f:
+        saved = json.loads(f.read())
+    if saved["dataset"] == previousVersion:
+        saved["dataset"] = dataset_version.datasetVersion(dataset)
+        segment_log.writeFileAtomic(archetypeFile, json.dumps(saved))
+
+
+def labelsInRange(saved: dict, dataset: str, minDate: Optional[date] = None, maxDate: Optional[date] = None) -> np.ndarray:
+    """
+    Returns the archetype of every deck of card_analyzer.loadDataset(dataset, minDate, maxDate), in the same order
+    """
+    labels = saved["labels"]
+    if partitions.isPartitionedDataset(dataset):
+        months = [labels[month] for month in partitions.monthsInRange(dataset, minDate, maxDate)]
+        return np.concatenate(months) if months else np.empty(0, dtype=np.int32)
+    return labels[""]
+
+
+def archetypeName(archetype: dict) -> str:
+    return " / ".join(archetype["signature"])
+
+
+def matchingArchetypes(saved: dict, terms: list[str]) -> np.ndarray:
+    """
+    Returns the ids of the archetypes matching any of terms: a partial card name of their signature (e.g. "murktide")
+    """
+    return np.array([i for i, archetype in enumerate(saved["archetypes"])
+                     if any(term in card for term in terms for card in archetype["signature"])], dtype=np.int32)
+
+
+if __name__ == "__main__":
+    import argparse
+    import card_analyzer
+
+    parser = argparse.ArgumentParser(description="Cluster the decks of a dataset into archetypes")
+    parser.add_argument("dataset", type=str, help="Dataset to cluster, in any format (e.g. Data/modern.json)")
+    args = parser.parse_args()
+
+    built = buildArchetypes(args.dataset, card_analyzer.loadDataset(args.dataset))
+    for i, archetype in enumerate(built["archetypes"]):
+        print(f"{i:>4} | {archetype['decks']:>7} decks | {archetypeName(archetype)}")
+    print(f"Saved {len(built['archetypes'])} archetypes to {archetypePath(args.dataset)}")
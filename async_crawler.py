@@ -0,0 +1,160 @@
+import asyncio
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from typing import Optional
+import mtgo_http
+import scraper
+
+'''
+Concurrent alternative to scraper.scrapeUrlsByMonth that never starts a browser
+Listing pages of every month and the event pages they link to are fetched concurrently, limited by a global number of
+requests in flight and a per-host request rate, with timeouts and retry-with-backoff. Results are recorded in the dataset
+and its url file exactly like scrapeUrls does. Pages that cannot be parsed without a browser are recorded as failed so
+'python scrape.py <dataset> <format> -retry' can pick them up.
+The base url is configurable so the crawl can be run against a local stand-in server
+'''
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_REQUESTS_PER_SECOND = 4
+DEFAULT_RETRIES = 3
+BACKOFF_SECONDS = 1
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+class HostRateLimiter:
+    """
+    Spaces out requests to the same host so at most requestsPerSecond start each second
+    """
+
+    def __init__(self, requestsPerSecond: float):
+        self.interval = 1 / requestsPerSecond
+        self.nextSlot = {}
+        self.lock = asyncio.Lock()
+
+    async def wait(self, host: str) -> None:
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            slot = max(now, self.nextSlot.get(host, now))
+            self.nextSlot[host] = slot + self.interval
+        await asyncio.sleep(slot - now)
+
+
+class Crawler:
+    def __init__(self,
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 requestsPerSecond: float = DEFAULT_REQUESTS_PER_SECOND,
+                 timeout: float = mtgo_http.HTTP_TIMEOUT,
+                 retries: int = DEFAULT_RETRIES):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiter = HostRateLimiter(requestsPerSecond)
+        self.timeout = timeout
+        self.retries = retries
+
+    async def fetch(self, url: str) -> Optional[requests.Response]:
+        """
+        Returns the 200 response for url, or None once every retry has failed
+        """
+        host = urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            await self.limiter.wait(host)
+            async with self.semaphore:
+                try:
+                    response = await asyncio.wait_for(asyncio.to_thread(mtgo_http.session.get, url, timeout=self.timeout),
+                                                      self.timeout + 1)
+                except (requests.RequestException, asyncio.TimeoutError):
+                    response = None
+
+            if response is not None:
+                if response.status_code == 200:
+                    return response
+                if response.status_code not in RETRY_STATUSES:
+                    return None
+
+            if attempt < self.retries:
+                await asyncio.sleep(BACKOFF_SECONDS * 2 ** attempt)
+        return None
+
+
+async def crawlMonths(datasetFile: str,
+                      format: str,
+                      dates: list[str],
+                      baseUrl: Optional[str] = mtgo_http.MTGO_URL,
+                      concurrency: Optional[int] = DEFAULT_CONCURRENCY,
+                      requestsPerSecond: Optional[float] = DEFAULT_REQUESTS_PER_SECOND) -> None:
+    """
+    Scrapes every event of format in the given months ('yyyy/mm') into datasetFile
+    """
+    format = format.title()
+    urlFileName = scraper.urlFileFor(datasetFile)
+    scraper.createDatasetFileIfNotExist(datasetFile)
+    storedUrls = scraper.loadUrlFile(urlFileName)
+    knownUrls = set(storedUrls["completed"] + storedUrls["failed"]["dead"])
+    crawler = Crawler(concurrency, requestsPerSecond)
+    totals = {"decks": 0, "errors": 0}
+
+    # Every save happens on the event loop thread, so the dataset and url file still have a single writer
+    async def crawlEvent(url: str) -> None:
+        response = await crawler.fetch(url)
+        result = None
+        if response is not None:
+            result = mtgo_http.eventFromResponse(url, response, scraper.dateFromUrl(url))
+
+        if result is None:
+            print(f"Failed to reach {url} Please retry it")
+            totals["errors"] += 1
+            scraper.saveUrlUpdate(urlFileName, {"failedEvent": [mtgo_http.urlEndingOf(url)]})
+            return
+
+        urlEnding, status, decks = result
+        totals["decks"] += len(decks)
+        scraper.attachEventMetadata(urlEnding, decks)
+        scraper.saveDecks(datasetFile, decks)
+        scraper.saveUrlUpdate(urlFileName, {status: [urlEnding]})
+
+    async def crawlMonth(date: str) -> None:
+        listingUrl = f"{baseUrl}/decklists/{date}?filter={format}"
+        response = await crawler.fetch(listingUrl)
+
+        # A listing without any event links was not rendered server side, which needs a browser to retry
+        if response is None or not mtgo_http.EVENT_LINK.search(response.text):
+            print(f"Error: Unable to access {listingUrl}. Please try them again with 'python scrape.py <dataset> <format> -retry'\n")
+            scraper.saveUrlUpdate(urlFileName, {"failedListing": [date]})
+            return
+
+        urls = mtgo_http.extractEventUrls(response.text, format, baseUrl)
+        if not urls:
+            print(f"Error: No {format} decklists found at {listingUrl}'")
+            scraper.saveUrlUpdate(urlFileName, {"dead": [date], "resolvedListing": [date]})
+            return
+
+        if date in storedUrls["failed"]["listing"]:
+            scraper.saveUrlUpdate(urlFileName, {"resolvedListing": [date]})
+
+        newUrls = [url for url in urls if mtgo_http.urlEndingOf(url) not in knownUrls]
+        print(f"Scraping {len(newUrls)} events from {date}")
+        await asyncio.gather(*(crawlEvent(url) for url in newUrls))
+
+    # to_thread runs on the default executor, which must allow as many requests in flight as the semaphore
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    await asyncio.gather(*(crawlMonth(date) for date in dates))
+
+    print(f"Saved {totals['decks']} decklists to {datasetFile}")
+    scraper.compactDataset(datasetFile)
+
+    numErrors = totals["errors"]
+    if numErrors > 0:
+        print(f"\nError: Failed to reach {numErrors} Url{'s' if (numErrors > 1) else ''}. Please try them again with 'python scrape.py <dataset> <format> -retry'\n")
+
+
+def crawlUrlsByMonth(datasetFile: str, format: str, skip: bool, grace: Optional[int] = 7, startDate: Optional[str] = None,
+                     endDate: Optional[str] = None, concurrency: Optional[int] = DEFAULT_CONCURRENCY,
+                     baseUrl: Optional[str] = mtgo_http.MTGO_URL) -> None:
+    """
+    Same as scraper.scrapeUrlsByMonth, with every month crawled concurrently
+    """
+    if not skip:
+        scraper.updateCardPropertiesDataset()
+
+    dates = scraper.monthsToScrape(grace, startDate, endDate)
+    asyncio.run(crawlMonths(datasetFile, format, dates, baseUrl=baseUrl, concurrency=concurrency))
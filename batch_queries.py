@@ -0,0 +1,76 @@
+from typing import Optional
+import card_analyzer as ca
+import columnar
+import dataset_version
+import deck_matrix
+import profiling
+import utils
+
+'''
+Evaluates many card prevalence searches (e.g. a report of every card group, leagues vs scheduled events, main vs side)
+with one pass over each dataset instead of one per search:
+    queries = [{"dataset": "Data/modern.json", "whitelist": ["bolt"], "eventType": ["league"], "showTypes": ["Creature"]}, ...]
+    outputs = batch_queries.getCardPrevalences(queries)
+
+A query holds card_analyzer.getDecks keyword arguments, plus showTypes for getCardPrevalence.
+Searches answered by the query cache or the rollups are answered from them as usual. For each dataset, the others share
+one load (covering every query's dates), one search index, the decks matching each whitelist/blacklist term and one deck
+matrix, of which each query only slices its own rows
+'''
+
+
+def getCardPrevalences(queries: list[dict]) -> list[str]:
+    """
+    Returns getCardPrevalence(getDecks(...), showTypes) of every query, in order
+    """
+    samples = [ca.getDecks(**{k: v for k, v in query.items() if k != "showTypes"}) for query in queries]
+    showTypes = [query.get("showTypes") for query in queries]
+    outputs = [None] * len(queries)
+
+    byDataset = {}
+    with profiling.span("cached and rollup queries"):
+        for i, sample in enumerate(samples):
+            if ca.QUERY_CACHE_ENABLED:
+                outputs[i] = ca.savedPrevalence(sample, showTypes[i], dataset_version.datasetVersion(sample.query["dataset"]))
+            if outputs[i] is None and ca.rollupRows(sample) is not None:
+                outputs[i] = ca.getCardPrevalence(sample, showTypes[i])
+            if outputs[i] is None:
+                byDataset.setdefault(sample.query["dataset"], []).append(i)
+
+    for dataset, pending in byDataset.items():
+        with profiling.span("batch " + dataset, len(pending)):
+            results = runQueries(dataset, [samples[i] for i in pending], [showTypes[i] for i in pending])
+        for i, output in zip(pending, results):
+            outputs[i] = output
+    return outputs
+
+
+def runQueries(dataset: str, samples: list[ca.DeckSample], showTypes: list[Optional[list[str]]]) -> list[str]:
+    """
+    Computes the prevalence output of samples (getDecks searches of dataset) with one load, index and deck matrix
+    """
+    minDate = min(sample.query["minDate"] for sample in samples)
+    maxDate = max(sample.query["maxDate"] for sample in samples)
+    version, loaded = dataset_version.loadVersioned(dataset, lambda: ca.loadDataset(dataset, minDate, maxDate))
+    index = ca.searchIndexOf(loaded)
+
+    if isinstance(loaded, columnar.ColumnarDataset):
+        rowsOf = loaded.deckMatrix
+    else:
+        with profiling.span("deck matrix", len(loaded)):
+            rowsOf = deck_matrix.deckMatrixOf(loaded).rows
+
+    termPostings = {}
+    outputs = []
+    for sample, types in zip(samples, showTypes):
+        query = sample.query
+        ids = ca.getIndexedDeckIds(index, query["whitelist"], query["blacklist"], query["player"], query["minDate"],
+                                   query["maxDate"], query["searchIn"], utils.eventCategoryMask(query["eventType"]),
+                                   termPostings)
+        if query["archetype"]:
+            ids = ca.archetypeDeckIds(dataset, minDate, maxDate, ids, query["archetype"])
+        output = ca.matrixPrevalence(rowsOf(ids), types)
+        if ca.QUERY_CACHE_ENABLED:
+            ca.savePrevalence(sample, types, version, output)
+        outputs.append(output)
+    return outputs
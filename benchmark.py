@@ -0,0 +1,171 @@
+import orjson as json
+import argparse
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from os import path
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Optional
+import card_analyzer as ca
+import data_visualization as dv
+import mtgo_http
+import synthetic_data
+
+'''
+Measures how the analyzer and the scraper's parsers scale on synthetic datasets (see synthetic_data.py). Runs offline
+Every scenario reports its best wall time over a few runs, the peak memory it allocated (from a separate traced run,
+tracing slows code down) and its throughput in decks per second. Results are saved as json so runs on different commits
+can be compared:
+    python benchmark.py -out before.json
+    python benchmark.py -out after.json -compare before.json
+'''
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_REPEATS = 3
+PARSE_DECKS = 100_000 # The parsers are measured on at most this many decks
+DISPLAY_DECKS = 10_000 # displayDecks is measured on at most this many decks
+CHART_CARDS = 10
+EVENT_SIZE = 32
+
+
+def measure(run: Callable, repeats: int) -> tuple[float, int]:
+    """
+    Returns the best wall time of run() over repeats runs and the peak memory allocated during one more, traced, run
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def scenarios(datasetPath: str, decks: list[dict]) -> list[tuple[str, int, Callable]]:
+    """
+    Returns (name, # of decks processed, run) for every scenario on a dataset
+    """
+    whitelisted = [deck for deck in decks if "lightning bolt" in deck["main"]]
+    cards = list(dict.fromkeys(card for deck in islice(decks, 1000) for card in deck["main"]))[:CHART_CARDS]
+    parsed = decks[:PARSE_DECKS]
+    texts = [(synthetic_data.decklistText(deck), deck["url"]) for deck in parsed]
+    pages = [synthetic_data.eventHtml(parsed[i:i + EVENT_SIZE]) for i in range(0, len(parsed), EVENT_SIZE)]
+
+    def loadDataset() -> None:
+        ca.clearDatasetCache()
+        ca.loadDataset(datasetPath)
+
+    def acceptDecks() -> None:
+        for deck in decks:
+            ca.shouldAcceptDeck(ca.SEARCH_IN_DEFAULT, deck, ["bolt", "thoughtseize"], ["solitude"])
+
+    def parseDecklists() -> None:
+        # The scraper pulls in selenium, so it is only imported by the scenario that uses it
+        import scraper
+        for text, urlEnding in texts:
+            scraper.parseDecklist(text, urlEnding)
+
+    def extractDecklists() -> None:
+        for page in pages:
+            mtgo_http.extractDecklists(page, "modern-challenge-32-2024-01-0110000000", None)
+
+    numDecks = len(decks)
+    return [("loadDataset", numDecks, loadDataset),
+            ("getDecks whitelist", numDecks, lambda: ca.getDecks(datasetPath, whitelist=["bolt"]).select()),
+            ("getDecks player", numDecks, lambda: ca.getDecks(datasetPath, player="player1").select()),
+            ("shouldAcceptDeck", numDecks, acceptDecks),
+            ("getCardPrevalence", numDecks, lambda: ca.getCardPrevalence(decks)),
+            ("getCardPrevalence rollups", numDecks, lambda: ca.getCardPrevalence(ca.getDecks(datasetPath, eventType=["league"]))),
+            ("displayDecks", min(len(whitelisted), DISPLAY_DECKS), lambda: ca.displayDecks(whitelisted[:DISPLAY_DECKS])),
+            ("getCardFrequencies", numDecks, lambda: dv.getCardFrequencies(cards, decks, ca.SEARCH_IN_DEFAULT)),
+            ("parseDecklist", len(texts), parseDecklists),
+            ("extractDecklists", len(parsed), extractDecklists)]
+
+
+def runBenchmarks(sizes: list[int], dataDir: str, repeats: int, only: Optional[list[str]] = None) -> list[dict]:
+    propertiesPath = path.join(dataDir, "synthetic_card_properties.json")
+    if not path.isfile(propertiesPath):
+        with open(propertiesPath, "wb") as f:
+            f.write(json.dumps(synthetic_data.generateCardProperties()))
+
+    # Measure the computations themselves: no cached search results, synthetic card properties
+    ca.CARD_PROPERTIES_PATH = propertiesPath
+    ca.QUERY_CACHE_ENABLED = False
+
+    results = []
+    for size in sizes:
+        datasetPath = path.join(dataDir, f"synthetic_{size}.json")
+        if not path.isfile(datasetPath):
+            print(f"Generating {size} decks")
+            synthetic_data.writeDataset(datasetPath, size)
+        decks = ca.loadDataset(datasetPath)
+        ca.loadRollups(datasetPath)
+
+        for name, numDecks, run in scenarios(datasetPath, decks):
+            if only and name not in only:
+                continue
+            seconds, peak = measure(run, repeats)
+            result = {"scenario": name, "size": size, "decks": numDecks, "seconds": seconds, "peakBytes": peak,
+                      "decksPerSecond": numDecks / seconds if seconds > 0 else None}
+            results.append(result)
+            print(f"{name:<26} {size:>9} decks: {seconds:8.3f}s, peak {peak / 1024 ** 2:8.1f} MiB, {result['decksPerSecond'] or 0:12.0f} decks/s")
+    return results
+
+
+def currentCommit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compareResults(results: list[dict], previousPath: str) -> None:
+    with open(previousPath, "rb") as f:
+        previous = {(r["scenario"], r["size"]): r for r in json.loads(f.read())["results"]}
+
+    print(f"\nCompared to {previousPath} (time ratio, < 1 is faster):")
+    for result in results:
+        before = previous.get((result["scenario"], result["size"]))
+        if before is None or not before["seconds"]:
+            continue
+        print(f"{result['scenario']:<26} {result['size']:>9} decks: {result['seconds'] / before['seconds']:6.2f}x time, "
+              f"{result['peakBytes'] / max(before['peakBytes'], 1):6.2f}x peak memory")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("benchmark", description="e.g. python benchmark.py -sizes 10000 100000 -out results.json")
+    parser.add_argument("-sizes", nargs="*", type=int, help="Dataset sizes in decks. Default: 10000 100000 1000000")
+    parser.add_argument("-repeats", nargs="?", type=int, default=DEFAULT_REPEATS, help="Timed runs per scenario. Default: 3")
+    parser.add_argument("-only", nargs="*", help="Only run these scenarios, e.g. \"getDecks whitelist\" displayDecks")
+    parser.add_argument("-dataDir", nargs="?", help="Keep the generated datasets here to reuse them. Default: a temporary directory")
+    parser.add_argument("-out", nargs="?", default="benchmark_results.json", help="Where to save the results. Default: benchmark_results.json")
+    parser.add_argument("-compare", nargs="?", help="Results of a previous run to compare against")
+    args = parser.parse_args()
+
+    sizes = args.sizes or DEFAULT_SIZES
+    if args.dataDir is not None:
+        os.makedirs(args.dataDir, exist_ok=True)
+        results = runBenchmarks(sizes, args.dataDir, args.repeats, args.only)
+    else:
+        with tempfile.TemporaryDirectory() as dataDir:
+            results = runBenchmarks(sizes, dataDir, args.repeats, args.only)
+
+    report = {"commit": currentCommit(), "date": datetime.now().isoformat(timespec="seconds"), "python": sys.version.split()[0],
+              "platform": platform.platform(), "repeats": args.repeats, "results": results}
+    with open(args.out, "wb") as f:
+        f.write(json.dumps(report, option=json.OPT_INDENT_2))
+    print(f"Saved results to {args.out}")
+
+    if args.compare is not None:
+        compareResults(results, args.compare)
@@ -1,56 +1,250 @@
 import orjson as json
 from datetime import *
-from typing import Union, Optional
+from typing import Union, Optional, Iterator
+from itertools import chain, islice
 from os import path
+from collections import OrderedDict
+from collections.abc import Sequence
+import os
 import string
-import scraper
-
-DECK_ENTRY = dict[str, Union[str, dict[str, int]]]
+import sys
+import threading
+import numpy as np
+import deck_matrix
+import archetypes
+import columnar
+import compact_decks
+import cooccurrence
+import deck_index
+import dataset_version
+import partitions
+import profiling
+import query_cache
+import rollups
+import segment_log
+import utils
+
+DECK_ENTRY = dict[str, Union[str, dict[str, int]]] | compact_decks.Deck
 DATASET_CHUNK_TYPE = list[DECK_ENTRY]
-EVENT_TYPES = { "league": ["league", "gold", "daily"],
-                "scheduled": ["prelim", "challenge", "ptq", "championship", "qualifier", "playoff", "finals", "last-chance"]}
+EVENT_TYPES = utils.EVENT_TYPES
 SEARCH_IN_DEFAULT = ["main", "side"]
 CARD_PROPERTIES_PATH = "Data/card_properties.json"
 
+# Parsed datasets and card properties stay resident between queries (e.g. repeated GUI searches)
+# Entries are keyed by file path and dropped when the file's mtime or size changes
+DATASET_CACHE_LIMIT_BYTES = 2 * 1024 ** 3
+PARSED_BYTES_PER_FILE_BYTE = 2 # Rough size of loaded decks (see compact_decks.py) relative to the file they came from
+_fileCache: OrderedDict[str, tuple[tuple[int, int], int, any]] = OrderedDict()
+_cacheLock = threading.Lock() # Queries may run on worker threads (e.g. the GUI's), loads themselves are not serialized
+QUERY_CACHE_ENABLED = True # Reuse the results of identical searches, see query_cache.py
+GROUP_METRICS = ["any", "all", "copies"] # Decks running any / all of a card group's cards, or enough copies of them
+GROUP_MIN_COPIES_DEFAULT = 4
+PLAYED_WITH_MIN_DECKS = 5 # getPlayedWith leaves out pairs played together in fewer decks, their lift is mostly noise
+
+
+def loadDataset(dataset: str,
+                minDate: Optional[datetime.date] = None,
+                maxDate: Optional[datetime.date] = None,
+                cancelled: Optional[threading.Event] = None) -> DATASET_CHUNK_TYPE | columnar.ColumnarDataset:
+    """
+    minDate/maxDate are only a hint: partitioned datasets skip months outside them, other formats return every deck
+    Raises QueryCancelled if cancelled is set, checked before each month of a partitioned dataset
+    """
+    with profiling.span("loadDataset") as stage:
+        loaded = readDataset(dataset, minDate, maxDate, cancelled)
+        profiling.setDecksOut(stage, len(loaded))
+    return loaded
+
+
+def readDataset(dataset: str,
+                minDate: Optional[datetime.date] = None,
+                maxDate: Optional[datetime.date] = None,
+                cancelled: Optional[threading.Event] = None) -> DATASET_CHUNK_TYPE | columnar.ColumnarDataset:
+    # A columnar dataset is memory-mapped and materializes decks lazily, see columnar.py
+    # meta.json is rewritten last on conversion, so it versions the whole directory
+    if columnar.isColumnarDataset(dataset):
+        return cachedLoad(path.join(dataset, "meta.json"), lambda: columnar.openColumnarDataset(dataset), sizeEstimate=0)
+
+    if partitions.isPartitionedDataset(dataset):
+        months = []
+        for month in partitions.monthsInRange(dataset, minDate, maxDate):
+            checkCancelled(cancelled)
+            months.append(cachedLoad(partitions.partitionPath(dataset, month),
+                                     lambda: compact_decks.compactDecks(partitions.loadPartition(dataset, month))))
+        return compact_decks.DeckList(chain.from_iterable(months), parts=months)
 
-def loadDataset(dataset: str) -> DATASET_CHUNK_TYPE:
     # The dataset is a list of dictionaries, each of which represents 1 deck entry
-    with open(dataset, "r") as f:
+    # followed by any decks appended by the scraper since it was last compacted
+    # They are kept as compact decks, see compact_decks.py
+    return cachedLoad(dataset, lambda: compact_decks.compactDecks(segment_log.readTable(dataset, utils.deckKey)))
+
+
+def readJson(filePath: str) -> any:
+    with open(filePath, "rb") as f:
         return json.loads(f.read())
 
 
+def fileSignature(filePath: str) -> tuple[int, int, int, int]:
+    # Appended segments change the data without touching the file itself
+    if path.isfile(filePath):
+        stat = os.stat(filePath)
+        return (stat.st_mtime_ns, stat.st_size) + segment_log.segmentSignature(filePath)
+    return (0, 0) + segment_log.segmentSignature(filePath)
+
+
+def cachedLoad(filePath: str, load, sizeEstimate: Optional[int] = None) -> any:
+    """
+    Returns load() for filePath, reusing the previous result while the file is unchanged
+    The least recently used entries are evicted once the estimated size of all entries exceeds DATASET_CACHE_LIMIT_BYTES
+    Cached values are shared between callers and must not be modified
+    """
+    signature = fileSignature(filePath)
+    with _cacheLock:
+        cached = _fileCache.get(filePath)
+        if cached is not None and cached[0] == signature:
+            _fileCache.move_to_end(filePath)
+            return cached[2]
+
+    with profiling.span("parse " + path.basename(filePath)):
+        value = load()
+    if sizeEstimate is None:
+        segmentBytes = sum(path.getsize(segment) for segment in segment_log.segmentFiles(filePath))
+        sizeEstimate = (signature[1] + segmentBytes) * PARSED_BYTES_PER_FILE_BYTE
+
+    with _cacheLock:
+        _fileCache.pop(filePath, None)
+        if sizeEstimate <= DATASET_CACHE_LIMIT_BYTES:
+            _fileCache[filePath] = (signature, sizeEstimate, value)
+            while sum(entry[1] for entry in _fileCache.values()) > DATASET_CACHE_LIMIT_BYTES:
+                _fileCache.popitem(last=False)
+    return value
+
+
+def setDatasetCacheLimit(limitBytes: int) -> None:
+    global DATASET_CACHE_LIMIT_BYTES
+    DATASET_CACHE_LIMIT_BYTES = limitBytes
+    with _cacheLock:
+        while _fileCache and sum(entry[1] for entry in _fileCache.values()) > DATASET_CACHE_LIMIT_BYTES:
+            _fileCache.popitem(last=False)
+
+
+def clearDatasetCache() -> None:
+    with _cacheLock:
+        _fileCache.clear()
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+def checkCancelled(cancelled: Optional[threading.Event]) -> None:
+    if cancelled is not None and cancelled.is_set():
+        raise QueryCancelled()
+
+
 def displayDecks(decks: DATASET_CHUNK_TYPE | None) -> str:
+    return "".join(renderDecks(decks))
+
+
+def renderDecks(decks: DATASET_CHUNK_TYPE | None, start: int = 0, limit: Optional[int] = None) -> Iterator[str]:
+    """
+    Yields the text of each deck in decks, from the start-th (0-based) and at most limit of them
+    Decks are only read as they are rendered, so the first deck takes the same time however many decks match
+    """
     if decks is None:
         decks = []
 
     cardProperties = loadCardProperties(force=False)
 
-    output = ""
-
-    for deck in decks:
-        output += f"\n {deck['player']} {deck['url']}"
+    stop = None if limit is None else start + limit
+    for deck in islice(decks, start, stop):
+        yield renderDeck(deck, cardProperties)
+
+
+def renderDeck(deck: DECK_ENTRY, cardProperties: dict) -> str:
+    if isinstance(deck, compact_decks.Deck):
+        deck = deck.toDict()
+    lines = [f"\n {deck['player']} {deck['url']}"]
+    try:
+        main = sorted(deck['main'].keys(), key=lambda x: cardProperties[x]['cmc'])
+        side = sorted(deck['side'].keys(), key=lambda x: cardProperties[x]['cmc'])
+    except KeyError:
+        # The Data/card_properties.json dataset is out of date. In this case do not sort on cmc
+        print("Error: Card Properties is out of date. Please update it with 'python analyze.py -fprops'")
+        main = deck['main']
+        side = deck['side']
+
+    for card in main:
         try:
-            main = sorted(deck['main'].keys(), key=lambda x: cardProperties[x]['cmc'])
-            side = sorted(deck['side'].keys(), key=lambda x: cardProperties[x]['cmc'])
+            lines.append(f"\n{deck['main'][card]} {card} - {cardProperties[card]['manaCost']}")
         except KeyError:
-            # The Data/card_properties.json dataset is out of date. In this case do not sort on cmc
-            print("Error: Card Properties is out of date. Please update it with 'python analyze.py -fprops'")
-            main = deck['main']
-            side = deck['side']
-
-        for card in main:
-            try:
-                output += f"\n{deck['main'][card]} {card} - {cardProperties[card]['manaCost']}"
-            except KeyError:
-                output += f"\n{card} - error retrieving CMC or quantity"
-        output += "\n------ side ------"
-        for card in side:
-            try:
-                output += f"\n{deck['side'][card]} {card} - {cardProperties[card]['manaCost']}"
-            except KeyError:
-                output += f"\n{card} - error retrieving CMC or quantity"
-        output += "\n------ END OF DECK ------\n"
-    return output
+            lines.append(f"\n{card} - error retrieving CMC or quantity")
+    lines.append("\n------ side ------")
+    for card in side:
+        try:
+            lines.append(f"\n{deck['side'][card]} {card} - {cardProperties[card]['manaCost']}")
+        except KeyError:
+            lines.append(f"\n{card} - error retrieving CMC or quantity")
+    lines.append("\n------ END OF DECK ------\n")
+    return "".join(lines)
+
+
+class DeckSample(Sequence):
+    """
+    The decks matching a getDecks query, selected the first time they are accessed
+    query keeps the normalized search criteria, which lets aggregate-only consumers (getCardPrevalence,
+    data_visualization) answer from the dataset's rollups without selecting any deck, see rollups.py
+    """
+
+    def __init__(self, query: dict):
+        self.query = query
+        self.ids = None # Positions of the decks in loadDataset(dataset, minDate, maxDate), once selected
+        self._decks = None
+
+    @property
+    def decks(self) -> DATASET_CHUNK_TYPE | columnar.ColumnarSample:
+        return self.select()._decks
+
+    def __len__(self) -> int:
+        return len(self.decks)
+
+    def __getitem__(self, index):
+        return self.decks[index]
+
+    def __iter__(self):
+        return self.stream()
+
+    def stream(self, cancelled: Optional[threading.Event] = None) -> Iterator[DECK_ENTRY]:
+        """
+        Iterates over the decks, selecting them first if needed
+        Raises QueryCancelled if cancelled is set before they are selected
+        """
+        return iter(self.select(cancelled)._decks)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def select(self, cancelled: Optional[threading.Event] = None) -> "DeckSample":
+        """
+        Selects the decks now instead of on first access. Raises QueryCancelled if cancelled is set during the search
+        """
+        if self._decks is None:
+            loaded, self.ids = cachedSelectDeckIds(self.query, cancelled)
+            self._decks = decksAt(loaded, self.ids)
+        return self
+
+    def deckMatrix(self) -> deck_matrix.DeckMatrix:
+        return deck_matrix.deckMatrixOf(self.decks)
+
+    def deckMonths(self) -> np.ndarray:
+        return deck_matrix.deckMonthsOf(self.decks)
+
+    def hasDeckCriteria(self) -> bool:
+        # Criteria that depend on a deck's contents or player cannot be answered from monthly aggregates
+        return bool(self.query["blacklist"] or [w for w in self.query["whitelist"] if w] or self.query["player"]
+                    or self.query["archetype"])
 
 
 def getDecks(dataset: str,
@@ -60,10 +254,14 @@ def getDecks(dataset: str,
                minDate: Optional[datetime.date] = date(1900, 1, 1),
                maxDate: Optional[datetime.date] = date(2100, 1, 1),
                searchIn: Optional[list[str]] = None,
-               eventType: Optional[list[str]] = None) -> DATASET_CHUNK_TYPE:
+               eventType: Optional[list[str]] = None,
+               archetype: Optional[list[str]] = None) -> DeckSample:
     """
     Gathers all decks matching criteria
     Outputs them in the same format as they appear in the dataset
+    (for a columnar dataset, as a sequence that builds each deck when it is accessed)
+    The decks are only selected once the returned DeckSample is first accessed
+    archetype keeps the decks of the archetypes whose signature cards contain any of its terms, see archetypes.py
     """
 
     # Handle unspecified parameters instead of using default mutable parameters
@@ -83,34 +281,169 @@ def getDecks(dataset: str,
     else:
         eventType = [v.lower() for v in eventType]
 
-    # Faster to search string than search each element
-    matchableEvents = "@".join([("@".join(EVENT_TYPES[k])) for k in eventType]) 
-
-
-    dataset = loadDataset(dataset)
-    foundDecks = []
-
-    minDate = str(minDate)
-    maxDate = str(maxDate)
     if player:
         player = player.lower()
 
-    dataset = [deck for deck in dataset if minDate <= deck["date"] <= maxDate]
+    archetype = [v.lower() for v in archetype or []]
 
-    for decklist in dataset:
-        if player and player not in decklist["player"].lower():
-            continue
+    return DeckSample({"dataset": dataset, "whitelist": whitelist, "blacklist": blacklist, "player": player,
+                       "minDate": minDate, "maxDate": maxDate, "searchIn": searchIn, "eventType": eventType,
+                       "archetype": archetype})
 
-        event = decklist['url'].split("-")[1]
-        if event not in matchableEvents:
-            continue
 
-        if not shouldAcceptDeck(searchIn, decklist, whitelist, blacklist):
-            continue
-        
-        foundDecks.append(decklist)
-
-    return foundDecks
+def selectDeckIds(loaded: DATASET_CHUNK_TYPE | columnar.ColumnarDataset,
+                  whitelist: list[str],
+                  blacklist: list[str],
+                  player: str | None,
+                  minDate: datetime.date,
+                  maxDate: datetime.date,
+                  searchIn: list[str],
+                  eventType: list[str],
+                  cancelled: Optional[threading.Event] = None) -> list[int]:
+    """
+    Returns the positions in loaded (the output of loadDataset) of the matching decks
+    Raises QueryCancelled if cancelled is set before the search starts or while the search index is built
+    (its slow part, checked before indexing each month of a partitioned dataset)
+    """
+    checkCancelled(cancelled)
+    with profiling.span("select decks", len(loaded)) as stage:
+        index = searchIndexOf(loaded, cancelled)
+        checkCancelled(cancelled)
+        ids = getIndexedDeckIds(index, whitelist, blacklist, player, minDate, maxDate, searchIn,
+                                utils.eventCategoryMask(eventType)).tolist()
+        profiling.setDecksOut(stage, len(ids))
+    return ids
+
+def searchIndexOf(loaded: DATASET_CHUNK_TYPE | columnar.ColumnarDataset,
+                  cancelled: Optional[threading.Event] = None) -> columnar.ColumnarDataset | deck_index.DeckIndex:
+    # A columnar dataset is its own index
+    if isinstance(loaded, columnar.ColumnarDataset):
+        return loaded
+    with profiling.span("search index"):
+        return deck_index.indexOf(loaded, lambda: checkCancelled(cancelled))
+
+def decksAt(loaded: DATASET_CHUNK_TYPE | columnar.ColumnarDataset, ids: list[int]) -> DATASET_CHUNK_TYPE | columnar.ColumnarSample:
+    if isinstance(loaded, columnar.ColumnarDataset):
+        return columnar.ColumnarSample(loaded, np.array(ids, dtype=np.int64))
+    return [loaded[i] for i in ids]
+
+def ordinalRange(minDate: datetime.date, maxDate: datetime.date) -> tuple[int, int]:
+    # Dates may come as strings (e.g. from analyze.py), datetimes or dates
+    return (date.fromisoformat(str(minDate)[:10]).toordinal(), date.fromisoformat(str(maxDate)[:10]).toordinal())
+
+def archetypeDeckIds(dataset: str,
+                     minDate: datetime.date,
+                     maxDate: datetime.date,
+                     ids: list[int] | np.ndarray,
+                     terms: list[str]) -> np.ndarray:
+    """
+    Keeps the ids (positions in loadDataset(dataset, minDate, maxDate)) of the decks in an archetype matching terms
+    """
+    with profiling.span("archetype filter", len(ids)) as stage:
+        saved = loadArchetypes(dataset)
+        ids = np.asarray(ids, dtype=np.int64)
+        labels = archetypes.labelsInRange(saved, dataset, minDate, maxDate)[ids]
+        ids = ids[np.isin(labels, archetypes.matchingArchetypes(saved, terms))]
+        profiling.setDecksOut(stage, len(ids))
+    return ids
+
+def queryCacheKey(query: dict) -> str:
+    return query_cache.queryKey(query_cache.normalizeQuery(query))
+
+def selectQueryIds(query: dict,
+                   loaded: DATASET_CHUNK_TYPE | columnar.ColumnarDataset,
+                   cancelled: Optional[threading.Event] = None) -> list[int]:
+    """
+    selectDeckIds for a getDecks query, loaded being loadDataset(dataset, minDate, maxDate)
+    """
+    criteria = {k: v for k, v in query.items() if k not in ["dataset", "archetype"]}
+    ids = selectDeckIds(loaded, cancelled=cancelled, **criteria)
+    if query["archetype"]:
+        ids = archetypeDeckIds(query["dataset"], query["minDate"], query["maxDate"], ids, query["archetype"]).tolist()
+    return ids
+
+def cachedSelectDeckIds(query: dict,
+                        cancelled: Optional[threading.Event] = None) -> tuple[DATASET_CHUNK_TYPE | columnar.ColumnarDataset, list[int]]:
+    """
+    Returns loadDataset(dataset, minDate, maxDate) and the positions of the decks matching query in it,
+    selected through the query cache (see query_cache.py)
+    """
+    dataset = query["dataset"]
+    version, loaded = dataset_version.loadVersioned(dataset, lambda: loadDataset(dataset, query["minDate"], query["maxDate"], cancelled))
+    if not QUERY_CACHE_ENABLED:
+        return loaded, selectQueryIds(query, loaded, cancelled)
+
+    key = queryCacheKey(query)
+    with profiling.span("query cache lookup") as stage:
+        entry = query_cache.loadEntry(dataset, key, version)
+        if entry is not None and entry["ids"] is not None:
+            profiling.setDecksOut(stage, len(entry["ids"]))
+    if entry is not None and entry["ids"] is not None:
+        return loaded, entry["ids"]
+
+    ids = selectQueryIds(query, loaded, cancelled)
+    entry = dict(entry or newQueryCacheEntry(query, version), ids=ids)
+    query_cache.saveEntry(dataset, key, entry)
+    return loaded, ids
+
+def newQueryCacheEntry(query: dict, version: list[int]) -> dict:
+    return {"dataset": version, "query": query_cache.normalizeQuery(query), "ids": None, "prevalence": {}}
+
+def getIndexedDeckIds(dataset: columnar.ColumnarDataset | deck_index.DeckIndex,
+                      whitelist: list[str],
+                      blacklist: list[str],
+                      player: str | None,
+                      minDate: datetime.date,
+                      maxDate: datetime.date,
+                      searchIn: list[str],
+                      eventMask: int,
+                      termPostings: Optional[dict] = None,
+                      deckRange: Optional[tuple[int, int]] = None) -> np.ndarray:
+    """
+    Returns the sorted ids of the matching decks of a columnar dataset or of a loaded dataset's deck_index
+    Whitelist/blacklist terms and the player are resolved to card/player ids through trigram indexes, then applied
+    as set operations on the card -> deck and player -> deck postings, so the remaining criteria only see candidate decks
+    Partial names (e.g. "bolt") match every card containing them
+    termPostings caches the decks matching each term, searches of the same dataset can share it (see batch_queries.py)
+    deckRange only searches the decks with ids in [start, end), e.g. a shard of the dataset (see sharded_queries.py)
+    """
+    if termPostings is None:
+        termPostings = {}
+    def postingsFor(term: str) -> np.ndarray:
+        key = (term, tuple(searchIn), deckRange)
+        if key not in termPostings:
+            cardIds = dataset.cardIndex.search(term)
+            found = [dataset.postings(location, cardIds, deckRange) for location in searchIn]
+            termPostings[key] = found[0] if len(found) == 1 else np.union1d(*found) if found else np.empty(0, dtype=np.int32)
+        return termPostings[key]
+
+    # An empty term is contained in every deck
+    if "" in blacklist:
+        return np.empty(0, dtype=np.int64)
+    whitelist = [w for w in set(whitelist) if w != ""]
+
+    with profiling.span("card and player terms", len(dataset)) as stage:
+        candidates = None
+        if player:
+            candidates = dataset.playerDecks(dataset.playerIndex.search(player), deckRange)
+        for ids in sorted((postingsFor(w) for w in whitelist), key=len):
+            candidates = ids if candidates is None else np.intersect1d(candidates, ids, assume_unique=True)
+        if candidates is None:
+            start, end = deckRange if deckRange is not None else (0, len(dataset))
+            candidates = np.arange(start, end, dtype=np.int64)
+
+        for b in set(blacklist):
+            candidates = np.setdiff1d(candidates, postingsFor(b), assume_unique=True)
+        profiling.setDecksOut(stage, len(candidates))
+
+    with profiling.span("date and event filter", len(candidates)) as stage:
+        minDate, maxDate = ordinalRange(minDate, maxDate)
+        dates = dataset.column("date")[candidates]
+        accepted = (dates >= minDate) & (dates <= maxDate)
+        accepted &= dataset.eventHits(eventMask, candidates)
+        candidates = candidates[accepted]
+        profiling.setDecksOut(stage, len(candidates))
+    return candidates
 
 def shouldAcceptDeck(searchIn: list[str], decklist: DECK_ENTRY, whitelist: list[str], blacklist: list[str]) -> bool:
     """
@@ -120,7 +453,10 @@ def shouldAcceptDeck(searchIn: list[str], decklist: DECK_ENTRY, whitelist: list[
     remainingWhitelist = whitelist.copy()
     leftToMatch = len(whitelist)
     blacklist = set(blacklist)
-    cards = "@".join(["@".join(decklist[location].keys()) for location in searchIn])
+    if isinstance(decklist, compact_decks.Deck):
+        cards = "@".join(["@".join(decklist.cardNames(location)) for location in searchIn])
+    else:
+        cards = "@".join(["@".join(decklist[location].keys()) for location in searchIn])
 
     for b in blacklist:
         if b in cards:
@@ -134,80 +470,377 @@ def shouldAcceptDeck(searchIn: list[str], decklist: DECK_ENTRY, whitelist: list[
                 
     return leftToMatch == 0
 
-def getCardPrevalence(sample: str, showTypes: Optional[list[str]] = None) -> string:
+def getEvents(sample) -> list[dict]:
+    """
+    Groups the decks of sample (e.g. from getDecks) by event
+    Returns the metadata of each event (see utils.eventMetadata) with its url and # of decks in sample, in the order
+    the events first appear
+    """
+    if isinstance(sample, DeckSample):
+        sample = sample.decks
+    if isinstance(sample, columnar.ColumnarSample):
+        dataset = sample.dataset
+        urlIds, first, counts = np.unique(dataset.column("url")[sample.indices], return_index=True, return_counts=True)
+        events = dataset.events
+        return [dict(utils.eventMetadata(dataset.urls[urlIds[i]]) if events is None else events[urlIds[i]],
+                     url=dataset.urls[urlIds[i]], decks=int(counts[i])) for i in np.argsort(first, kind="stable")]
+
+    decksPerEvent = {}
+    for deck in sample:
+        decksPerEvent.setdefault(deck["url"], [deck, 0])[1] += 1
+    return [dict(deck.get("event") or utils.eventMetadata(url), url=url, decks=count) for url, (deck, count) in decksPerEvent.items()]
+
+def formatEvents(events: list[dict]) -> str:
+    lines = [f"{'date':<12}{'event':<24}{'size':>6}{'decks':>7}  url"]
+    for event in events:
+        size = "" if event["size"] is None else event["size"]
+        lines.append(f"{event['date']:<12}{event['kind']:<24}{size:>6}{event['decks']:>7}  {event['url']}")
+    return "\n".join(lines)
+
+def getCardPrevalence(sample, showTypes: Optional[list[str]] = None, showArchetypes: bool = False) -> string:
     """
     Calculates the prevalence of each card across all decks in sample and lists them in this order
     sample parameter should be passed from getDecks()
     Output looks like:
     Most prevalent card - # copies in sample - % of decks it appears in - Average # played in decks it appeared in
+    With showArchetypes, the archetypes of the sample's decks are listed after the cards (see getArchetypes)
     """
-    
+    with profiling.span("getCardPrevalence"):
+        output = cachedCardPrevalence(sample, showTypes)
+        if showArchetypes and isinstance(sample, DeckSample) and len(sample) > 0:
+            output += formatArchetypes(getArchetypes(sample), len(sample))
+        return output
+
+def cachedCardPrevalence(sample, showTypes: Optional[list[str]] = None) -> str:
+    # Identical searches reuse their output while the dataset and the card properties are unchanged
+    if QUERY_CACHE_ENABLED and isinstance(sample, DeckSample):
+        version = dataset_version.datasetVersion(sample.query["dataset"])
+        output = savedPrevalence(sample, showTypes, version)
+        if output is None:
+            output = computeCardPrevalence(sample, showTypes)
+            savePrevalence(sample, showTypes, version, output)
+        return output
+
+    return computeCardPrevalence(sample, showTypes)
+
+def prevalenceOutputKey(showTypes: Optional[list[str]]) -> str:
+    return ",".join(sorted(string.capwords(t) for t in showTypes or [])) + "@" + str(fileSignature(CARD_PROPERTIES_PATH))
+
+def savedPrevalence(sample: DeckSample, showTypes: Optional[list[str]], version: list[int]) -> Optional[str]:
+    entry = query_cache.loadEntry(sample.query["dataset"], queryCacheKey(sample.query), version)
+    if entry is None:
+        return None
+    return entry["prevalence"].get(prevalenceOutputKey(showTypes))
+
+def savePrevalence(sample: DeckSample, showTypes: Optional[list[str]], version: list[int], output: str) -> None:
+    dataset = sample.query["dataset"]
+    key = queryCacheKey(sample.query)
+    # Re-read in case selecting the decks just saved them to the entry
+    entry = query_cache.loadEntry(dataset, key, version) or newQueryCacheEntry(sample.query, version)
+    query_cache.saveEntry(dataset, key, dict(entry, prevalence=dict(entry["prevalence"], **{prevalenceOutputKey(showTypes): output})))
+
+def computeCardPrevalence(sample, showTypes: Optional[list[str]] = None) -> str:
+    # Searches without deck-level criteria are summed from the monthly rollups instead of scanning the decks
+    rows = rollupRows(sample)
+    if rows is not None:
+        numDecks = sum(bucket["decks"] for _, bucket in rows)
+        if numDecks == 0:
+            return "No decks in sample"
+        with profiling.span("sum rollups", numDecks):
+            cards, decksContaining, totalCopies, firstAppearance = sumRollupRows(rows)
+        return formatPrevalence(cards, numDecks, decksContaining, totalCopies, firstAppearance, showTypes)
+
     if not sample:
         return "No decks in sample"
 
+    numDecks = len(sample)
+    with profiling.span("deck matrix", numDecks):
+        matrix = deck_matrix.deckMatrixOf(sample)
+    return matrixPrevalence(matrix, showTypes)
+
+def matrixPrevalence(matrix: deck_matrix.DeckMatrix, showTypes: Optional[list[str]] = None) -> str:
+    """
+    getCardPrevalence of the decks of a deck matrix
+    """
+    numDecks = matrix.numDecks
+    if numDecks == 0:
+        return "No decks in sample"
+    with profiling.span("aggregate", numDecks):
+        decksContaining = {location: matrix.decksContaining(location) for location in SEARCH_IN_DEFAULT}
+        totalCopies = {location: matrix.totalCopies(location) for location in SEARCH_IN_DEFAULT}
+        firstAppearance = {location: matrix.firstAppearance(location) for location in SEARCH_IN_DEFAULT}
+    return formatPrevalence(matrix.cards, numDecks, decksContaining, totalCopies, firstAppearance, showTypes)
+
+def formatPrevalence(cards: list[str],
+                     numDecks: int,
+                     decksContaining: dict[str, np.ndarray],
+                     totalCopies: dict[str, np.ndarray],
+                     firstAppearance: dict[str, np.ndarray],
+                     showTypes: Optional[list[str]] = None) -> str:
+    """
+    Lays out per-card counts (arrays indexed like cards, per location) as described in getCardPrevalence
+    """
+    with profiling.span("format output"):
+        return layoutPrevalence(cards, numDecks, decksContaining, totalCopies, firstAppearance, showTypes)
+
+def layoutPrevalence(cards: list[str],
+                     numDecks: int,
+                     decksContaining: dict[str, np.ndarray],
+                     totalCopies: dict[str, np.ndarray],
+                     firstAppearance: dict[str, np.ndarray],
+                     showTypes: Optional[list[str]] = None) -> str:
     cardProperties = loadCardProperties(force=False)
     
     if showTypes:
             showTypes = [string.capwords(t) for t in showTypes]
 
-    # Use this list of all cards in cardProperties to make sure an invalid key is never used.
+    # Use this mask of all cards in cardProperties to make sure an invalid key is never used.
     # This would only occur if the Scryfall API was briefly out of date when a new set is released. 
-    # Failing to check against this will destroy the dictionary comprehensions below  
-    recognizeableCards = cardProperties.keys()
+    recognized = np.array([card in cardProperties for card in cards], dtype=bool)
+    for card in np.array(cards, dtype=object)[~recognized]:
+        print(f"Error: unable to identify {card}. Please update card_properties.json.")
 
-    numDecks = len(sample)
-    prevalenceDict = {"main": {}, "side": {}}
-    maxCardLen = 0
-    output = ""
-    unrecoginzableCards = [] # Track cards that cannot match cardProperties so they do not get logged multiple times
-
-    for location in SEARCH_IN_DEFAULT:
-        locDict = prevalenceDict[location]
-        for deck in sample:
-            for card in deck[location]:
-                if card not in recognizeableCards:
-                    if card not in unrecoginzableCards:
-                        unrecoginzableCards.append(card)
-                        print(f"Error: unable to identify {card}. Please update card_properties.json.")
-                    continue
-                if card in locDict:
-                    locDict[card][0] +=  1
-                    locDict[card][1] += deck[location][card]
-                else:
-                    locDict[card] = [1, deck[location][card]]
-        
-        longestCardName = max(locDict.keys(), key=lambda x: len(cardProperties[x]["displayName"]))
-        maxCardLen = max(maxCardLen, len(cardProperties[longestCardName]["displayName"]))
+    nameLengths = np.array([len(cardProperties[card]["displayName"]) if known else 0 for card, known in zip(cards, recognized)],
+                           dtype=np.int64)
+    keep = recognized
+    if showTypes:
+        keep = keep & deck_matrix.cardTypeMask(cards, cardProperties, showTypes)
 
-    maxQuantityLen = len(str(max(prevalenceDict["main"].values(), key=lambda x: x[0])[0]))            
+    # Column widths are based on every recognized card, before filtering by type
+    maxCardLen = max([int(nameLengths[(decksContaining[location] > 0) & recognized].max(initial=0)) for location in SEARCH_IN_DEFAULT])
+    maxQuantityLen = len(str(int(decksContaining["main"][recognized].max(initial=0))))
+    output = ""
 
     # Add maindeck or sideboard to output
     for location in SEARCH_IN_DEFAULT:
         if location == "side":
             output += "\n\n---SIDEBOARD---\n"
 
-        if showTypes:
-            def keep(name):
-                for type in showTypes:
-                    if type in cardProperties[name]["type"]:
-                        return True
-                return False
-            prevalenceDict[location] = {k:v for k,v in prevalenceDict[location].items() if (keep(k))}
-        
+        # Most played first, ties in the order the cards first appear in the sample
+        shown = np.flatnonzero((decksContaining[location] > 0) & keep)
+        shown = shown[np.argsort(firstAppearance[location][shown], kind="stable")]
+        shown = shown[np.argsort(-decksContaining[location][shown], kind="stable")]
 
-        quantityDescending = sorted(prevalenceDict[location].items(), key=lambda x: x[1][0], reverse=True)
+        deckCounts = decksContaining[location][shown]
+        percentages = deckCounts / numDecks * 100
+        averages = totalCopies[location][shown] / deckCounts
 
-        for card, quantity in quantityDescending:
-            percentage = ((quantity[0] / numDecks) * 100)
-            avg = (quantity[1] / quantity[0])
-            output += f"\n{cardProperties[card]['displayName']:<{maxCardLen}} | {quantity[0]:>{maxQuantityLen}} decks | {percentage:>5.2f}% | {avg:.2f} avg"
+        for card, count, percentage, avg in zip(shown.tolist(), deckCounts.tolist(), percentages.tolist(), averages.tolist()):
+            output += f"\n{cardProperties[cards[card]]['displayName']:<{maxCardLen}} | {count:>{maxQuantityLen}} decks | {percentage:>5.2f}% | {avg:.2f} avg"
 
     return output
 
+def getGroupMetrics(sample,
+                    groups: dict[str, list[str]],
+                    searchIn: Optional[list[str]] = None,
+                    minCopies: int = GROUP_MIN_COPIES_DEFAULT) -> tuple[list[str], np.ndarray, dict[str, dict[str, np.ndarray]]]:
+    """
+    Counts, per month, the decks of sample running any of the cards of each group (e.g. card_groups.CARD_GROUP_DICT),
+    all of them, or at least minCopies copies of them in total
+    Returns (months, # of decks per month, {group: {"any" / "all" / "copies": # of those decks per month}})
+    """
+    if searchIn is None:
+        searchIn = SEARCH_IN_DEFAULT
+    names = list(groups)
+
+    # Months come first as they select the decks of a DeckSample
+    months, monthIds = np.unique(deck_matrix.deckMonthsOf(sample), return_inverse=True)
+    monthIds = monthIds.ravel()
+    with profiling.span("deck matrix", len(monthIds)):
+        matrix = deck_matrix.deckMatrixOf(sample)
+
+    with profiling.span("group metrics", matrix.numDecks):
+        masks = deck_matrix.cardGroupMasks(matrix.cards, [groups[name] for name in names])
+        numGroupCards, groupCopies = matrix.groupCounts(masks, searchIn)
+        groupSizes = np.array([len(deck_matrix.groupCardNames(groups[name])) for name in names], dtype=np.int64)
+        matches = {"any": numGroupCards > 0,
+                   "all": numGroupCards >= groupSizes[:, None],
+                   "copies": groupCopies >= minCopies}
+
+        monthly = {}
+        for metric, decks in matches.items():
+            rows, deckIds = np.nonzero(decks)
+            counts = np.bincount(rows * len(months) + monthIds[deckIds], minlength=len(names) * len(months))
+            monthly[metric] = counts.reshape(len(names), len(months))
+
+    return months.tolist(), np.bincount(monthIds, minlength=len(months)), \
+           {name: {metric: monthly[metric][row] for metric in GROUP_METRICS} for row, name in enumerate(names)}
+
+def getGroupPrevalence(sample,
+                       groups: dict[str, list[str]],
+                       searchIn: Optional[list[str]] = None,
+                       minCopies: int = GROUP_MIN_COPIES_DEFAULT) -> str:
+    """
+    Lays out getGroupMetrics as a table per group. Output looks like:
+    month - # decks - % of decks with any of the group's cards - % with all of them - % with at least minCopies copies
+    """
+    with profiling.span("getGroupPrevalence"):
+        months, numDecks, metrics = getGroupMetrics(sample, groups, searchIn, minCopies)
+    return formatGroupPrevalence(groups, minCopies, months, numDecks, metrics)
+
+def formatGroupPrevalence(groups: dict[str, list[str]],
+                          minCopies: int,
+                          months: list[str],
+                          numDecks: np.ndarray,
+                          metrics: dict[str, dict[str, np.ndarray]]) -> str:
+    # Lays out the output of getGroupMetrics as described in getGroupPrevalence
+    if not months:
+        return "No decks in sample"
+
+    output = ""
+    for name, counts in metrics.items():
+        output += f"\n{name} ({len(deck_matrix.groupCardNames(groups[name]))} cards)\n"
+        output += f"{'month':<8}{'decks':>8}{'any':>9}{'all':>9}{str(minCopies) + '+ copies':>12}"
+        rows = [(month, numDecks[i], [counts[metric][i] for metric in GROUP_METRICS]) for i, month in enumerate(months)]
+        rows.append(("total", numDecks.sum(), [counts[metric].sum() for metric in GROUP_METRICS]))
+        for month, decks, (withAny, withAll, withCopies) in rows:
+            output += f"\n{month:<8}{decks:>8}{withAny / decks:>9.2%}{withAll / decks:>9.2%}{withCopies / decks:>12.2%}"
+        output += "\n"
+    return output
+
+def getArchetypes(sample: DeckSample) -> list[dict]:
+    """
+    Counts the decks of each archetype in a getDecks sample (see archetypes.py), most played first
+    Decks in no archetype come last, as archetype -1
+    """
+    query = sample.select().query
+    saved = loadArchetypes(query["dataset"])
+    labels = archetypes.labelsInRange(saved, query["dataset"], query["minDate"], query["maxDate"])
+    counts = np.bincount(labels[np.asarray(sample.ids, dtype=np.int64)] + 1, minlength=len(saved["archetypes"]) + 1)
+
+    found = [{"archetype": i, "signature": saved["archetypes"][i]["signature"], "decks": int(counts[i + 1])}
+             for i in np.argsort(-counts[1:], kind="stable").tolist() if counts[i + 1] > 0]
+    if counts[0] > 0:
+        found.append({"archetype": -1, "signature": [], "decks": int(counts[0])})
+    return found
+
+def formatArchetypes(found: list[dict], numDecks: int) -> str:
+    cardProperties = loadCardProperties(force=False)
+    displayName = lambda card: cardProperties[card]["displayName"] if card in cardProperties else string.capwords(card)
+    names = [" / ".join(displayName(card) for card in archetype["signature"]) or "Other" for archetype in found]
+    maxNameLen = max(len(name) for name in names)
+    maxQuantityLen = len(str(max(archetype["decks"] for archetype in found)))
+
+    output = "\n\n---ARCHETYPES---\n"
+    for name, archetype in zip(names, found):
+        output += f"\n{name:<{maxNameLen}} | {archetype['decks']:>{maxQuantityLen}} decks | {archetype['decks'] / numDecks * 100:>5.2f}%"
+    return output
+
+def getCooccurrence(sample, searchIn: Optional[list[str]] = None) -> cooccurrence.CooccurrenceMatrix:
+    """
+    Returns the card x card co-occurrence matrix of sample (see cooccurrence.py)
+    The matrix of a getDecks sample is built once per dataset version, search (including its dates) and searchIn
+    """
+    if searchIn is None:
+        searchIn = SEARCH_IN_DEFAULT
+
+    cached = QUERY_CACHE_ENABLED and isinstance(sample, DeckSample)
+    if cached:
+        dataset = sample.query["dataset"]
+        key = queryCacheKey(sample.query)
+        version = dataset_version.datasetVersion(dataset)
+        with profiling.span("cooccurrence cache lookup"):
+            found = cooccurrence.loadCached(dataset, key, searchIn, version)
+        if found is not None:
+            return found
+
+    with profiling.span("deck matrix", len(sample)):
+        matrix = deck_matrix.deckMatrixOf(sample)
+    with profiling.span("cooccurrence", matrix.numDecks):
+        built = cooccurrence.buildCooccurrence(matrix, searchIn)
+    if cached:
+        cooccurrence.save(dataset, key, searchIn, version, built)
+    return built
+
+def getPlayedWith(sample,
+                  card: str,
+                  k: int = 20,
+                  by: str = "decks",
+                  searchIn: Optional[list[str]] = None) -> str:
+    """
+    Lists the k cards most played with card (or the most played card containing it, e.g. "bolt") in sample,
+    by # of decks running both or by lift (see cooccurrence.CooccurrenceMatrix.topPartners). Output looks like:
+    Card - # decks running both - % of card's decks that run it - lift
+    """
+    with profiling.span("getPlayedWith"):
+        matrix = getCooccurrence(sample, searchIn)
+        cardId = matrix.findCard(card)
+        if cardId is None:
+            return f"No decks in sample with {card}"
+        partners = matrix.topPartners(cardId, k, by, PLAYED_WITH_MIN_DECKS)
+
+    cardProperties = loadCardProperties(force=False)
+    displayName = lambda card: cardProperties[card]["displayName"] if card in cardProperties else string.capwords(card)
+    output = f"Played with {displayName(matrix.cards[cardId])} ({matrix.decksWith[cardId]} decks)\n"
+    if not partners:
+        return output
+    maxCardLen = max(len(displayName(partner["card"])) for partner in partners)
+    maxQuantityLen = len(str(max(partner["decks"] for partner in partners)))
+    for partner in partners:
+        output += f"\n{displayName(partner['card']):<{maxCardLen}} | {partner['decks']:>{maxQuantityLen}} decks | " \
+                  f"{partner['share'] * 100:>6.2f}% | {partner['lift']:.2f} lift"
+    return output
+
+def rollupRows(sample) -> Optional[list[tuple[str, dict]]]:
+    """
+    Returns the rollup rows (month, event bucket) covering a getDecks sample, or None if the sample has to be scanned:
+    it has deck-level criteria, was not made by getDecks, or its date range cuts through a month
+    Rollups missing or out of date are rebuilt from the whole dataset first
+    """
+    if not isinstance(sample, DeckSample) or sample.hasDeckCriteria():
+        return None
+    query = sample.query
+    with profiling.span("rollups"):
+        return rollups.rowsInRange(loadRollups(query["dataset"]), query["minDate"], query["maxDate"], query["eventType"])
+
+def sumRollupRows(rows: list[tuple[str, dict]]) -> tuple[list[str], dict, dict, dict]:
+    """
+    Adds up rollup rows into per-card arrays, in the form formatPrevalence takes
+    """
+    cards = list(dict.fromkeys(card for _, bucket in rows for location in SEARCH_IN_DEFAULT for card in bucket[location]))
+    vocabulary = {card: i for i, card in enumerate(cards)}
+    decksContaining = {}
+    totalCopies = {}
+    firstAppearance = {}
+    for location in SEARCH_IN_DEFAULT:
+        decksContaining[location] = np.zeros(len(cards), dtype=np.int64)
+        totalCopies[location] = np.zeros(len(cards), dtype=np.int64)
+        firstAppearance[location] = np.full(len(cards), np.iinfo(np.int64).max, dtype=np.int64)
+        for _, bucket in rows:
+            counts = bucket[location]
+            if not counts:
+                continue
+            ids = np.fromiter(map(vocabulary.__getitem__, counts), dtype=np.int64, count=len(counts))
+            entries = np.array(list(counts.values()), dtype=np.int64)
+            decksContaining[location][ids] += entries[:, 0]
+            totalCopies[location][ids] += entries[:, 1]
+            np.minimum.at(firstAppearance[location], ids, entries[:, 2])
+    return cards, decksContaining, totalCopies, firstAppearance
+
+def loadRollups(dataset: str) -> dict:
+    rollupFile = rollups.rollupPath(dataset)
+    if path.isfile(rollupFile):
+        saved = cachedLoad(rollupFile, lambda: readJson(rollupFile))
+        if rollups.isCurrent(saved, dataset):
+            return saved
+    # Progress goes to stderr so it never lands in the middle of piped query output
+    print(f"Building rollups for {dataset}", file=sys.stderr)
+    return rollups.buildRollups(dataset, loadDataset(dataset))
+
+def loadArchetypes(dataset: str) -> dict:
+    archetypeFile = archetypes.archetypePath(dataset)
+    if path.isfile(archetypeFile):
+        saved = cachedLoad(archetypeFile, lambda: archetypes.readArchetypes(archetypeFile))
+        if archetypes.isCurrent(saved, dataset):
+            return saved
+    print(f"Building archetypes for {dataset}", file=sys.stderr)
+    return archetypes.buildArchetypes(dataset, loadDataset(dataset))
+
 def loadCardProperties(force):
     if not path.isfile(CARD_PROPERTIES_PATH) or force:
         print("Updating Card Properties dataset")
+        # The scraper pulls in selenium, so it is only imported when an update is actually needed
+        import scraper
         scraper.updateCardPropertiesDataset()
 
-    with open(CARD_PROPERTIES_PATH, "rb") as f:
-        return json.loads(f.read())
+    return cachedLoad(CARD_PROPERTIES_PATH, lambda: readJson(CARD_PROPERTIES_PATH))
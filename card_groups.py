@@ -19,7 +19,7 @@ MODERN_METAGAME_9_2025 = ["Ocelot Pride", "Leyline of the Guildpact", "Goblin Ch
 
 
 
-MODERN_EXILE_REMOVAL = ["Path to Exile", "Leyline Binding", "Celestial Purge", "Prismatic Ending", "Dispatch"
+MODERN_EXILE_REMOVAL = ["Path to Exile", "Leyline Binding", "Celestial Purge", "Prismatic Ending", "Dispatch",
                         "Vanishing Verse", "March of Otherworldly Light"]
 
 MODERN_WRATHS = ["Supreme Verdict", "Damn", "Wrath of the Skies", "Kozilek's Return", "Pyroclasm", "Hurkyl's Recall", "Whipflare"]
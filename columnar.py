@@ -0,0 +1,403 @@
+import orjson as json
+import numpy as np
+import argparse
+import os
+from os import path
+from datetime import *
+from typing import Optional, Iterator
+import deck_matrix
+import utils
+from trigram_index import TrigramIndex
+
+'''
+Columnar dataset layout (a directory, by convention named <dataset>.cols):
+    meta.json                           number of decks and format version
+    cards.json / players.json / urls.json    string dictionaries, indexed by the integer id columns
+    events.json                         event metadata of each url (utils.eventMetadata), aligned with urls.json
+    date.npy                            deck date as a proleptic ordinal (date.toordinal())
+    player.npy / url.npy                id into players.json / urls.json
+    main_offsets.npy / side_offsets.npy CSR offsets, deck i owns entries offsets[i]:offsets[i + 1]
+    main_cards.npy / side_cards.npy     id into cards.json
+    main_counts.npy / side_counts.npy   quantity of that card in the deck
+    main_postings_offsets.npy / side_postings_offsets.npy
+    main_postings.npy / side_postings.npy
+                                        inverted index, card c appears in the sorted deck ids postings[offsets[c]:offsets[c + 1]]
+
+Every .npy column is opened with mmap_mode="r" the first time it is used, so a query only pages in the columns it touches
+'''
+
+COLUMNAR_VERSION = 1
+COLUMNAR_EXTENSION = ".cols"
+LOCATIONS = ["main", "side"]
+
+
+def isColumnarDataset(dataset: str) -> bool:
+    return path.isfile(path.join(dataset, "meta.json"))
+
+
+def defaultColumnarPath(jsonPath: str) -> str:
+    return path.splitext(jsonPath)[0] + COLUMNAR_EXTENSION
+
+
+class ColumnarDataset:
+    """
+    Read-only, memory-mapped view of a columnar dataset
+    Behaves like the list of deck dictionaries returned by the json loader: len(), indexing and iteration
+    materialize decks on demand
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(path.join(directory, "meta.json"), "rb") as f:
+            self.meta = json.loads(f.read())
+        if self.meta["version"] != COLUMNAR_VERSION:
+            raise ValueError(f"Unsupported columnar dataset version {self.meta['version']} in {directory}")
+        self._columns = {}
+        self._strings = {}
+        self._indexes = {}
+
+    def column(self, name: str) -> np.ndarray:
+        if name not in self._columns:
+            self._columns[name] = np.load(path.join(self.directory, f"{name}.npy"), mmap_mode="r")
+        return self._columns[name]
+
+    def strings(self, name: str) -> list[str]:
+        if name not in self._strings:
+            with open(path.join(self.directory, f"{name}.json"), "rb") as f:
+                self._strings[name] = json.loads(f.read())
+        return self._strings[name]
+
+    @property
+    def cards(self) -> list[str]:
+        return self.strings("cards")
+
+    @property
+    def players(self) -> list[str]:
+        return self.strings("players")
+
+    @property
+    def urls(self) -> list[str]:
+        return self.strings("urls")
+
+    @property
+    def events(self) -> Optional[list[dict]]:
+        # Datasets converted before events were stored have no events.json, see addEventMetadata
+        if not path.isfile(path.join(self.directory, "events.json")):
+            return None
+        return self.strings("events")
+
+    @property
+    def eventCodes(self) -> np.ndarray:
+        """
+        utils.eventCategoryCode of every url
+        """
+        if "eventCodes" not in self._columns:
+            events = self.events
+            if events is None:
+                codes = [utils.eventCategoryCode(url) for url in self.urls]
+            else:
+                codes = [event["categories"] for event in events]
+            self._columns["eventCodes"] = np.array(codes, dtype=np.int64)
+        return self._columns["eventCodes"]
+
+    @property
+    def cardIndex(self) -> TrigramIndex:
+        if "cards" not in self._indexes:
+            self._indexes["cards"] = TrigramIndex(self.cards)
+        return self._indexes["cards"]
+
+    @property
+    def playerIndex(self) -> TrigramIndex:
+        if "players" not in self._indexes:
+            self._indexes["players"] = TrigramIndex(self.players, lower=True)
+        return self._indexes["players"]
+
+    def playerDecks(self, playerIds: np.ndarray, deckRange: Optional[tuple[int, int]] = None) -> np.ndarray:
+        """
+        Returns the sorted ids of the decks of any of playerIds (within deckRange, [start, end) deck ids, if given)
+        """
+        if "playerPostings" not in self._indexes:
+            self._indexes["playerPostings"] = ValuePostings(self.column("player"))
+        return self._indexes["playerPostings"].decksOf(playerIds, deckRange)
+
+    def eventHits(self, eventMask: int, candidates: np.ndarray) -> np.ndarray:
+        return ((self.eventCodes & eventMask) != 0)[self.column("url")[candidates]]
+
+    def __len__(self) -> int:
+        return self.meta["numDecks"]
+
+    def __getitem__(self, i: int) -> dict:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("deck index out of range")
+        return self.materialize([i])[0]
+
+    def __iter__(self) -> Iterator[dict]:
+        # Materialize in blocks so iteration does not pay per-deck column lookups
+        blockSize = 4096
+        for start in range(0, len(self), blockSize):
+            yield from self.materialize(range(start, min(start + blockSize, len(self))))
+
+    def locationHits(self, location: str, cardIds: np.ndarray) -> np.ndarray:
+        """
+        Returns a boolean array with one entry per deck: whether the deck has any of cardIds in location
+        """
+        offsets = self.column(f"{location}_offsets")
+        hit = np.isin(self.column(f"{location}_cards"), cardIds)
+        hitsBefore = np.concatenate(([0], np.cumsum(hit, dtype=np.int64)))
+        return hitsBefore[offsets[1:]] > hitsBefore[offsets[:-1]]
+
+    def hasPostings(self) -> bool:
+        return all(path.isfile(path.join(self.directory, f"{location}_postings.npy")) for location in LOCATIONS)
+
+    def postings(self, location: str, cardIds: np.ndarray, deckRange: Optional[tuple[int, int]] = None) -> np.ndarray:
+        """
+        Returns the sorted ids of every deck with any of cardIds in location (within deckRange, [start, end) deck ids, if given)
+        """
+        if not self.hasPostings():
+            # Directories converted before the index existed fall back to scanning the card column
+            return idsInRange(np.flatnonzero(self.locationHits(location, cardIds)), deckRange)
+
+        offsets = self.column(f"{location}_postings_offsets")
+        postings = self.column(f"{location}_postings")
+        lists = [idsInRange(postings[offsets[c]:offsets[c + 1]], deckRange) for c in cardIds]
+        if len(lists) == 1:
+            return np.asarray(lists[0])
+        return np.unique(np.concatenate(lists)) if lists else np.empty(0, dtype=np.int32)
+
+    def deckMatrix(self, indices: Optional[np.ndarray] = None) -> deck_matrix.DeckMatrix:
+        """
+        Slices the rows of the given decks (every deck by default) out of the CSR columns without building any dictionaries
+        Column ids are the ids of the dataset's card dictionary
+        """
+        if indices is None:
+            indices = np.arange(len(self), dtype=np.int64)
+        offsets = {}
+        cardIds = {}
+        counts = {}
+        for location in LOCATIONS:
+            allOffsets = self.column(f"{location}_offsets")
+            starts = allOffsets[indices]
+            lengths = allOffsets[indices + 1] - starts
+            locationOffsets = np.zeros(len(indices) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=locationOffsets[1:])
+            positions = np.repeat(starts - locationOffsets[:-1], lengths) + np.arange(locationOffsets[-1], dtype=np.int64)
+            offsets[location] = locationOffsets
+            cardIds[location] = np.asarray(self.column(f"{location}_cards")[positions])
+            counts[location] = np.asarray(self.column(f"{location}_counts")[positions], dtype=np.int32)
+        return deck_matrix.DeckMatrix(self.cards, len(indices), offsets, cardIds, counts)
+
+    def materialize(self, indices) -> list[dict]:
+        """
+        Converts the given deck indices into deck dictionaries in the same format as the json dataset
+        """
+        cards = self.cards
+        players = self.players
+        urls = self.urls
+        events = self.events
+        dates = self.column("date")
+        playerIds = self.column("player")
+        urlIds = self.column("url")
+        located = [(location, self.column(f"{location}_offsets"), self.column(f"{location}_cards"),
+                    self.column(f"{location}_counts")) for location in LOCATIONS]
+
+        decks = []
+        for i in indices:
+            deck = {"player": players[playerIds[i]], "url": urls[urlIds[i]],
+                    "date": date.fromordinal(int(dates[i])).isoformat()}
+            if events is not None:
+                deck["event"] = events[urlIds[i]]
+            for location, offsets, cardIds, counts in located:
+                start, end = offsets[i], offsets[i + 1]
+                deck[location] = {cards[c]: int(q) for c, q in zip(cardIds[start:end].tolist(), counts[start:end].tolist())}
+            decks.append(deck)
+        return decks
+
+
+class ColumnarSample:
+    """
+    Subset of a columnar dataset, e.g. the decks matching a getDecks search
+    Decks are only materialized when indexed or iterated, aggregations can use deckMatrix() instead
+    """
+
+    def __init__(self, dataset: ColumnarDataset, indices: np.ndarray):
+        self.dataset = dataset
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return ColumnarSample(self.dataset, self.indices[i])
+        return self.dataset.materialize([self.indices[i]])[0]
+
+    def __iter__(self) -> Iterator[dict]:
+        blockSize = 4096
+        for start in range(0, len(self), blockSize):
+            yield from self.dataset.materialize(self.indices[start:start + blockSize].tolist())
+
+    def deckMatrix(self) -> deck_matrix.DeckMatrix:
+        return self.dataset.deckMatrix(self.indices)
+
+    def deckMonths(self) -> np.ndarray:
+        # Dates are stored as ordinals, so only the distinct ones are converted
+        ordinals, inverse = np.unique(self.dataset.column("date")[self.indices], return_inverse=True)
+        months = np.array([date.fromordinal(int(o)).isoformat()[:7] for o in ordinals], dtype=str)
+        return months[inverse]
+
+
+def openColumnarDataset(dataset: str) -> ColumnarDataset:
+    return ColumnarDataset(dataset)
+
+
+def convertJsonToColumnar(jsonPath: str, outDir: Optional[str] = None) -> str:
+    """
+    Converts a json dataset (list of deck dictionaries) into the columnar format
+    Returns the directory the columnar dataset was written to
+    """
+    if outDir is None:
+        outDir = defaultColumnarPath(jsonPath)
+
+    with open(jsonPath, "rb") as f:
+        decks = json.loads(f.read())
+
+    writeColumnar(decks, outDir)
+    return outDir
+
+
+def writeColumnar(decks: list[dict], outDir: str) -> None:
+    os.makedirs(outDir, exist_ok=True)
+
+    cardIds = {}
+    playerIds = {}
+    urlIds = {}
+    events = []
+
+    def intern(table: dict, value: str) -> int:
+        i = table.get(value)
+        if i is None:
+            i = table[value] = len(table)
+        return i
+
+    numDecks = len(decks)
+    columns = {"date": np.empty(numDecks, dtype=np.int32),
+               "player": np.empty(numDecks, dtype=np.int32),
+               "url": np.empty(numDecks, dtype=np.int32)}
+    entries = {location: ([], []) for location in LOCATIONS}
+    offsets = {location: np.zeros(numDecks + 1, dtype=np.int64) for location in LOCATIONS}
+
+    for i, deck in enumerate(decks):
+        columns["date"][i] = date.fromisoformat(deck["date"]).toordinal()
+        columns["player"][i] = intern(playerIds, deck["player"])
+        columns["url"][i] = intern(urlIds, deck["url"])
+        if len(events) < len(urlIds):
+            events.append(deck.get("event") or utils.eventMetadata(deck["url"]))
+        for location in LOCATIONS:
+            ids, counts = entries[location]
+            for card, quantity in deck[location].items():
+                ids.append(intern(cardIds, card))
+                counts.append(quantity)
+            offsets[location][i + 1] = len(ids)
+
+    for location in LOCATIONS:
+        ids, counts = entries[location]
+        columns[f"{location}_offsets"] = offsets[location]
+        columns[f"{location}_cards"] = np.array(ids, dtype=np.int32)
+        columns[f"{location}_counts"] = np.array(counts, dtype=np.uint16)
+
+    for location in LOCATIONS:
+        postingsOffsets, postings = buildPostings(columns[f"{location}_offsets"], columns[f"{location}_cards"], len(cardIds))
+        columns[f"{location}_postings_offsets"] = postingsOffsets
+        columns[f"{location}_postings"] = postings
+
+    for name, values in columns.items():
+        np.save(path.join(outDir, f"{name}.npy"), values)
+
+    for name, table in [("cards", cardIds), ("players", playerIds), ("urls", urlIds)]:
+        with open(path.join(outDir, f"{name}.json"), "wb") as f:
+            f.write(json.dumps(list(table.keys())))
+    with open(path.join(outDir, "events.json"), "wb") as f:
+        f.write(json.dumps(events))
+
+    # meta.json is written last so a partially written directory is never mistaken for a dataset
+    with open(path.join(outDir, "meta.json"), "wb") as f:
+        f.write(json.dumps({"version": COLUMNAR_VERSION, "numDecks": numDecks}))
+
+
+def buildPostings(offsets: np.ndarray, cardIds: np.ndarray, numCards: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Inverts one location's CSR deck -> card arrays into card -> sorted deck id postings
+    """
+    deckIds = np.repeat(np.arange(len(offsets) - 1, dtype=np.int32), np.diff(offsets))
+    # A stable sort keeps the deck ids of each card in ascending order
+    order = np.argsort(cardIds, kind="stable")
+    postingsOffsets = np.zeros(numCards + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cardIds, minlength=numCards), out=postingsOffsets[1:])
+    return postingsOffsets, deckIds[order]
+
+
+class ValuePostings:
+    """
+    Deck ids grouped by the value of an id column (e.g. player), so the decks with a few values are found by binary search
+    """
+
+    def __init__(self, column: np.ndarray):
+        self.order = np.argsort(column, kind="stable")
+        self.sortedValues = np.asarray(column)[self.order]
+
+    def decksOf(self, values: np.ndarray, deckRange: Optional[tuple[int, int]] = None) -> np.ndarray:
+        starts = np.searchsorted(self.sortedValues, values, side="left")
+        ends = np.searchsorted(self.sortedValues, values, side="right")
+        # The decks of each value are in id order, as the sort is stable
+        found = [idsInRange(self.order[start:end], deckRange) for start, end in zip(starts.tolist(), ends.tolist()) if end > start]
+        return np.sort(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+
+def idsInRange(ids: np.ndarray, deckRange: Optional[tuple[int, int]]) -> np.ndarray:
+    # The sorted ids within [start, end), found by binary search
+    if deckRange is None:
+        return ids
+    start, end = np.searchsorted(ids, deckRange)
+    return ids[start:end]
+
+
+def indexColumnar(directory: str) -> None:
+    """
+    Adds the card -> deck postings to a columnar dataset written before they were part of the format
+    """
+    dataset = ColumnarDataset(directory)
+    for location in LOCATIONS:
+        postingsOffsets, postings = buildPostings(np.asarray(dataset.column(f"{location}_offsets")),
+                                                  np.asarray(dataset.column(f"{location}_cards")), len(dataset.cards))
+        np.save(path.join(directory, f"{location}_postings_offsets.npy"), postingsOffsets)
+        np.save(path.join(directory, f"{location}_postings.npy"), postings)
+
+
+def addEventMetadata(directory: str) -> None:
+    """
+    Adds the event metadata of every url to a columnar dataset written before it was part of the format, or refreshes it
+    """
+    dataset = ColumnarDataset(directory)
+    with open(path.join(directory, "events.json"), "wb") as f:
+        f.write(json.dumps([utils.eventMetadata(url) for url in dataset.urls]))
+    # Rewriting meta.json changes the dataset's version, so results cached with the previous events are recomputed
+    with open(path.join(directory, "meta.json"), "wb") as f:
+        f.write(json.dumps(dataset.meta))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("columnar")
+    parser.add_argument("dataset", help="json dataset to convert. e.g. 'Data/modern.json'")
+    parser.add_argument("-out", nargs="?", help="output directory. Default: the dataset path with a .cols extension")
+    parser.add_argument("-index", action=argparse.BooleanOptionalAction, help="Only (re)build the card index of an existing columnar dataset")
+    args = parser.parse_args()
+
+    if args.index:
+        indexColumnar(args.dataset)
+        print(f"Indexed {args.dataset}")
+        quit()
+
+    outDir = convertJsonToColumnar(args.dataset, args.out)
+    print(f"Saved columnar dataset to {outDir}")
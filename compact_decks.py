@@ -0,0 +1,192 @@
+import threading
+from array import array
+from datetime import date
+from typing import Iterable, Optional
+import utils
+
+'''
+Compact in-memory decks. Loaded datasets keep every deck as a Deck instead of the dictionary stored in the json:
+card names, players and urls are interned to integer ids in process-wide vocabularies, the date is kept as an ordinal
+and the cards of both locations share one array:
+    Deck.data = [main card ids..., side card ids..., main quantities..., side quantities...]
+    Deck.numMain = # of main deck cards
+    Deck.eventCode = utils.eventCategoryCode of the deck's event, so event filters are a bitwise and
+
+The event metadata stored with decks (see utils.eventMetadata) is shared by every deck of the event, in EVENTS by url id
+Decks of datasets scraped before it was stored (see migrate_events.py) have none
+
+Decks still read like the dictionaries they came from (deck["main"], deck["date"], dict(deck)...), which builds the
+values on every access. That is meant for the output edge (rendering, saving); aggregations read the ids directly,
+see deck_matrix.buildCompactDeckMatrix
+'''
+
+CARD_ID_TYPE = "I"
+KEYS = ["player", "url", "date", "main", "side"]
+
+
+class Vocabulary:
+    """
+    Interns strings to consecutive integer ids. Ids are never reused, so they stay valid for the whole process
+    """
+
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.names: list[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def intern(self, name: str) -> int:
+        id = self.ids.get(name)
+        if id is None:
+            with self._lock:
+                id = self.ids.get(name)
+                if id is None:
+                    id = len(self.names)
+                    self.names.append(name)
+                    self.ids[name] = id
+        return id
+
+
+CARDS = Vocabulary()
+PLAYERS = Vocabulary()
+URLS = Vocabulary()
+EVENTS: dict[int, dict] = {}
+_eventCodes: dict[int, int] = {} # Of urls without stored metadata
+
+
+class Deck:
+    __slots__ = ("playerId", "urlId", "ordinal", "numMain", "data", "eventCode")
+
+    def __init__(self, playerId: int, urlId: int, ordinal: int, numMain: int, data: array, eventCode: int):
+        self.playerId = playerId
+        self.urlId = urlId
+        self.ordinal = ordinal
+        self.numMain = numMain
+        self.data = data
+        self.eventCode = eventCode
+
+    @property
+    def numCards(self) -> int:
+        return len(self.data) // 2
+
+    @property
+    def player(self) -> str:
+        return PLAYERS.names[self.playerId]
+
+    @property
+    def url(self) -> str:
+        return URLS.names[self.urlId]
+
+    @property
+    def date(self) -> str:
+        return date.fromordinal(self.ordinal).isoformat()
+
+    def cardIds(self, location: str) -> array:
+        if location == "main":
+            return self.data[:self.numMain]
+        return self.data[self.numMain:self.numCards]
+
+    def cardNames(self, location: str) -> list[str]:
+        names = CARDS.names
+        return [names[id] for id in self.cardIds(location)]
+
+    def cards(self, location: str) -> dict[str, int]:
+        """
+        Returns {card: quantity} for location, in the order of the original deck entry
+        """
+        numCards = self.numCards
+        if location == "main":
+            quantities = self.data[numCards:numCards + self.numMain]
+        else:
+            quantities = self.data[numCards + self.numMain:]
+        return dict(zip(self.cardNames(location), quantities))
+
+    def __getitem__(self, key: str):
+        if key == "main" or key == "side":
+            return self.cards(key)
+        if key == "player":
+            return self.player
+        if key == "url":
+            return self.url
+        if key == "date":
+            return self.date
+        if key == "event" and self.urlId in EVENTS:
+            return EVENTS[self.urlId]
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self else default
+
+    def keys(self) -> list[str]:
+        return KEYS + ["event"] if self.urlId in EVENTS else KEYS
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys()
+
+    def toDict(self) -> dict:
+        return {key: self[key] for key in self.keys()}
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Deck):
+            return (self.playerId, self.urlId, self.ordinal, self.numMain, self.data) == \
+                   (other.playerId, other.urlId, other.ordinal, other.numMain, other.data)
+        if isinstance(other, dict):
+            return self.toDict() == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"Deck({self.toDict()})"
+
+
+def compactDeck(deck: dict, ordinals: Optional[dict[str, int]] = None) -> Deck:
+    """
+    ordinals caches the ordinal of date strings already seen, decks of an event share their date
+    """
+    main = deck["main"]
+    side = deck["side"]
+    intern = CARDS.intern
+    data = array(CARD_ID_TYPE, [intern(card) for card in main])
+    data.extend([intern(card) for card in side])
+    data.extend(main.values())
+    data.extend(side.values())
+
+    deckDate = str(deck["date"])[:10]
+    ordinal = None if ordinals is None else ordinals.get(deckDate)
+    if ordinal is None:
+        ordinal = date.fromisoformat(deckDate).toordinal()
+        if ordinals is not None:
+            ordinals[deckDate] = ordinal
+
+    urlId = URLS.intern(deck["url"])
+    event = deck.get("event")
+    if event is None:
+        eventCode = _eventCodes.get(urlId)
+        if eventCode is None:
+            eventCode = _eventCodes[urlId] = utils.eventCategoryCode(deck["url"])
+    else:
+        eventCode = EVENTS.setdefault(urlId, event)["categories"]
+    return Deck(PLAYERS.intern(deck["player"]), urlId, ordinal, len(main), data, eventCode)
+
+
+class DeckList(list):
+    """
+    The decks of a loaded dataset, and the search index built for them the first time they are searched (see deck_index.py)
+    A list made of other loaded lists (e.g. the months of a partitioned dataset) keeps them as its parts
+    """
+
+    def __init__(self, decks: Iterable[Deck] = (), parts: Optional[list["DeckList"]] = None):
+        super().__init__(decks)
+        self.parts = parts
+        self.index = None
+
+
+def compactDecks(decks: Iterable[dict]) -> DeckList:
+    ordinals = {}
+    return DeckList(deck if isinstance(deck, Deck) else compactDeck(deck, ordinals) for deck in decks)
+
+
+def isCompactSample(sample) -> bool:
+    # Samples are homogeneous: every deck of a loaded dataset is converted
+    return isinstance(sample, list) and len(sample) > 0 and isinstance(sample[0], Deck)
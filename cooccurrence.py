@@ -0,0 +1,178 @@
+import io
+import threading
+import numpy as np
+from os import path
+from collections import OrderedDict
+from typing import Optional
+import deck_matrix
+import query_cache
+
+'''
+Card x card co-occurrence of a sample of decks: how many decks run each pair of cards, kept sparse (only pairs seen together)
+and symmetric in CSR form, so the partners of a card are one row:
+    cards           names of the cards in the sample, the row/column ids
+    decksWith       # of decks running each card
+    offsets         card i's partners are partners[offsets[i]:offsets[i + 1]], with the # of decks running both in counts
+It is the product of the sample's binary deck x card matrix with its transpose, computed from the card pairs of each deck.
+A card counts once per deck whether it is in the main, the side or both (of the searched locations)
+
+Matrices of getDecks searches are cached in memory and next to the search cache (see query_cache.py), per dataset version,
+search criteria (including the date window) and locations:
+    <dataset>_queries/<key>.<locations>.cooccurrence.npz
+'''
+
+PAIR_BLOCK = 2 ** 22 # Card pairs generated at once, bounds the memory of a build
+MEMORY_ENTRIES = 8
+SORT_KEYS = ["decks", "lift"]
+
+_memory: OrderedDict[str, tuple[list[int], "CooccurrenceMatrix"]] = OrderedDict()
+_memoryLock = threading.Lock()
+
+
+class CooccurrenceMatrix:
+    def __init__(self, cards: list[str], numDecks: int, decksWith: np.ndarray, offsets: np.ndarray, partners: np.ndarray,
+                 counts: np.ndarray):
+        self.cards = cards
+        self.numDecks = numDecks
+        self.decksWith = decksWith
+        self.offsets = offsets
+        self.partners = partners
+        self.counts = counts
+        self.ids = {card: i for i, card in enumerate(cards)}
+
+    def row(self, card: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the ids of the cards played with card and the # of decks running both
+        """
+        return self.partners[self.offsets[card]:self.offsets[card + 1]], self.counts[self.offsets[card]:self.offsets[card + 1]]
+
+    def topPartners(self, card: int, k: int = 20, by: str = "decks", minDecks: int = 1) -> list[dict]:
+        """
+        Returns the k cards most played with card, by # of decks running both or by lift: how much more often they are played
+        together than if they were independent (P(both) / (P(card) P(partner))). Pairs in fewer than minDecks decks are left out
+        """
+        partners, together = self.row(card)
+        kept = together >= minDecks
+        partners = partners[kept]
+        together = together[kept]
+        lift = together * self.numDecks / (self.decksWith[card] * self.decksWith[partners])
+        scores = together if by == "decks" else lift
+
+        # Highest scores first, ties by # of decks together then by card id
+        top = np.lexsort((partners, -together, -scores))[:k]
+        return [{"card": self.cards[partner], "decks": count, "share": count / int(self.decksWith[card]), "lift": value}
+                for partner, count, value in zip(partners[top].tolist(), together[top].tolist(), lift[top].tolist())]
+
+    def findCard(self, term: str) -> Optional[int]:
+        """
+        Returns the id of the card named term, or else of the most played card containing it (e.g. "bolt")
+        """
+        term = term.lower()
+        if term in self.ids:
+            return self.ids[term]
+        matches = [i for i, card in enumerate(self.cards) if term in card]
+        if not matches:
+            return None
+        return max(matches, key=lambda i: (self.decksWith[i], -i))
+
+
+def buildCooccurrence(matrix: deck_matrix.DeckMatrix, searchIn: list[str]) -> CooccurrenceMatrix:
+    """
+    Counts the decks of matrix running each pair of cards in searchIn
+    """
+    numCards = max(matrix.numCards, 1)
+    # Distinct (deck, card) entries, sorted by deck then card
+    entries = np.unique(np.concatenate([matrix.deckIds(location).astype(np.int64) * numCards + matrix.cardIds[location]
+                                        for location in searchIn]))
+    decks, cards = np.divmod(entries, numCards)
+    # Only cards of the sample get a row, ids keep the vocabulary's order so each deck's cards stay sorted
+    present, cards = np.unique(cards, return_inverse=True)
+    cards = cards.ravel()
+    numPresent = len(present)
+    decksWith = np.bincount(cards, minlength=numPresent)
+
+    # Pair each entry with the entries after it in its deck, so each pair of cards is generated once per deck (lower id first)
+    deckEnds = np.cumsum(np.bincount(decks, minlength=matrix.numDecks))
+    positions = np.arange(len(entries), dtype=np.int64)
+    after = deckEnds[decks] - positions - 1
+    pairEnds = np.cumsum(after)
+    numPairs = int(pairEnds[-1]) if len(entries) else 0
+    bounds = [0] + np.searchsorted(pairEnds, np.arange(PAIR_BLOCK, numPairs, PAIR_BLOCK)).tolist() + [len(entries)]
+
+    keys = []
+    counts = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        numAfter = after[start:end]
+        first = np.repeat(positions[start:end], numAfter)
+        firstStarts = np.cumsum(numAfter) - numAfter
+        second = first + 1 + np.arange(len(first), dtype=np.int64) - np.repeat(firstStarts, numAfter)
+        blockKeys, blockCounts = np.unique(cards[first].astype(np.int64) * numPresent + cards[second], return_counts=True)
+        keys.append(blockKeys)
+        counts.append(blockCounts)
+
+    # Pairs seen in several blocks are added up
+    keys, inverse = np.unique(np.concatenate(keys) if keys else np.empty(0, dtype=np.int64), return_inverse=True)
+    pairCounts = np.bincount(inverse.ravel(), weights=np.concatenate(counts) if counts else None, minlength=len(keys))
+    lower, higher = np.divmod(keys, max(numPresent, 1))
+
+    # Both directions, sorted by row then column
+    rows = np.concatenate([lower, higher])
+    columns = np.concatenate([higher, lower])
+    order = np.lexsort((columns, rows))
+    offsets = np.zeros(numPresent + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=numPresent), out=offsets[1:])
+    return CooccurrenceMatrix([matrix.cards[card] for card in present.tolist()], matrix.numDecks, decksWith, offsets,
+                              columns[order].astype(np.int32), np.concatenate([pairCounts, pairCounts])[order].astype(np.int64))
+
+
+def cachePath(dataset: str, key: str, searchIn: list[str]) -> str:
+    return path.join(query_cache.cacheDir(dataset), f"{key}.{'+'.join(sorted(searchIn))}.cooccurrence.npz")
+
+
+def loadCached(dataset: str, key: str, searchIn: list[str], version: list[int]) -> Optional[CooccurrenceMatrix]:
+    """
+    Returns the cached matrix of a search (key, see query_cache.queryKey) if it was built from this version of dataset
+    """
+    filePath = cachePath(dataset, key, searchIn)
+    with _memoryLock:
+        if filePath in _memory:
+            _memory.move_to_end(filePath)
+            entryVersion, cooccurrence = _memory[filePath]
+            if entryVersion == version:
+                return cooccurrence
+
+    if not path.isfile(filePath):
+        return None
+    try:
+        with np.load(filePath) as saved:
+            current = saved["version"].tolist() == version
+            if current:
+                cooccurrence = CooccurrenceMatrix(saved["cards"].tolist(), int(saved["numDecks"]), saved["decksWith"],
+                                                  saved["offsets"], saved["partners"], saved["counts"])
+    except (OSError, ValueError, KeyError):
+        # Corrupt or from another layout, it is rebuilt
+        return None
+    if not current:
+        query_cache.removeFile(filePath)
+        return None
+    query_cache.touch(filePath)
+    remember(filePath, version, cooccurrence)
+    return cooccurrence
+
+
+def save(dataset: str, key: str, searchIn: list[str], version: list[int], cooccurrence: CooccurrenceMatrix) -> None:
+    filePath = cachePath(dataset, key, searchIn)
+    remember(filePath, version, cooccurrence)
+    content = io.BytesIO()
+    np.savez(content, version=np.array(version, dtype=np.int64), cards=np.array(cooccurrence.cards, dtype=str),
+             numDecks=cooccurrence.numDecks, decksWith=cooccurrence.decksWith, offsets=cooccurrence.offsets,
+             partners=cooccurrence.partners, counts=cooccurrence.counts)
+    query_cache.saveFile(dataset, filePath, content.getvalue())
+
+
+def remember(filePath: str, version: list[int], cooccurrence: CooccurrenceMatrix) -> None:
+    with _memoryLock:
+        _memory[filePath] = (version, cooccurrence)
+        _memory.move_to_end(filePath)
+        while len(_memory) > MEMORY_ENTRIES:
+            _memory.popitem(last=False)
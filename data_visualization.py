@@ -1,83 +1,189 @@
 import orjson as json
-import matplotlib.pyplot as plt
 import numpy
-from matplotlib.ticker import AutoMinorLocator, MultipleLocator
 import numpy as np
 from datetime import *
 from typing import Union, Optional
 import card_groups
 import card_analyzer as ca
+import deck_matrix
 import utils
 
 def getNumDecksByMonth(consideredDecks: ca.DATASET_CHUNK_TYPE,
                         dates: Optional[list[str]] = None) -> dict[str: int]:
     # Returns a dictionary with (k,v) = (month, total # of decks in consideredDecks) for each month represented in consideredDecks
+    # Months are 'YYYY-MM', the format of deck dates
 
-    deckDates = sorted([deck['date'][:7] for deck in consideredDecks])
+    months, numDecks = np.unique(deck_matrix.deckMonthsOf(consideredDecks), return_counts=True)
+    numDecks = dict(zip(months.tolist(), numDecks.tolist()))
     if dates == None:
-        start = deckDates[0]
-        end = deckDates[-1]
-        dates = utils.getDatesBetweenMonths(start, end)
-
-    numDecks = {date: 0 for date in dates}
-    for date in dates:
-        numDecks[date] = deckDates.count(date)
-
+        if not numDecks:
+            return {}
+        dates = utils.getDatesBetweenMonths(min(numDecks), max(numDecks))
+
+    dates = [date.replace("/", "-") for date in dates]
+    return {date: numDecks.get(date, 0) for date in dates}
+
+
+def monthStarts(months: list[str]) -> numpy.ndarray:
+    # Use datetime-based buckets for a cleaner x-axis
+    return np.array([datetime(year=int(k[0:4]), day=1, month=int(k[5:7])) for k in months])
+
+
+def getCardFrequencies(cards: list[str],
+                       consideredDecks: ca.DATASET_CHUNK_TYPE,
+                       searchIn: list[str]) -> dict[str, tuple[numpy.ndarray, numpy.ndarray]]:
+    """
+    Returns, for every card, the fraction of each month's decks in the sample that run it (months where none do are left out)
+    """
+    cards = list(dict.fromkeys(cards))
+    return cardFrequenciesOf(cards, *getCardMonthlyCounts(cards, consideredDecks, searchIn))
+
+
+def getCardMonthlyCounts(cards: list[str],
+                         consideredDecks: ca.DATASET_CHUNK_TYPE,
+                         searchIn: list[str]) -> tuple[list[str], numpy.ndarray, numpy.ndarray]:
+    """
+    Returns (months, # of decks per month, # of decks running each card per month, one row per card) of the sample
+    The decks are bucketed into months once and every card's monthly counts come from a single bincount
+    """
+    months, monthIds = np.unique(deck_matrix.deckMonthsOf(consideredDecks), return_inverse=True)
+    totals = np.bincount(monthIds, minlength=len(months))
+    matrix = deck_matrix.deckMatrixOf(consideredDecks)
+
+    # Column of the sample's card vocabulary -> index in cards, -1 for cards that were not requested
+    vocabulary = {card: i for i, card in enumerate(matrix.cards)}
+    requested = np.full(matrix.numCards, -1, dtype=np.int64)
+    for i, card in enumerate(cards):
+        if card in vocabulary:
+            requested[vocabulary[card]] = i
+
+    # (requested card, deck) pairs, made unique so a deck running a card in the main and the side counts once
+    pairs = [np.empty(0, dtype=np.int64)]
+    for location in searchIn:
+        which = requested[matrix.cardIds[location]]
+        hit = which >= 0
+        pairs.append(which[hit] * matrix.numDecks + matrix.deckIds(location)[hit])
+    cardIndex, deckIndex = np.divmod(np.unique(np.concatenate(pairs)), max(matrix.numDecks, 1))
+
+    monthly = np.bincount(cardIndex * len(months) + monthIds[deckIndex], minlength=len(cards) * len(months))
+    return months.tolist(), totals, monthly.reshape(len(cards), len(months))
+
+
+def cardFrequenciesOf(cards: list[str],
+                      months: list[str],
+                      totals: numpy.ndarray,
+                      monthly: numpy.ndarray) -> dict[str, tuple[numpy.ndarray, numpy.ndarray]]:
+    # The getCardFrequencies series of getCardMonthlyCounts
+    x = monthStarts(months)
+    frequencies = {}
+    for card, counts in zip(cards, monthly):
+        present = counts > 0
+        frequencies[card] = x[present], counts[present] / totals[present]
+    return frequencies
+
+
+def getGroupFrequencies(groups: dict[str, list[str]],
+                        consideredDecks: ca.DATASET_CHUNK_TYPE,
+                        searchIn: list[str] | None = None,
+                        metric: str = "any",
+                        minCopies: int = ca.GROUP_MIN_COPIES_DEFAULT) -> dict[str, tuple[numpy.ndarray, numpy.ndarray]]:
+    """
+    Returns, for every card group, the fraction of each month's decks in the sample that match it by metric
+    ("any" / "all" of its cards, or at least minCopies "copies", see ca.getGroupMetrics). Months where none do are left out
+    Every group is counted in a single pass over the sample's deck matrix
+    """
+    months, totals, metrics = ca.getGroupMetrics(consideredDecks, groups, searchIn, minCopies)
+    x = monthStarts(months)
+    frequencies = {}
+    for name, counts in metrics.items():
+        present = counts[metric] > 0
+        frequencies[name] = x[present], counts[metric][present] / totals[present]
+    return frequencies
+
+
+def getRollupDecksByMonth(rows: list[tuple[str, dict]]) -> dict[str: int]:
+    # Same as getNumDecksByMonth, summed from rollup rows (see card_analyzer.rollupRows)
+    numDecks = {}
+    for month, bucket in rows:
+        numDecks[month] = numDecks.get(month, 0) + bucket["decks"]
     return numDecks
 
 
-def getCardFrequency(card: str,
-                  consideredDecks: ca.DATASET_CHUNK_TYPE,
-                  totalDecksPerMonth: dict[str: int],
-                  searchIn: list[str]) -> tuple[numpy.ndarray, numpy.ndarray]:
-    # Returns the frequency of decks in the sample that include the given card
-
-    start = min(consideredDecks, key=lambda x: x['date'])['date'][:7]
-    end = max(consideredDecks, key=lambda x: x['date'])['date'][:7]
-    dates = utils.getDatesBetweenMonths(start, end)
-    cardFreqDict = {date: 0 for date in dates}
-
-    for deck in consideredDecks:
-        date = deck['date'][:7] # Exclude days
-        if "main" in searchIn and card in deck['main']:
-            cardFreqDict[date] += 1
-            continue
+def getRollupCardFrequencies(cards: list[str],
+                             rows: list[tuple[str, dict]],
+                             searchIn: list[str]) -> dict[str, tuple[numpy.ndarray, numpy.ndarray]]:
+    # Same as getCardFrequencies, summed from rollup rows instead of counted deck by deck
 
-        if "side" in searchIn and card in deck['side']:
-            cardFreqDict[date] += 1
+    # "any" counts decks running the card in either location, so no deck is counted twice
+    if "main" in searchIn and "side" in searchIn:
+        counts = lambda bucket, card: bucket["any"].get(card, 0)
+    elif "main" in searchIn:
+        counts = lambda bucket, card: bucket["main"].get(card, [0])[0]
+    else:
+        counts = lambda bucket, card: bucket["side"].get(card, [0])[0]
 
-    cardFreqDict = {date: num for date, num in cardFreqDict.items() if num > 0} # Remove months not in sample
+    totalDecksPerMonth = getRollupDecksByMonth(rows)
+    months = sorted(totalDecksPerMonth)
+    monthly = {card: dict.fromkeys(months, 0) for card in cards}
+    for month, bucket in rows:
+        for card in monthly:
+            monthly[card][month] += counts(bucket, card)
 
-    # replace total # of cards with % of all decks
-    for date, numDecksPlaying in cardFreqDict.items():
-        cardFreqDict[date] = numDecksPlaying / totalDecksPerMonth[date]
-
-    # Use datetime-based buckets for a cleaner  x-axis
-    x = np.array([datetime(year=int(k[0:4]), day=1, month=int(k[5:7])) for k in cardFreqDict.keys()])
-    y = np.array(list(cardFreqDict.values()))
-    return x, y
+    frequencies = {}
+    for card, cardFreqDict in monthly.items():
+        cardFreqDict = {date: num / totalDecksPerMonth[date] for date, num in cardFreqDict.items() if num > 0}
+        frequencies[card] = monthStarts(list(cardFreqDict)), np.array(list(cardFreqDict.values()))
+    return frequencies
 
 
 def createLineChart(consideredDecks: ca.DATASET_CHUNK_TYPE,
                       cards: list[str] | None = None,
                       searchIn: list[str] | None = None) -> None:
     # draws a chart of card frequency given the criteria for selecting decks
+    cards = normalizeChartCards(cards)
+    drawLineChart(getChartFrequencies(consideredDecks, cards, searchIn), cards)
+
+
+def createGroupChart(consideredDecks: ca.DATASET_CHUNK_TYPE,
+                     groups: dict[str, list[str]],
+                     searchIn: list[str] | None = None,
+                     metric: str = "any",
+                     minCopies: int = ca.GROUP_MIN_COPIES_DEFAULT) -> None:
+    # draws a chart of the fraction of decks matching each card group, one line per group
+    drawLineChart(getGroupFrequencies(groups, consideredDecks, searchIn, metric, minCopies), list(groups))
 
+
+def normalizeChartCards(cards: list[str] | None) -> list[str]:
     if cards is None:
         cards = []
-    cards = [card.split(" //")[0].lower() for card in cards]
+    return [card.split(" //")[0].lower() for card in cards]
+
+
+def getChartFrequencies(consideredDecks: ca.DATASET_CHUNK_TYPE,
+                        cards: list[str],
+                        searchIn: list[str] | None = None) -> dict[str, tuple[numpy.ndarray, numpy.ndarray]]:
+    """
+    Computes the series createLineChart draws (cards must already be normalized). Does not touch matplotlib,
+    so it can run on a worker thread while the chart itself is drawn by the GUI thread
+    """
     if searchIn is None:
         searchIn = ca.SEARCH_IN_DEFAULT
 
+    # Searches without deck-level criteria are summed from the monthly rollups instead of scanning the decks
+    rows = ca.rollupRows(consideredDecks)
+    if rows is not None:
+        return getRollupCardFrequencies(cards, rows, searchIn)
+    return getCardFrequencies(cards, consideredDecks, searchIn)
+
+
+def drawLineChart(frequencies: dict[str, tuple[numpy.ndarray, numpy.ndarray]], cards: list[str]) -> None:
+    # matplotlib is slow to import, so only load it once a chart is requested
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import AutoMinorLocator, MultipleLocator
+
     fig, ax = plt.subplots()
-    numMonthlyDecks = getNumDecksByMonth(consideredDecks)
     for card in cards:
-        try:
-            x, y = getCardFrequency(card, consideredDecks, numMonthlyDecks, searchIn)
-            x, y = zip(*sorted(zip(x, y)))
-        except ValueError:
-            pass
-
+        x, y = frequencies[card]
         plt.plot(x, y, label=card)
 
     plt.legend(loc='upper center')
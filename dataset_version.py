@@ -0,0 +1,39 @@
+import os
+from os import path
+from typing import Callable, TypeVar
+import columnar
+import partitions
+import segment_log
+
+'''
+A dataset's version changes whenever its decks may have changed (a scrape appended to it, it was rewritten or converted)
+Derived data such as rollups and cached query results record the version they were computed from
+'''
+
+T = TypeVar("T")
+
+
+def statSignature(filePath: str) -> list[int]:
+    if not path.isfile(filePath):
+        return [0, 0]
+    stat = os.stat(filePath)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def datasetVersion(dataset: str) -> list[int]:
+    # Columnar datasets write meta.json last and partitioned datasets update their manifest after every append
+    if columnar.isColumnarDataset(dataset):
+        return statSignature(path.join(dataset, "meta.json"))
+    if partitions.isPartitionedDataset(dataset):
+        return statSignature(path.join(dataset, partitions.MANIFEST_FILE))
+    return statSignature(dataset) + list(segment_log.segmentSignature(dataset))
+
+
+def loadVersioned(dataset: str, load: Callable[[], T]) -> tuple[list[int], T]:
+    """
+    Returns the version of dataset and load(), which reads the dataset (or computes something from it)
+    The version is read first, so a scrape running meanwhile can only make the result look older than it is and have it
+    recomputed, never make stale data look current
+    """
+    version = datasetVersion(dataset)
+    return version, load()
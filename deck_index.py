@@ -0,0 +1,138 @@
+import numpy as np
+from typing import Callable, Optional
+import columnar
+import compact_decks
+import deck_matrix
+from trigram_index import TrigramIndex
+
+'''
+Search index of a loaded json or partitioned dataset (a compact_decks.DeckList), built the first time it is searched:
+    columns "date" / "player" / "url" / "event"   one entry per deck: ordinal, ids into the compact_decks vocabularies,
+                                                  utils.eventCategoryCode
+    card postings per location                    card id -> sorted ids of the decks running it (like a columnar dataset's)
+    player postings                               deck ids sorted by player
+It offers the same interface as columnar.ColumnarDataset, so both are searched by card_analyzer.getIndexedDeckIds
+Substring terms are resolved to card/player ids through trigram indexes over the shared vocabularies (see trigram_index.py)
+'''
+
+CARD_INDEX = TrigramIndex(compact_decks.CARDS.names)
+PLAYER_INDEX = TrigramIndex(compact_decks.PLAYERS.names, lower=True)
+
+
+class DeckIndex:
+    def __init__(self, decks: list[compact_decks.Deck]):
+        numDecks = len(decks)
+        self.numDecks = numDecks
+        self.columns = {"date": np.fromiter((deck.ordinal for deck in decks), dtype=np.int32, count=numDecks),
+                        "player": np.fromiter((deck.playerId for deck in decks), dtype=np.int32, count=numDecks),
+                        "url": np.fromiter((deck.urlId for deck in decks), dtype=np.int32, count=numDecks),
+                        "event": np.fromiter((deck.eventCode for deck in decks), dtype=np.int32, count=numDecks)}
+
+        matrix = deck_matrix.buildCompactDeckMatrix(decks) if decks else None
+        self.cardPostings = {}
+        for location in deck_matrix.LOCATIONS:
+            if matrix is None:
+                self.cardPostings[location] = (np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int32))
+            else:
+                self.cardPostings[location] = columnar.buildPostings(matrix.offsets[location], matrix.cardIds[location],
+                                                                     matrix.numCards)
+        self._players = None
+
+    def __len__(self) -> int:
+        return self.numDecks
+
+    def column(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    @property
+    def cardIndex(self) -> TrigramIndex:
+        return CARD_INDEX
+
+    @property
+    def playerIndex(self) -> TrigramIndex:
+        return PLAYER_INDEX
+
+    def postings(self, location: str, cardIds: np.ndarray, deckRange: Optional[tuple[int, int]] = None) -> np.ndarray:
+        """
+        Returns the sorted ids of every deck with any of cardIds in location (within deckRange, [start, end) deck ids, if given)
+        """
+        offsets, postings = self.cardPostings[location]
+        # Cards interned after the index was built appear in none of its decks
+        lists = [columnar.idsInRange(postings[offsets[c]:offsets[c + 1]], deckRange) for c in cardIds if c < len(offsets) - 1]
+        if len(lists) == 1:
+            return lists[0]
+        return np.unique(np.concatenate(lists)) if lists else np.empty(0, dtype=np.int32)
+
+    def playerDecks(self, playerIds: np.ndarray, deckRange: Optional[tuple[int, int]] = None) -> np.ndarray:
+        if self._players is None:
+            self._players = columnar.ValuePostings(self.columns["player"])
+        return self._players.decksOf(playerIds, deckRange)
+
+    def eventHits(self, eventMask: int, candidates: np.ndarray) -> np.ndarray:
+        return (self.columns["event"][candidates] & eventMask) != 0
+
+
+class CombinedDeckIndex:
+    """
+    Index of a DeckList made of other ones (e.g. the months of a partitioned dataset), answered from each part's index
+    """
+
+    def __init__(self, parts: list[tuple[int, DeckIndex]]):
+        self.parts = parts # (position of the part's first deck, its index)
+        self.numDecks = sum(len(index) for _, index in parts)
+
+    def __len__(self) -> int:
+        return self.numDecks
+
+    def column(self, name: str) -> np.ndarray:
+        return np.concatenate([index.column(name) for _, index in self.parts]) if self.parts else np.empty(0, dtype=np.int32)
+
+    @property
+    def cardIndex(self) -> TrigramIndex:
+        return CARD_INDEX
+
+    @property
+    def playerIndex(self) -> TrigramIndex:
+        return PLAYER_INDEX
+
+    def combine(self, found: list[np.ndarray]) -> np.ndarray:
+        # Parts are in order, so offsetting their sorted ids keeps the result sorted
+        found = [ids.astype(np.int64) + offset for (offset, _), ids in zip(self.parts, found)]
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def partRange(self, offset: int, index: DeckIndex, deckRange: Optional[tuple[int, int]]) -> Optional[tuple[int, int]]:
+        # deckRange in the ids of one part, empty for parts outside of it
+        if deckRange is None:
+            return None
+        return tuple(min(max(bound - offset, 0), len(index)) for bound in deckRange)
+
+    def postings(self, location: str, cardIds: np.ndarray, deckRange: Optional[tuple[int, int]] = None) -> np.ndarray:
+        return self.combine([index.postings(location, cardIds, self.partRange(offset, index, deckRange))
+                             for offset, index in self.parts])
+
+    def playerDecks(self, playerIds: np.ndarray, deckRange: Optional[tuple[int, int]] = None) -> np.ndarray:
+        return self.combine([index.playerDecks(playerIds, self.partRange(offset, index, deckRange))
+                             for offset, index in self.parts])
+
+    def eventHits(self, eventMask: int, candidates: np.ndarray) -> np.ndarray:
+        return (self.column("event")[candidates] & eventMask) != 0
+
+
+def indexOf(decks: compact_decks.DeckList, beforePart: Optional[Callable[[], None]] = None) -> DeckIndex | CombinedDeckIndex:
+    """
+    Returns the index of a loaded dataset, building it (or the index of each of its parts) the first time
+    beforePart is called before each part is indexed, so a caller can stop a long build by raising (e.g. when cancelled)
+    """
+    if decks.index is None:
+        if decks.parts is None:
+            decks.index = DeckIndex(decks)
+        else:
+            parts = []
+            offset = 0
+            for part in decks.parts:
+                if beforePart is not None:
+                    beforePart()
+                parts.append((offset, indexOf(part)))
+                offset += len(part)
+            decks.index = CombinedDeckIndex(parts)
+    return decks.index
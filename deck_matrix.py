@@ -0,0 +1,202 @@
+import numpy as np
+from datetime import date
+from itertools import chain
+from typing import Optional
+import compact_decks
+
+'''
+Sparse deck x card quantity matrices for a sample of decks (e.g. the output of card_analyzer.getDecks)
+Each location (main/side) is stored in CSR form: deck i owns entries offsets[i]:offsets[i + 1] of cardIds/counts.
+Column ids index into DeckMatrix.cards, which is shared by both locations, so per-card statistics become column
+reductions (np.bincount) instead of per-deck Python loops
+'''
+
+LOCATIONS = ["main", "side"]
+
+
+class DeckMatrix:
+    def __init__(self, cards: list[str], numDecks: int, offsets: dict, cardIds: dict, counts: dict):
+        self.cards = cards
+        self.numDecks = numDecks
+        self.offsets = offsets
+        self.cardIds = cardIds
+        self.counts = counts
+
+    @property
+    def numCards(self) -> int:
+        return len(self.cards)
+
+    def decksContaining(self, location: str) -> np.ndarray:
+        # A card appears at most once per deck location, so counting its entries counts the decks that run it
+        return np.bincount(self.cardIds[location], minlength=self.numCards)
+
+    def totalCopies(self, location: str) -> np.ndarray:
+        return np.bincount(self.cardIds[location], weights=self.counts[location], minlength=self.numCards).astype(np.int64)
+
+    def firstAppearance(self, location: str) -> np.ndarray:
+        """
+        Returns, per card, the position of its first entry in location (or the number of entries if it never appears)
+        Sorting by this reproduces the order cards are first seen when iterating over the sample
+        """
+        ids = self.cardIds[location]
+        first = np.full(self.numCards, len(ids), dtype=np.int64)
+        np.minimum.at(first, ids, np.arange(len(ids), dtype=np.int64))
+        return first
+
+    def deckIds(self, location: str) -> np.ndarray:
+        # Row id of every entry, i.e. the deck each (card, count) pair belongs to
+        return np.repeat(np.arange(self.numDecks, dtype=np.int32), np.diff(self.offsets[location]))
+
+    def rows(self, indices: np.ndarray) -> "DeckMatrix":
+        """
+        Returns the matrix of the decks at the given rows, in that order, e.g. the decks of one search out of a whole dataset
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        offsets = {}
+        cardIds = {}
+        counts = {}
+        for location in self.offsets:
+            starts = self.offsets[location][indices]
+            lengths = self.offsets[location][indices + 1] - starts
+            offsets[location] = np.zeros(len(indices) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[location][1:])
+            positions = np.repeat(starts - offsets[location][:-1], lengths) + np.arange(offsets[location][-1], dtype=np.int64)
+            cardIds[location] = self.cardIds[location][positions]
+            counts[location] = self.counts[location][positions]
+        return DeckMatrix(self.cards, len(indices), offsets, cardIds, counts)
+
+    def groupCounts(self, groupMasks: np.ndarray, searchIn: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns, per card group (row of groupMasks, see cardGroupMasks) and deck, how many of the group's cards the deck
+        runs in searchIn and how many copies of them. Every group is counted in one pass over the entries of their cards
+        """
+        numGroups = len(groupMasks)
+        inAnyGroup = groupMasks.any(axis=0)
+        keys = []
+        copies = []
+        for location in searchIn:
+            hit = inAnyGroup[self.cardIds[location]]
+            keys.append(self.deckIds(location)[hit].astype(np.int64) * self.numCards + self.cardIds[location][hit])
+            copies.append(self.counts[location][hit])
+
+        # Unique (deck, card) pairs, so a card in both the main and the side counts once and its copies add up
+        pairs, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        pairCopies = np.bincount(inverse.ravel(), weights=np.concatenate(copies), minlength=len(pairs))
+        pairDecks, pairCards = np.divmod(pairs, max(self.numCards, 1))
+
+        groups, pairIndex = np.nonzero(groupMasks[:, pairCards])
+        slots = groups * self.numDecks + pairDecks[pairIndex]
+        size = numGroups * self.numDecks
+        numGroupCards = np.bincount(slots, minlength=size).reshape(numGroups, self.numDecks)
+        groupCopies = np.bincount(slots, weights=pairCopies[pairIndex], minlength=size).astype(np.int64)
+        return numGroupCards, groupCopies.reshape(numGroups, self.numDecks)
+
+
+def buildDeckMatrix(decks: list[dict], cards: Optional[list[str]] = None) -> DeckMatrix:
+    """
+    Builds the matrices of decks. cards fixes the first column ids (e.g. a shared vocabulary),
+    names not in it get the ids after it
+    """
+    if cards is None:
+        cards = []
+    vocabulary = {card: i for i, card in enumerate(cards)}
+
+    offsets = {}
+    cardIds = {}
+    counts = {}
+    for location in LOCATIONS:
+        locationCards = [deck[location] for deck in decks]
+        lengths = np.fromiter((len(c) for c in locationCards), dtype=np.int64, count=len(decks))
+        locationOffsets = np.zeros(len(decks) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=locationOffsets[1:])
+
+        # Only distinct names go through Python code, the per-entry work stays in C (chain, map, fromiter)
+        names = list(chain.from_iterable(locationCards))
+        for card in dict.fromkeys(names):
+            vocabulary.setdefault(card, len(vocabulary))
+
+        offsets[location] = locationOffsets
+        cardIds[location] = np.fromiter(map(vocabulary.__getitem__, names), dtype=np.int32, count=len(names))
+        counts[location] = np.fromiter(chain.from_iterable(c.values() for c in locationCards), dtype=np.int32, count=len(names))
+
+    return DeckMatrix(list(vocabulary), len(decks), offsets, cardIds, counts)
+
+
+def buildCompactDeckMatrix(decks: list[compact_decks.Deck]) -> DeckMatrix:
+    """
+    buildDeckMatrix for compact decks: their card ids already index into compact_decks.CARDS,
+    so the matrices are sliced out of the concatenated Deck.data arrays without reading any name
+    """
+    numDecks = len(decks)
+    numCards = np.fromiter((deck.numCards for deck in decks), dtype=np.int64, count=numDecks)
+    numMain = np.fromiter((deck.numMain for deck in decks), dtype=np.int64, count=numDecks)
+    data = np.frombuffer(b"".join(deck.data for deck in decks), dtype=compact_decks.CARD_ID_TYPE)
+
+    # Deck i's ids start at starts[i] in data, its quantities numCards[i] entries later
+    starts = np.zeros(numDecks, dtype=np.int64)
+    np.cumsum(2 * numCards[:-1], out=starts[1:])
+    entryDecks = np.repeat(np.arange(numDecks), numCards)
+    entryStarts = np.zeros(numDecks, dtype=np.int64)
+    np.cumsum(numCards[:-1], out=entryStarts[1:])
+    positions = np.arange(len(entryDecks), dtype=np.int64) - entryStarts[entryDecks]
+    idPositions = starts[entryDecks] + positions
+    isMain = positions < numMain[entryDecks]
+
+    offsets = {}
+    cardIds = {}
+    counts = {}
+    for location, mask, lengths in [("main", isMain, numMain), ("side", ~isMain, numCards - numMain)]:
+        offsets[location] = np.zeros(numDecks + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[location][1:])
+        cardIds[location] = data[idPositions[mask]].astype(np.int32)
+        counts[location] = data[idPositions[mask] + numCards[entryDecks[mask]]].astype(np.int32)
+
+    return DeckMatrix(list(compact_decks.CARDS.names), numDecks, offsets, cardIds, counts)
+
+
+def deckMatrixOf(sample) -> DeckMatrix:
+    # Samples backed by columnar data (see columnar.py) can build their matrix without going through deck dictionaries
+    if hasattr(sample, "deckMatrix"):
+        return sample.deckMatrix()
+    if compact_decks.isCompactSample(sample):
+        return buildCompactDeckMatrix(sample)
+    return buildDeckMatrix(sample)
+
+
+def deckMonthsOf(sample) -> np.ndarray:
+    """
+    Returns the month ('YYYY-MM') of every deck in sample
+    """
+    if hasattr(sample, "deckMonths"):
+        return sample.deckMonths()
+    if compact_decks.isCompactSample(sample):
+        ordinals = np.fromiter((deck.ordinal for deck in sample), dtype=np.int64, count=len(sample))
+        # Few distinct dates, so only those are converted to months
+        uniqueOrdinals, inverse = np.unique(ordinals, return_inverse=True)
+        months = np.array([date.fromordinal(int(o)).isoformat()[:7] for o in uniqueOrdinals], dtype=str)
+        return months[inverse]
+    return np.array([str(deck["date"])[:7] for deck in sample], dtype=str)
+
+
+def cardTypeMask(cards: list[str], cardProperties: dict, showTypes: list[str]) -> np.ndarray:
+    """
+    Returns whether each card's type line contains any of showTypes. Unrecognized cards are never kept
+    """
+    return np.array([card in cardProperties and any(t in cardProperties[card]["type"] for t in showTypes) for card in cards],
+                    dtype=bool)
+
+
+def groupCardNames(group: list[str]) -> list[str]:
+    # Group cards are listed by display name (see card_groups.py), decks store the lower case front face
+    return list(dict.fromkeys(card.split(" //")[0].lower() for card in group))
+
+
+def cardGroupMasks(cards: list[str], groups: list[list[str]]) -> np.ndarray:
+    """
+    Compiles card groups into one row per group over cards (e.g. a deck matrix's columns), marking the group's cards
+    """
+    vocabulary = {card: i for i, card in enumerate(cards)}
+    masks = np.zeros((len(groups), len(cards)), dtype=bool)
+    for row, group in enumerate(groups):
+        masks[row, [vocabulary[card] for card in groupCardNames(group) if card in vocabulary]] = True
+    return masks
@@ -5,13 +5,32 @@ from tkinter.filedialog import askopenfilename
 from tkcalendar import DateEntry
 from datetime import date
 from dateutil.relativedelta import relativedelta
-from typing import Union
+from typing import Union, Callable
+from itertools import islice
+import queue
+import threading
 import card_analyzer as ca
 import data_visualization as dv
 import card_groups
 
 DEFAULT_DATASET_FILE = "Data/modern.json"
+DECKS_PER_PAGE = 20
+LOAD_MORE_AT = 0.9 # Load the next page of decks once the output is scrolled this far down
+DEBOUNCE_MS = 250 # Rapid clicks within this delay only run the last query
+POLL_MS = 50 # How often the GUI thread checks for finished queries
+# How "Generate Historical Graph" charts the chosen cards: one line per card, or one line for the whole group (see ca.getGroupMetrics)
+CHART_METRICS = {"Each card": None, "Decks with any": "any", "Decks with all": "all", "Decks with N+ copies": "copies"}
 dataset = DEFAULT_DATASET_FILE
+pendingDecks = None # Decks of the current "Show Decks" search that are not in the output yet
+pageScheduled = False
+
+# Queries run on worker threads so the window stays responsive. Workers never touch widgets: they put
+# (query id, callback, result, error) on finishedQueries and the GUI thread picks them up in pollQueries
+# Starting a query supersedes the previous one, whose result is dropped and whose scan is asked to stop
+finishedQueries = queue.Queue()
+currentQuery = 0
+currentCancel = threading.Event()
+debouncedQuery = None
 
 searchParams = {"whitelist": [], "blacklist": [], "player": None, "minDate": date(2000, 1, 1),
                       "maxDate": date(2100, 1, 1), "searchIn": ["main", "side"],
@@ -31,13 +50,150 @@ def parseCommaSeparatedInput(input: str) -> list[str]:
     else:
         return input.split(",")
 
+def runQuery(work: Callable, onDone: Callable, status: str) -> None:
+    """
+    Debounced startQuery, for buttons. Only the last of several clicks in quick succession runs
+    """
+    global debouncedQuery
+    if debouncedQuery is not None:
+        root.after_cancel(debouncedQuery)
+    debouncedQuery = root.after(DEBOUNCE_MS, lambda: startQuery(work, onDone, status))
+
+def startQuery(work: Callable, onDone: Callable, status: str, cancel: threading.Event = None) -> None:
+    """
+    Runs work(cancel) on a worker thread and calls onDone(result) on the GUI thread once it finishes,
+    unless another query was started (or the query was cancelled) in the meantime
+    """
+    global currentQuery, currentCancel, debouncedQuery
+    debouncedQuery = None
+    if cancel is None:
+        currentCancel.set()
+        cancel = threading.Event()
+    currentCancel = cancel
+    currentQuery += 1
+    queryId = currentQuery
+
+    def worker() -> None:
+        try:
+            finishedQueries.put((queryId, onDone, work(cancel), None))
+        except ca.QueryCancelled:
+            pass
+        except Exception as e:
+            finishedQueries.put((queryId, onDone, None, e))
+
+    statusLabel.config(text=status)
+    progressBar.start()
+    cancelButton.state(["!disabled"])
+    threading.Thread(target=worker, daemon=True).start()
+
+def cancelQuery() -> None:
+    global currentQuery, pendingDecks, pageScheduled
+    currentCancel.set()
+    currentQuery += 1 # Drops the result if the worker finishes anyway
+    pendingDecks = None
+    pageScheduled = False
+    queryFinished("Cancelled")
+
+def queryFinished(status: str) -> None:
+    statusLabel.config(text=status)
+    progressBar.stop()
+    cancelButton.state(["disabled"])
+
+def pollQueries() -> None:
+    try:
+        while True:
+            queryId, onDone, result, error = finishedQueries.get_nowait()
+            if queryId != currentQuery:
+                continue # Superseded
+            if error is not None:
+                queryFinished("")
+                updateOutput(f"Error: {error}")
+            else:
+                queryFinished("")
+                onDone(result)
+    except queue.Empty:
+        pass
+    root.after(POLL_MS, pollQueries)
+
+def searchParamsOrNone() -> dict | None:
+    # Reads the search widgets on the GUI thread, None if they are invalid
+    if not updateSearchParams():
+        return None
+    return dict(searchParams)
+
 def updateOutput(text: str) -> None:
+    global pendingDecks, pageScheduled
+    pendingDecks = None
+    pageScheduled = False
     outputTextbox.config(state="normal")
     outputTextbox.delete(1.0, tk.END)
     outputTextbox.insert(1.0, text)
     outputTextbox.config(state="disabled")
 
-def updateSearchParams() -> None:
+def showDecks() -> None:
+    """
+    Shows the first page of matching decks. The next pages are rendered as the output is scrolled down (see onOutputScroll)
+    """
+    params = searchParamsOrNone()
+    if params is None:
+        return
+
+    def work(cancel: threading.Event):
+        # Each page resumes the same scan, so the whole search shares one cancel event
+        decks = ca.renderDecks(ca.getDecks(dataset, **params).stream(cancel))
+        return decks, nextDeckPage(decks, cancel)
+
+    def onDone(result) -> None:
+        global pendingDecks
+        updateOutput("")
+        pendingDecks, page = result
+        insertDeckPage(page)
+
+    runQuery(work, onDone, "Searching decks...")
+
+def nextDeckPage(decks, cancel: threading.Event) -> list[str]:
+    ca.checkCancelled(cancel)
+    return list(islice(decks, DECKS_PER_PAGE))
+
+def appendDeckPage() -> None:
+    if pendingDecks is None:
+        return
+    decks = pendingDecks
+    startQuery(lambda cancel: nextDeckPage(decks, cancel), insertDeckPage, "Loading more decks...", cancel=currentCancel)
+
+def insertDeckPage(page: list[str]) -> None:
+    global pendingDecks, pageScheduled
+    pageScheduled = False
+    if len(page) < DECKS_PER_PAGE:
+        pendingDecks = None
+    outputTextbox.config(state="normal")
+    outputTextbox.insert(tk.END, "".join(page))
+    outputTextbox.config(state="disabled")
+
+def analyzeDecks() -> None:
+    params = searchParamsOrNone()
+    if params is None:
+        return
+
+    def work(cancel: threading.Event) -> str:
+        decks = ca.getDecks(dataset, **params)
+        # Searches the rollups can answer never scan decks, the others are selected here so they can be cancelled
+        if ca.rollupRows(decks) is None:
+            decks.select(cancel)
+        ca.checkCancelled(cancel)
+        return ca.getCardPrevalence(decks)
+
+    runQuery(work, updateOutput, "Analyzing decks...")
+
+def onOutputScroll(first: str, last: str) -> None:
+    global pageScheduled
+    outputTextbox.vbar.set(first, last)
+    if pendingDecks is not None and not pageScheduled and float(last) >= LOAD_MORE_AT:
+        # Let the current scroll finish drawing before loading more decks
+        pageScheduled = True
+        root.after_idle(appendDeckPage)
+
+def updateSearchParams() -> bool:
     """
     Update query parameters with current gui state and use ca.getDecks() to get all relevant decks
     This is called by the "Analyze Decks", "Show Decks" and "Generate Chart" buttons, which pass it to other functions from CA to format it
@@ -65,7 +221,7 @@ def updateSearchParams() -> None:
     maxDate = maxDateSelector.get_date()
     if minDate > maxDate:
         updateOutput("End date is before start date")
-        return
+        return False
     searchParams["minDate"] = minDate
     searchParams["maxDate"] = maxDate
 
@@ -79,24 +235,52 @@ def updateSearchParams() -> None:
         searchParams["player"] = None
     else:
         searchParams["player"] = playerInput
+    return True
 
 def generateChart() -> None:
-    updateSearchParams()
+    params = searchParamsOrNone()
+    if params is None:
+        return
     inputChart = parseCommaSeparatedInput(chartTextbox.get(1.0, "end-1c"))
-    print(searchParams)
     if not inputChart:
         # Use dropdown
-        cards = card_groups.CARD_GROUP_DICT[chartDropdownValue.get()]
+        groupName = chartDropdownValue.get()
+        cards = card_groups.CARD_GROUP_DICT[groupName]
     else:
         # use text input
+        groupName = ", ".join(inputChart)
         cards = inputChart
-    dv.createLineChart(consideredDecks=ca.getDecks(dataset, *searchParams.values()),
-                        cards=cards)
 
+    metric = CHART_METRICS[chartMetricValue.get()]
+    if metric is not None:
+        try:
+            minCopies = int(copiesSpinbox.get())
+        except ValueError:
+            updateOutput("N must be a whole number")
+            return
+        groups = {groupName: cards}
+
+        def groupWork(cancel: threading.Event) -> dict:
+            # Group metrics count decks, which the rollups do not keep, so the decks are always selected
+            decks = ca.getDecks(dataset, **params).select(cancel)
+            ca.checkCancelled(cancel)
+            return dv.getGroupFrequencies(groups, decks, params["searchIn"], metric, minCopies)
+
+        runQuery(groupWork, lambda frequencies: dv.drawLineChart(frequencies, list(groups)), "Generating chart...")
+        return
+
+    cards = dv.normalizeChartCards(cards)
+
+    def work(cancel: threading.Event) -> dict:
+        decks = ca.getDecks(dataset, **params)
+        if ca.rollupRows(decks) is None:
+            decks.select(cancel)
+        ca.checkCancelled(cancel)
+        return dv.getChartFrequencies(decks, cards, params["searchIn"])
+
+    # matplotlib has to draw on the GUI thread
+    runQuery(work, lambda frequencies: dv.drawLineChart(frequencies, cards), "Generating chart...")
 
-def queryDecks() -> list[dict[str, Union[str, dict[str, int]]]]:
-    updateSearchParams()
-    return ca.getDecks(dataset, *searchParams.values())
 
 # Window setup
 root = tk.Tk()
@@ -104,8 +288,8 @@ root.title("MTG Card Usage Analyzer")
 
 # Dataset selection
 filePickerButton = ttk.Button(root, text="Change Dataset", command=chooseFile)
-analyzeDecksButton = ttk.Button(root, text="Analyze Decks", command=lambda: updateOutput(ca.getCardPrevalence(queryDecks())))
-showDecksButton = ttk.Button(root, text="Show Decks", command=lambda: updateOutput(ca.displayDecks(queryDecks())))
+analyzeDecksButton = ttk.Button(root, text="Analyze Decks", command=analyzeDecks)
+showDecksButton = ttk.Button(root, text="Show Decks", command=showDecks)
 
 # Maindeck/Sideboard selection
 searchMaindeck = tk.IntVar(value=1)
@@ -175,16 +359,41 @@ chartDropdownValue = tk.StringVar()
 chartDropdownValue.set(list(card_groups.CARD_GROUP_DICT.keys())[0])
 chartDropdown = tk.OptionMenu(chartMenu, chartDropdownValue, *card_groups.CARD_GROUP_DICT.keys())
 chartTextbox = tk.Text(chartMenu, height=1, width=25)
+chartMetricLabel = tk.Label(chartMenu, text="Graph as")
+chartMetricValue = tk.StringVar()
+chartMetricValue.set(list(CHART_METRICS.keys())[0])
+chartMetricDropdown = tk.OptionMenu(chartMenu, chartMetricValue, *CHART_METRICS.keys())
+copiesLabel = tk.Label(chartMenu, text="N:")
+copiesSpinbox = tk.Spinbox(chartMenu, from_=1, to=60, width=3)
+copiesSpinbox.delete(0, tk.END)
+copiesSpinbox.insert(0, str(ca.GROUP_MIN_COPIES_DEFAULT))
 
 customChartLabel.grid(row=0, column=0)
 chartTextbox.grid(row=0, column=1)
 generateChartButton.grid(row=0, column=2)
 presetChartLabel.grid(row=1, column=0)
 chartDropdown.grid(row=1, column=1)
+chartMetricLabel.grid(row=2, column=0)
+chartMetricDropdown.grid(row=2, column=1)
+copiesLabel.grid(row=2, column=2)
+copiesSpinbox.grid(row=2, column=3)
+
+
+# Query progress
+progressMenu = tk.Frame(root)
+statusLabel = tk.Label(progressMenu, text="")
+progressBar = ttk.Progressbar(progressMenu, mode="indeterminate", length=200)
+cancelButton = ttk.Button(progressMenu, text="Cancel", command=cancelQuery)
+cancelButton.state(["disabled"])
+
+statusLabel.grid(row=0, column=0)
+progressBar.grid(row=0, column=1)
+cancelButton.grid(row=0, column=2)
 
 
 # Output
 outputTextbox = scrolledtext.ScrolledText(root, state="disabled", width=160, height=30, wrap=tk.WORD)
+outputTextbox.config(yscrollcommand=onOutputScroll)
 
 
 # Populate window
@@ -196,9 +405,11 @@ cardListInputMenu.grid(row=2, columnspan=2)
 analyzeDecksButton.grid(row=3, column=0)
 showDecksButton.grid(row=3, column=1)
 chartMenu.grid(row=4, columnspan=2)
+progressMenu.grid(row=5, columnspan=2)
 outputTextbox.grid(row=6, columnspan=2)
 
 
 # Draw window
 mainframe = ttk.Frame(root)
+root.after(POLL_MS, pollQueries)
 root.mainloop()
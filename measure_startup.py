@@ -0,0 +1,55 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+'''
+Measures the cold-start latency of analyze.py queries
+Every run is a fresh interpreter, so the numbers include imports and loading the dataset from disk (but not from the cache)
+'''
+
+HEAVY_MODULES = ["selenium", "chromedriver_autoinstaller", "matplotlib", "tkcalendar", "scraper"]
+
+
+def timeCommand(command: list[str], runs: int) -> list[float]:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def heavyModulesImported() -> list[str]:
+    # Import the analyzer in a fresh interpreter and list which heavy modules came with it
+    check = f"import sys, card_analyzer; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("measure_startup", description="e.g. python measure_startup.py -runs 5 -- -d modern -dsPath Data/ -w bolt")
+    parser.add_argument("-runs", nargs="?", help="# of fresh processes to time. Default: 5")
+    parser.add_argument("query", nargs=argparse.REMAINDER, help="analyze.py arguments, after '--'. Default: only import the analyzer")
+    args = parser.parse_args()
+
+    runs = 5 if args.runs == None else int(args.runs)
+    query = [arg for arg in args.query if arg != "--"]
+
+    baseline = timeCommand([sys.executable, "-c", "pass"], runs)
+    if query:
+        label = "analyze.py " + " ".join(query)
+        measured = timeCommand([sys.executable, "analyze.py"] + query, runs)
+    else:
+        label = "import card_analyzer"
+        measured = timeCommand([sys.executable, "-c", "import card_analyzer"], runs)
+
+    print(f"{label}: median {statistics.median(measured):.3f}s, min {min(measured):.3f}s over {runs} runs")
+    print(f"bare interpreter: median {statistics.median(baseline):.3f}s")
+
+    heavy = heavyModulesImported()
+    if heavy:
+        print(f"Error: importing card_analyzer also imports {', '.join(heavy)}")
+    else:
+        print("importing card_analyzer does not import any of: " + ", ".join(HEAVY_MODULES))
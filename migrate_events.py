@@ -0,0 +1,61 @@
+import orjson as json
+import argparse
+import archetypes
+import columnar
+import dataset_version
+import partitions
+import rollups
+import segment_log
+import utils
+
+'''
+Adds the structured event metadata scrapeUrls now stores with every deck (see utils.eventMetadata) to datasets scraped
+before it did, or refreshes it after utils.EVENT_TYPES changed:
+    python migrate_events.py Data/modern.json
+
+json and partitioned datasets are compacted first, then each file is rewritten with an "event" field on every deck.
+Columnar datasets get an events.json table instead. Decks and their order are unchanged, and rollups derive event
+categories from urls, so rollups and archetypes carry over. Searches cached before the migration are recomputed.
+Datasets that were not migrated still work: their decks' event categories are derived from their urls when loaded
+'''
+
+
+def withEventMetadata(decks: list[dict]) -> list[dict]:
+    # Decks of one event share its metadata. Stored metadata is recomputed, its categories may be outdated
+    events = {}
+    for deck in decks:
+        if deck["url"] not in events:
+            events[deck["url"]] = utils.eventMetadata(deck["url"])
+        deck["event"] = events[deck["url"]]
+    return decks
+
+
+def migrateFile(basePath: str) -> None:
+    segment_log.compact(basePath, key=utils.deckKey)
+    decks = segment_log.readBase(basePath, [])
+    segment_log.writeFileAtomic(basePath, json.dumps(withEventMetadata(decks)))
+
+
+def migrateDataset(dataset: str) -> None:
+    previousVersion = dataset_version.datasetVersion(dataset)
+    if columnar.isColumnarDataset(dataset):
+        columnar.addEventMetadata(dataset)
+    elif partitions.isPartitionedDataset(dataset):
+        manifest = partitions.loadManifest(dataset)
+        for month in manifest["partitions"]:
+            migrateFile(partitions.partitionPath(dataset, month))
+        # The manifest versions the dataset, rewriting it makes results cached with the previous events be recomputed
+        partitions.saveManifest(dataset, manifest)
+    else:
+        migrateFile(dataset)
+    rollups.carryOver(dataset, previousVersion)
+    archetypes.carryOver(dataset, previousVersion)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("migrate_events", description="e.g. python migrate_events.py Data/modern.json")
+    parser.add_argument("dataset", help="json, partitioned (.parts) or columnar (.cols) dataset")
+    args = parser.parse_args()
+
+    migrateDataset(args.dataset)
+    print(f"Added event metadata to {args.dataset}")
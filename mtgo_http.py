@@ -0,0 +1,114 @@
+import json as stdjson
+import re
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin
+from datetime import *
+from typing import Optional
+from unidecode import unidecode
+
+'''
+Fetches MTGO pages with plain HTTP requests instead of a browser
+Event pages embed their decklists as json ("window.MTGO.decklists.data = {...};"), which is parsed directly.
+Every function returns None when the page does not look as expected so the caller can fall back to Selenium.
+The extract* functions only take html, so they can be run against saved pages
+'''
+
+MTGO_URL = "https://www.mtgo.com"
+HTTP_TIMEOUT = 10
+POOL_SIZE = 16
+
+DECKLIST_DATA_MARKER = re.compile(r"window\.MTGO\.decklists\.data\s*=\s*")
+EVENT_LINK = re.compile(r'<a[^>]*href="([^"]*/decklist/[^"?#]+)"[^>]*>(.*?)</a>', re.DOTALL | re.IGNORECASE)
+TAG = re.compile(r"<[^>]+>")
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+session.headers["User-Agent"] = "Mozilla/5.0 (compatible; MTGCardUsageAnalyzer)"
+
+
+def fetchHtml(url: str) -> Optional[requests.Response]:
+    try:
+        response = session.get(url, timeout=HTTP_TIMEOUT)
+    except requests.RequestException:
+        return None
+    if response.status_code != 200:
+        return None
+    return response
+
+
+def extractEventUrls(html: str, format: str, baseUrl: Optional[str] = MTGO_URL) -> list[str]:
+    """
+    Returns the absolute url of every event on a listing page whose link text contains format (e.g. "Modern")
+    """
+    found = []
+    for href, text in EVENT_LINK.findall(html):
+        if format in TAG.sub("", text):
+            url = urljoin(baseUrl, href)
+            if url not in found:
+                found.append(url)
+    return found
+
+
+def fetchEventUrls(listingUrl: str, format: str) -> Optional[list[str]]:
+    response = fetchHtml(listingUrl)
+    if response is None:
+        return None
+    return extractEventUrls(response.text, format) or None
+
+
+def extractDecklists(html: str, urlEnding: str, deckDate: date) -> Optional[list[dict]]:
+    """
+    Converts the decklist json embedded in an event page into deck entries, normalized the same way as scraper.parseDecklist
+    """
+    marker = DECKLIST_DATA_MARKER.search(html)
+    if marker is None:
+        return None
+
+    try:
+        data, _ = stdjson.JSONDecoder().raw_decode(html, marker.end())
+        decks = []
+        for decklist in data["decklists"]:
+            player = unidecode(decklist["player"].split(" ")[0])
+            deck = {"player": player, "url": urlEnding, "date": deckDate, "main": {}, "side": {}}
+            for location, key in [("main", "main_deck"), ("side", "sideboard_deck")]:
+                for entry in decklist[key]:
+                    card = unidecode(entry["card_attributes"]["card_name"])
+                    card = card.lower().split(" //")[0].split("/")[0] # For DFCs only use the front name
+                    deck[location][card] = deck[location].get(card, 0) + int(entry["qty"])
+            decks.append(deck)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+    return decks or None
+
+
+def urlEndingOf(url: str) -> str:
+    # "https://www.mtgo.com/decklist/modern-league-..." -> "modern-league-...", for any host
+    return url.split("/decklist/", 1)[-1]
+
+
+def fetchEvent(url: str, deckDate: date) -> Optional[tuple[str, str, list[dict]]]:
+    """
+    Same result as scraper.scrapeEvent, or None if the page could not be fetched or parsed
+    """
+    response = fetchHtml(url)
+    if response is None:
+        return None
+    return eventFromResponse(url, response, deckDate)
+
+
+def eventFromResponse(url: str, response: requests.Response, deckDate: date) -> Optional[tuple[str, str, list[dict]]]:
+    urlEnding = urlEndingOf(url)
+
+    # Dead event urls redirect to the listing pages
+    if response.history and urlEnding not in response.url:
+        print("WAS REDIRECTED " + url)
+        return urlEnding, "dead", []
+
+    decks = extractDecklists(response.text, urlEnding, deckDate)
+    if decks is None:
+        return None
+
+    print(f"Gathering {len(decks)} decks from", url)
+    return urlEnding, "completed", decks
@@ -0,0 +1,153 @@
+import orjson as json
+import argparse
+import os
+from os import path
+from datetime import *
+from typing import Optional
+import segment_log
+import utils
+
+'''
+Partitioned dataset layout (a directory, by convention named <dataset>.parts):
+    manifest.json       {"version": 1, "partitions": {"YYYY-MM": {"file": "YYYY-MM.json", "numDecks": n, "minDate": ..., "maxDate": ...}}}
+    YYYY-MM.json        list of deck dictionaries dated in that month, in the same format as a json dataset
+    YYYY-MM.json.segments/  decks appended to that month since it was last compacted, see segment_log.py
+
+A query with a date range only opens the partitions whose month overlaps it
+'''
+
+PARTITIONED_VERSION = 1
+PARTITIONED_EXTENSION = ".parts"
+MANIFEST_FILE = "manifest.json"
+
+
+def isPartitionedDataset(dataset: str) -> bool:
+    return path.isfile(path.join(dataset, MANIFEST_FILE))
+
+
+def defaultPartitionedPath(jsonPath: str) -> str:
+    return path.splitext(jsonPath)[0] + PARTITIONED_EXTENSION
+
+
+def monthOf(deckDate: str | date) -> str:
+    # "YYYY-MM-DD" -> "YYYY-MM"
+    return str(deckDate)[:7]
+
+
+def loadManifest(dataset: str) -> dict:
+    with open(path.join(dataset, MANIFEST_FILE), "rb") as f:
+        return json.loads(f.read())
+
+
+def saveManifest(dataset: str, manifest: dict) -> None:
+    segment_log.writeFileAtomic(path.join(dataset, MANIFEST_FILE), json.dumps(manifest, option=json.OPT_SORT_KEYS))
+
+
+def createPartitionedDataset(dataset: str) -> None:
+    if not isPartitionedDataset(dataset):
+        os.makedirs(dataset, exist_ok=True)
+        saveManifest(dataset, {"version": PARTITIONED_VERSION, "partitions": {}})
+
+
+def monthsInRange(dataset: str, minDate: Optional[date] = None, maxDate: Optional[date] = None) -> list[str]:
+    """
+    Returns the months of every partition overlapping [minDate, maxDate], oldest first
+    """
+    months = sorted(loadManifest(dataset)["partitions"].keys())
+    if minDate is not None:
+        months = [m for m in months if m >= monthOf(minDate)]
+    if maxDate is not None:
+        months = [m for m in months if m <= monthOf(maxDate)]
+    return months
+
+
+def partitionPath(dataset: str, month: str) -> str:
+    return path.join(dataset, f"{month}.json")
+
+
+def loadPartition(dataset: str, month: str) -> list[dict]:
+    return segment_log.readTable(partitionPath(dataset, month), utils.deckKey)
+
+
+def loadPartitions(dataset: str, minDate: Optional[date] = None, maxDate: Optional[date] = None) -> list[dict]:
+    """
+    Loads the decks of every partition overlapping [minDate, maxDate]
+    Decks outside the range but inside an overlapping month are included, callers still filter by exact date
+    """
+    decks = []
+    for month in monthsInRange(dataset, minDate, maxDate):
+        decks += loadPartition(dataset, month)
+    return decks
+
+
+def groupByMonth(decks: list[dict]) -> dict[str, list[dict]]:
+    byMonth = {}
+    for deck in decks:
+        byMonth.setdefault(monthOf(deck["date"]), []).append(deck)
+    return byMonth
+
+
+def updateManifestEntry(manifest: dict, month: str, newDecks: list[dict]) -> None:
+    entry = manifest["partitions"].setdefault(month, {"file": f"{month}.json", "numDecks": 0})
+    dates = [str(deck["date"]) for deck in newDecks] + [entry[k] for k in ["minDate", "maxDate"] if k in entry]
+    entry["numDecks"] += len(newDecks)
+    entry["minDate"] = min(dates)
+    entry["maxDate"] = max(dates)
+
+
+def appendDecks(dataset: str, decks: list[dict]) -> None:
+    """
+    Adds decks to a partitioned dataset. Each affected month gets a new segment, nothing already stored is rewritten
+    """
+    createPartitionedDataset(dataset)
+    manifest = loadManifest(dataset)
+
+    for month, newDecks in groupByMonth(decks).items():
+        segment_log.appendRecords(partitionPath(dataset, month), newDecks)
+        updateManifestEntry(manifest, month, newDecks)
+
+    # The manifest is updated last so it never lists a partition that has not been written
+    saveManifest(dataset, manifest)
+
+
+def compactPartitions(dataset: str, force: Optional[bool] = False) -> None:
+    """
+    Folds each month's segments into its partition file. Without force only months with many segments are compacted
+    """
+    for month in loadManifest(dataset)["partitions"]:
+        if force:
+            segment_log.compact(partitionPath(dataset, month), key=utils.deckKey)
+        else:
+            segment_log.compactIfNeeded(partitionPath(dataset, month), key=utils.deckKey)
+
+
+def partitionJsonDataset(jsonPath: str, outDir: Optional[str] = None) -> str:
+    """
+    Splits a json dataset into monthly partitions
+    Returns the directory the partitioned dataset was written to
+    """
+    if outDir is None:
+        outDir = defaultPartitionedPath(jsonPath)
+    if isPartitionedDataset(outDir):
+        raise FileExistsError(f"{outDir} is already a partitioned dataset")
+
+    with open(jsonPath, "rb") as f:
+        decks = json.loads(f.read())
+
+    createPartitionedDataset(outDir)
+    manifest = loadManifest(outDir)
+    for month, monthDecks in groupByMonth(decks).items():
+        segment_log.writeFileAtomic(partitionPath(outDir, month), json.dumps(monthDecks))
+        updateManifestEntry(manifest, month, monthDecks)
+    saveManifest(outDir, manifest)
+    return outDir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("partitions")
+    parser.add_argument("dataset", help="json dataset to split into monthly partitions. e.g. 'Data/modern.json'")
+    parser.add_argument("-out", nargs="?", help="output directory. Default: the dataset path with a .parts extension")
+    args = parser.parse_args()
+
+    outDir = partitionJsonDataset(args.dataset, args.out)
+    print(f"Saved partitioned dataset to {outDir}")
@@ -0,0 +1,132 @@
+import orjson as json
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+from typing import Optional
+
+'''
+Stage-level instrumentation for queries: card_analyzer wraps each stage (loading, filtering, aggregation, formatting)
+in a span that records its wall time and how many decks went in and out. With memory tracking, spans also record the
+memory they allocated (net) and their peak allocation, from tracemalloc.
+
+Disabled (the default), span() returns a shared no-op context manager, so instrumented code only pays for one call per
+stage. Spans are never opened per deck.
+
+    profiling.enable(memory=True)
+    ...run a query...
+    print(profiling.formatReport(profiling.report()))
+'''
+
+ENABLED = False
+MEMORY = False
+
+_records: list[dict] = []
+_state = threading.local()
+_disabled = nullcontext()
+
+
+class Span:
+    def __init__(self, name: str, decksIn: Optional[int]):
+        self.name = name
+        self.decksIn = decksIn
+        self.decksOut = None
+        self.childPeak = 0
+
+    def __enter__(self) -> "Span":
+        stack = _stack()
+        self.depth = len(stack)
+        self.record = {"name": self.name, "depth": self.depth}
+        _records.append(self.record)
+        stack.append(self)
+
+        if MEMORY:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack[:-1]:
+                # The peak is reset for every span, so carry the enclosing span's peak so far over to it
+                stack[-2].childPeak = max(stack[-2].childPeak, peak)
+            tracemalloc.reset_peak()
+            self.startMemory = current
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.record["seconds"] = time.perf_counter() - self.start
+        self.record["decksIn"] = self.decksIn
+        self.record["decksOut"] = self.decksOut
+
+        stack = _stack()
+        stack.pop()
+        if MEMORY:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, self.childPeak)
+            self.record["allocatedBytes"] = current - self.startMemory
+            self.record["peakBytes"] = peak - self.startMemory
+            if stack:
+                stack[-1].childPeak = max(stack[-1].childPeak, peak)
+            tracemalloc.reset_peak()
+
+
+def _stack() -> list[Span]:
+    if not hasattr(_state, "stack"):
+        _state.stack = []
+    return _state.stack
+
+
+def span(name: str, decksIn: Optional[int] = None):
+    """
+    Context manager timing a stage. Set .decksOut on the value it returns to record how many decks the stage kept
+    """
+    if not ENABLED:
+        return _disabled
+    return Span(name, decksIn)
+
+
+def setDecksOut(stage, decksOut: int) -> None:
+    # Works on the no-op context too, so callers need not check whether profiling is enabled
+    if stage is not None:
+        stage.decksOut = decksOut
+
+
+def enable(memory: Optional[bool] = False) -> None:
+    global ENABLED, MEMORY
+    ENABLED = True
+    MEMORY = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable() -> None:
+    global ENABLED, MEMORY
+    if MEMORY:
+        tracemalloc.stop()
+    ENABLED = False
+    MEMORY = False
+
+
+def reset() -> None:
+    _records.clear()
+
+
+def report() -> list[dict]:
+    """
+    Returns the finished spans in the order they started. depth is their nesting level
+    """
+    return [record for record in _records if "seconds" in record]
+
+
+def formatReport(records: list[dict]) -> str:
+    lines = [f"{'stage':<40} {'time':>10} {'decks in':>10} {'decks out':>10}" + (f" {'allocated':>12} {'peak':>12}" if MEMORY else "")]
+    for record in records:
+        name = "  " * record["depth"] + record["name"]
+        decksIn = "" if record["decksIn"] is None else record["decksIn"]
+        decksOut = "" if record["decksOut"] is None else record["decksOut"]
+        line = f"{name:<40} {record['seconds'] * 1000:>8.1f}ms {decksIn:>10} {decksOut:>10}"
+        if "allocatedBytes" in record:
+            line += f" {record['allocatedBytes'] / 1024 ** 2:>10.1f}MB {record['peakBytes'] / 1024 ** 2:>10.1f}MB"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def jsonReport(records: list[dict]) -> str:
+    return json.dumps({"memory": MEMORY, "stages": records}).decode()
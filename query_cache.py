@@ -0,0 +1,150 @@
+import orjson as json
+import hashlib
+import os
+import threading
+from os import path
+from collections import OrderedDict
+from typing import Optional
+import segment_log
+import utils
+
+'''
+Results of getDecks searches, keyed on their normalized criteria and kept in memory and on disk:
+    <dataset>_queries/<key>.json    e.g. Data/modern_queries/, or queries/ inside .cols/.parts datasets
+
+{"dataset": <dataset_version.datasetVersion the result was computed from>, "query": <normalized criteria>,
+ "ids": [position of each matching deck in card_analyzer.loadDataset(dataset, minDate, maxDate)],
+ "prevalence": {<showTypes joined by ",">: getCardPrevalence output}}
+
+Entries computed from an older version of the dataset (e.g. before a scrape) are ignored and removed. Past DISK_LIMIT_BYTES,
+the least recently used files of a dataset's cache are removed, including data derived from searches (e.g. cooccurrence.py)
+Cache files are not flushed to disk as they are written: one lost in a crash is just recomputed
+'''
+
+MEMORY_ENTRIES = 64
+DISK_LIMIT_BYTES = 512 * 1024 ** 2 # Per dataset
+
+_memory: OrderedDict[str, dict] = OrderedDict()
+_memoryLock = threading.Lock()
+
+
+def normalizeQuery(query: dict) -> dict:
+    """
+    Returns the criteria of a getDecks query in a canonical form: terms that cannot change the result are dropped,
+    lists whose order does not matter are sorted
+    """
+    normalized = {"dataset": path.abspath(query["dataset"]),
+                  # An empty whitelist term matches every deck
+                  "whitelist": sorted({w for w in query["whitelist"] if w != ""}),
+                  "blacklist": sorted(set(query["blacklist"])),
+                  "player": query["player"] or None,
+                  "minDate": str(query["minDate"]),
+                  "maxDate": str(query["maxDate"]),
+                  "searchIn": sorted(set(query["searchIn"])),
+                  "eventType": sorted(set(query["eventType"])),
+                  # The event kinds of those categories, so results are recomputed when utils.EVENT_TYPES changes
+                  "eventKinds": sorted({kind for category in query["eventType"] for kind in utils.EVENT_TYPES[category]})}
+    # Only added when set, so the keys of searches without it stay the same
+    if query.get("archetype"):
+        normalized["archetype"] = sorted(set(query["archetype"]))
+    return normalized
+
+
+def queryKey(normalized: dict) -> str:
+    return hashlib.sha1(json.dumps(normalized, option=json.OPT_SORT_KEYS)).hexdigest()
+
+
+def cacheDir(dataset: str) -> str:
+    if path.isdir(dataset):
+        return path.join(dataset, "queries")
+    return path.splitext(dataset)[0] + "_queries"
+
+
+def entryPath(dataset: str, key: str) -> str:
+    return path.join(cacheDir(dataset), key + ".json")
+
+
+def loadEntry(dataset: str, key: str, version: list[int]) -> Optional[dict]:
+    """
+    Returns the cached entry for key if it was computed from this version of dataset (see dataset_version.py)
+    """
+    with _memoryLock:
+        entry = _memory.get(key)
+        if entry is not None and entry["dataset"] == version:
+            _memory.move_to_end(key)
+            return entry
+
+    entryFile = entryPath(dataset, key)
+    if not path.isfile(entryFile):
+        return None
+    try:
+        with open(entryFile, "rb") as f:
+            entry = json.loads(f.read())
+    except json.JSONDecodeError:
+        return None
+    if entry["dataset"] != version:
+        # It can never be used again. At worst it was just written from a newer version and is recomputed
+        removeFile(entryFile)
+        return None
+
+    touch(entryFile)
+    remember(key, entry)
+    return entry
+
+
+def saveEntry(dataset: str, key: str, entry: dict) -> None:
+    remember(key, entry)
+    saveFile(dataset, entryPath(dataset, key), json.dumps(entry))
+
+
+def saveFile(dataset: str, filePath: str, content: bytes) -> None:
+    """
+    Writes a file of dataset's cache, then removes the least recently used ones past DISK_LIMIT_BYTES
+    """
+    os.makedirs(cacheDir(dataset), exist_ok=True)
+    segment_log.writeFileAtomic(filePath, content, durable=False)
+    prune(dataset)
+
+
+def prune(dataset: str) -> None:
+    # Files are ordered by their last use, see touch
+    files = []
+    with os.scandir(cacheDir(dataset)) as found:
+        for entry in found:
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, filePath in sorted(files):
+        if total <= DISK_LIMIT_BYTES:
+            break
+        removeFile(filePath)
+        total -= size
+
+
+def touch(filePath: str) -> None:
+    # Marks a cache file as used. Another process may have just removed it
+    try:
+        os.utime(filePath)
+    except FileNotFoundError:
+        pass
+
+
+def removeFile(filePath: str) -> None:
+    try:
+        os.remove(filePath)
+    except FileNotFoundError:
+        pass
+
+
+def remember(key: str, entry: dict) -> None:
+    with _memoryLock:
+        _memory[key] = entry
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+
+
+def clearMemory() -> None:
+    with _memoryLock:
+        _memory.clear()
@@ -0,0 +1,177 @@
+import orjson as json
+import os
+from os import path
+from datetime import *
+from typing import Optional
+import compact_decks
+import dataset_version
+import partitions
+import segment_log
+import utils
+
+'''
+Precomputed monthly aggregates of a dataset, used to answer searches without deck-level criteria
+(no whitelist, blacklist or player) without scanning any decks.
+
+{"version": 3, "dataset": <dataset_version.datasetVersion the rollups were computed from>,
+ "order": "append" or "month", "entries": {"main": n, "side": n},
+ "months": {"YYYY-MM": {"minDate": ..., "maxDate": ..., "entries" (month order only): {"main": n, "side": n},
+                        "events": {"league": {"decks": n,
+                                              "main": {card: [decks, copies, first]},
+                                              "side": {card: [decks, copies, first]},
+                                              "any": {card: decks}}}}}}
+
+Decks are grouped by their utils.eventCategories joined with "+" (a deck can only match several categories in odd cases).
+"any" counts decks running the card in the main or the side. "first" is the position of the card's first entry among the
+main/side entries in dataset order, so ties can be listed in the order a scan of the decks would first see them.
+json and columnar datasets keep decks in the order they were added, so positions count every entry added so far ("entries").
+Partitioned datasets keep them by month: positions count the entries of the deck's month and are offset by the month
+(see monthPosition), so decks appended to an earlier month are still ordered before the later months.
+minDate/maxDate bound every deck of the month, so a date range can tell if it contains the whole month
+'''
+
+ROLLUP_VERSION = 3 # Bumped whenever the buckets of existing rollups would change, e.g. utils.EVENT_TYPES
+LOCATIONS = ["main", "side"]
+MONTH_POSITIONS = 2 ** 32 # Room for the entries of one month
+
+
+def rollupPath(dataset: str) -> str:
+    if path.isdir(dataset):
+        return path.join(dataset, "rollups.json")
+    return path.splitext(dataset)[0] + "_rollups.json"
+
+
+def emptyRollups(version: list[int], order: str) -> dict:
+    return {"version": ROLLUP_VERSION, "dataset": version, "order": order, "entries": {location: 0 for location in LOCATIONS},
+            "months": {}}
+
+
+def datasetOrder(dataset: str) -> str:
+    return "month" if partitions.isPartitionedDataset(dataset) else "append"
+
+
+def monthPosition(month: str) -> int:
+    # Position of a month's first entry in a dataset kept by month
+    return (int(month[:4]) * 12 + int(month[5:7])) * MONTH_POSITIONS
+
+
+def addDecks(rollups: dict, decks) -> None:
+    byMonth = rollups["order"] == "month"
+    for deck in decks:
+        if isinstance(deck, compact_decks.Deck):
+            deck = deck.toDict()
+        deckDate = str(deck["date"])
+        month = rollups["months"].setdefault(deckDate[:7], {"minDate": deckDate, "maxDate": deckDate, "events": {}})
+        month["minDate"] = min(month["minDate"], deckDate)
+        month["maxDate"] = max(month["maxDate"], deckDate)
+        entries = rollups["entries"]
+        start = 0
+        if byMonth:
+            entries = month.setdefault("entries", {location: 0 for location in LOCATIONS})
+            start = monthPosition(deckDate[:7])
+
+        categories = "+".join(utils.eventCategories(deck["url"]))
+        if not categories:
+            # getDecks never returns decks outside of every category
+            for location in LOCATIONS:
+                entries[location] += len(deck[location])
+            continue
+
+        bucket = month["events"].setdefault(categories, {"decks": 0, "main": {}, "side": {}, "any": {}})
+        bucket["decks"] += 1
+        for location in LOCATIONS:
+            counts = bucket[location]
+            for card, quantity in deck[location].items():
+                entry = counts.get(card)
+                if entry is None:
+                    counts[card] = [1, quantity, start + entries[location]]
+                else:
+                    entry[0] += 1
+                    entry[1] += quantity
+                entries[location] += 1
+        anyCounts = bucket["any"]
+        for card in deck["main"].keys() | deck["side"].keys():
+            anyCounts[card] = anyCounts.get(card, 0) + 1
+
+
+def buildRollups(dataset: str, decks) -> dict:
+    """
+    Computes the rollups of every deck in dataset (decks must be all of them, in dataset order) and saves them
+    """
+    rollups = emptyRollups(dataset_version.datasetVersion(dataset), datasetOrder(dataset))
+    addDecks(rollups, decks)
+    saveRollups(dataset, rollups)
+    return rollups
+
+
+def saveRollups(dataset: str, rollups: dict) -> None:
+    segment_log.writeFileAtomic(rollupPath(dataset), json.dumps(rollups))
+
+
+def isCurrent(rollups: dict, dataset: str) -> bool:
+    return rollups.get("version") == ROLLUP_VERSION and rollups["dataset"] == dataset_version.datasetVersion(dataset)
+
+
+def updateRollups(dataset: str, decks: list[dict], previousVersion: list[int]) -> None:
+    """
+    Adds decks that were just appended to dataset. previousVersion is the dataset version before the append
+    Rollups that were already out of date are removed instead, they are rebuilt the next time they are needed
+    """
+    rollupFile = rollupPath(dataset)
+    if not path.isfile(rollupFile):
+        return
+    with open(rollupFile, "rb") as f:
+        rollups = json.loads(f.read())
+
+    if rollups.get("version") != ROLLUP_VERSION or rollups["dataset"] != previousVersion:
+        os.remove(rollupFile)
+        return
+
+    addDecks(rollups, decks)
+    rollups["dataset"] = dataset_version.datasetVersion(dataset)
+    saveRollups(dataset, rollups)
+
+
+def carryOver(dataset: str, previousVersion: list[int]) -> None:
+    """
+    Keeps the rollups valid after an operation that changed the dataset's files but not its decks (e.g. compaction)
+    """
+    rollupFile = rollupPath(dataset)
+    if not path.isfile(rollupFile):
+        return
+    with open(rollupFile, "rb") as f:
+        rollups = json.loads(f.read())
+    if rollups["dataset"] == previousVersion:
+        rollups["dataset"] = dataset_version.datasetVersion(dataset)
+        saveRollups(dataset, rollups)
+
+
+def rowsInRange(rollups: dict, minDate: date, maxDate: date, eventType: list[str]) -> Optional[list[tuple[str, dict]]]:
+    """
+    Returns (month, bucket) for every bucket of the requested event types whose month lies inside [minDate, maxDate]
+    Returns None if the range only covers part of a month, in which case the decks have to be scanned
+    """
+    minDate = str(minDate)
+    maxDate = str(maxDate)
+    rows = []
+    for month, monthRollup in sorted(rollups["months"].items()):
+        if monthRollup["maxDate"] < minDate or monthRollup["minDate"] > maxDate:
+            continue
+        if monthRollup["minDate"] < minDate or monthRollup["maxDate"] > maxDate:
+            return None
+        for categories, bucket in monthRollup["events"].items():
+            if any(category in eventType for category in categories.split("+")):
+                rows.append((month, bucket))
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+    import card_analyzer
+
+    parser = argparse.ArgumentParser(description="Rebuild the monthly rollups of a dataset")
+    parser.add_argument("dataset", type=str, help="Dataset to summarize, in any format (e.g. Data/modern.json)")
+    args = parser.parse_args()
+
+    built = buildRollups(args.dataset, card_analyzer.loadDataset(args.dataset))
+    print(f"Saved rollups for {len(built['months'])} months to {rollupPath(args.dataset)}")
@@ -1,20 +1,27 @@
 import scraper
+import partitions
+import async_crawler
 import argparse
 import time
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("scrape")
-    parser.add_argument("dataset", help="file name with or without file extension. e.g. 'full_modern'")
+    parser.add_argument("dataset", help="file name with or without file extension. e.g. 'full_modern'. Use a '.parts' extension to store monthly partitions")
     parser.add_argument("format", help="Format name to scrape. e.g. 'modern'")
     parser.add_argument("-start", nargs="?", help="first month to scrape. e.g. '2025/1'")
     parser.add_argument("-end", nargs="?", help="last month to scrape. e.g. '2025/10'")
     parser.add_argument("-grace", nargs="?", help="# of days before start date to begin scraping. Intended to prevent coverage issues when automated. \nOnly applies if no start date is given. Default: 7")
     parser.add_argument("-skip", action=argparse.BooleanOptionalAction, help="Skip updating card dictionary references. Only use if no new cards have been added to Scryfall recently")
     parser.add_argument("-retry", action=argparse.BooleanOptionalAction, help="Retry all urls which failed previously instaed of a normal scrape.")
+    parser.add_argument("-workers", nargs="?", help="# of browsers loading event pages in parallel, or of concurrent requests with -crawl. Default: 1 (8 with -crawl)")
+    parser.add_argument("-crawl", action=argparse.BooleanOptionalAction, help="Fetch every month and event concurrently over HTTP, without a browser")
+    parser.add_argument("-baseUrl", nargs="?", help="Site to crawl with -crawl. Default: https://www.mtgo.com")
+    parser.add_argument("-browser", action=argparse.BooleanOptionalAction, help="Load every page with Chrome instead of first trying a plain HTTP request")
+    parser.add_argument("-compact", action=argparse.BooleanOptionalAction, help="Fold decks appended by previous scrapes back into the dataset file instead of a normal scrape.")
     
     # Format args and set default values
     args = parser.parse_args()
-    if ".json" not in args.dataset:
+    if ".json" not in args.dataset and not args.dataset.endswith(partitions.PARTITIONED_EXTENSION):
         args.dataset = args.dataset + ".json"
     args.dataset = args.dataset.replace("\\", "/") # Account for different directory separators in Windows
 
@@ -24,9 +31,21 @@ if __name__ == "__main__":
         args.grace = 7
     args.grace = int(args.grace)
 
+    if args.workers == None:
+        args.workers = async_crawler.DEFAULT_CONCURRENCY if args.crawl else 1
+    args.workers = int(args.workers)
+
+    if args.baseUrl == None:
+        args.baseUrl = async_crawler.mtgo_http.MTGO_URL
+
     startTime = time.time()
     if (args.retry):
-        scraper.retryErroredUrls(args.dataset, args.format)
+        scraper.retryErroredUrls(args.dataset, args.format, workers=args.workers, useHttp=not args.browser)
+    elif (args.compact):
+        scraper.compactDataset(args.dataset, force=True)
+    elif (args.crawl):
+        async_crawler.crawlUrlsByMonth(args.dataset, args.format, args.skip, grace=args.grace, startDate=args.start, endDate=args.end,
+                                       concurrency=args.workers, baseUrl=args.baseUrl)
     else:
-        scraper.scrapeUrlsByMonth(args.dataset, args.format, args.skip, grace=args.grace, startDate=args.start, endDate=args.end)
+        scraper.scrapeUrlsByMonth(args.dataset, args.format, args.skip, grace=args.grace, startDate=args.start, endDate=args.end, workers=args.workers, useHttp=not args.browser)
     print(f"Operation completed in {time.time() - startTime} seconds")
@@ -10,7 +10,17 @@ from os import path
 from datetime import *
 from typing import Optional
 from unidecode import unidecode
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+import threading
+import atexit
 import utils
+import partitions
+import segment_log
+import dataset_version
+import rollups
+import archetypes
+import mtgo_http
 
 import chromedriver_autoinstaller
 
@@ -25,7 +35,6 @@ Tribal / Kindred are no longer used (they just use the other type)
 
 DRIVER_TIMEOUT = 4
 
-chromedriver_autoinstaller.install()
 chromeOptions = Options()
 chromeOptions.add_argument("--headless")
 chromeOptions.add_argument("--log-level=3") # Ignore unimpactful errors
@@ -33,11 +42,37 @@ chromeOptions.add_experimental_option("prefs", {"profile.managed_default_content
 chromeOptions.add_argument("--no-sandbox") # Attempt to fix linux error
 chromeOptions.add_argument("--disable-dev-shm-usage") # Attempt to fix linux error
 
-try:
-    driver = webdriver.Chrome(options=chromeOptions)
-except selenium.common.exceptions.SessionNotCreatedException as e:
-    print("Error: Issue with ChromeDriver, cannot create Selenium Session")
-    raise e
+# Nothing browser related happens at import time. chromedriver is installed and Chrome is started the first time a page
+# actually needs a browser, and the shared driver is shut down when the process exits
+driver = None
+chromedriverInstalled = False
+driverLock = threading.Lock()
+
+def createDriver() -> webdriver.Chrome:
+    global chromedriverInstalled
+    with driverLock:
+        if not chromedriverInstalled:
+            chromedriver_autoinstaller.install()
+            chromedriverInstalled = True
+
+    try:
+        return webdriver.Chrome(options=chromeOptions)
+    except selenium.common.exceptions.SessionNotCreatedException as e:
+        print("Error: Issue with ChromeDriver, cannot create Selenium Session")
+        raise e
+
+def getDriver() -> webdriver.Chrome:
+    global driver
+    if driver is None:
+        driver = createDriver()
+    return driver
+
+@atexit.register
+def closeDriver() -> None:
+    global driver
+    if driver is not None:
+        driver.quit()
+        driver = None
 
 def updateCardPropertiesDataset() -> None: 
     """
@@ -99,107 +134,227 @@ def updateCardPropertiesDataset() -> None:
 
     print("successfully updated card properties dataset from Scryfall\n")
 
-def scrapeUrls(datasetFile: str, urls: list[str]) -> None:
+def scrapeUrls(datasetFile: str, urls: list[str], workers: Optional[int] = 1, useHttp: Optional[bool] = True) -> None:
     """
     Scrapes all given urls from www.mtgo.com/decklists/... to extract deck information
     writes to the output_file information in json format: payer name, url of event, event date, maindeck, sideboard
+    and the event's metadata (see utils.eventMetadata)
     Adds all urls successfully scraped to Data/scraped_urls_NAMEOFOUTPUTFILE.txt
+    Decks and url bookkeeping are appended after every event, so an interrupted scrape keeps every finished event
+    With workers > 1, events are loaded in parallel by that many browsers but still saved in the order of urls
+    With useHttp, each event is first fetched without a browser, see mtgo_http.py
     """
 
     if not urls:
         return
 
-    datasetName = datasetFile.split("/")[-1].split(".")[0]
-    urlFileName = f"Data/{datasetName}_urls.json"
-    scrapedUrls = []
-    erroredUrls = []
-    deadUrls = []
-    decks = []
+    urlFileName = urlFileFor(datasetFile)
+    numErrors = 0
     numDecks = 0
 
+    createDatasetFileIfNotExist(datasetFile)
+    createUrlFileIfNotExist(urlFileName)
+
     print(f"Scraping {len(urls)} events")
-    for url in urls:
-        urlEnding = url.replace("https://www.mtgo.com/decklist/", "")
+    for urlEnding, status, decks in scrapeEvents(urls, workers, useHttp):
+        if status == "failed":
+            numErrors += 1
+            saveUrlUpdate(urlFileName, {"failedEvent": [urlEnding]})
+            continue
+
+        numDecks += len(decks)
+        attachEventMetadata(urlEnding, decks)
+
+        # Save the decks before marking the event as completed so a crash in between can only cause a retry
+        saveDecks(datasetFile, decks)
+        saveUrlUpdate(urlFileName, {status: [urlEnding]})
+
+    print(f"Saved {numDecks} decklists to {datasetFile}")
+    compactDataset(datasetFile)
+
+    if numErrors > 0:
+        print(f"\nError: Failed to reach {numErrors} Url{'s' if (numErrors > 1) else ''}. Please try them again with 'python scrape.py <dataset> <format> -retry'\n")
+
+
+def attachEventMetadata(urlEnding: str, decks: list[dict]) -> None:
+    # Every deck of an event shares its metadata (see utils.eventMetadata)
+    event = utils.eventMetadata(urlEnding)
+    for deck in decks:
+        deck["event"] = event
+
+
+def scrapeEvents(urls: list[str], workers: Optional[int] = 1, useHttp: Optional[bool] = True) -> Iterator[tuple[str, str, list[dict]]]:
+    """
+    Yields the result of scrapeEvent for each url, in the same order as urls
+    With workers > 1 each worker thread creates and owns its own browser, which is closed once all urls are done
+    With useHttp the browser is only used for pages that could not be fetched and parsed over plain HTTP
+    A url whose browser cannot be started (e.g. Chrome is not installed) fails on its own, like one that cannot be reached
+    """
+    def scrapeWithFallback(url: str, getDriver) -> tuple[str, str, list[dict]]:
+        if useHttp:
+            result = mtgo_http.fetchEvent(url, dateFromUrl(url))
+            if result is not None:
+                return result
         try:
-            driver.get(url)
+            browser = getDriver()
+        except (selenium.common.exceptions.WebDriverException, ValueError, OSError):
+            # chromedriver_autoinstaller raises ValueError without Chrome and OSError when it cannot download the driver
+            print(f"Failed to start a browser for {url} Please retry it")
+            return url.replace("https://www.mtgo.com/decklist/", ""), "failed", []
+        return scrapeEvent(browser, url)
+
+    if workers <= 1:
+        for url in urls:
+            yield scrapeWithFallback(url, getDriver)
+        return
 
-            # If decklists-list class if found then the driver must have been redirected due to the url being dead
-            WebDriverWait(driver, DRIVER_TIMEOUT).until(lambda driver: driver.find_elements(By.CLASS_NAME, "decklist-item-page") 
-                                                        or driver.find_elements(By.CLASS_NAME, "decklist-title"))
-            
-            content = driver.find_elements(By.CLASS_NAME, 'decklist')
-            if len(content) == 0:
-                print(f"No decks found at {url} Please retry it")
-
-                erroredUrls.append(urlEnding)
-                continue
-            elif driver.find_elements(By.CLASS_NAME, 'decklists-page'):
-                print("WAS REDIRECTED " + url)
-                deadUrls.append(urlEnding)
-                # raise Exception("ERORR: was redirected")
-            else:
-                print(f"Gathering {len(content)} decks from", url)
-                scrapedUrls.append(urlEnding)
-            
-        except selenium.common.exceptions.TimeoutException:
-            erroredUrls.append(urlEnding)
-            print(f"Failed to reach {url} Please retry it") # DEBUG
+    workerState = threading.local()
+    workerDrivers = []
+    lock = threading.Lock()
+
+    def workerDriver() -> webdriver.Chrome:
+        # Browsers are only started by workers that need one
+        if not hasattr(workerState, "driver"):
+            workerState.driver = createDriver()
+            with lock:
+                workerDrivers.append(workerState.driver)
+        return workerState.driver
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # map hands urls to whichever worker is free and returns results in the order of urls
+            yield from pool.map(lambda url: scrapeWithFallback(url, workerDriver), urls)
+    finally:
+        for d in workerDrivers:
+            d.quit()
+
+
+def scrapeEvent(driver: webdriver.Chrome, url: str) -> tuple[str, str, list[dict]]:
+    """
+    Loads one event page with the given browser
+    Returns the url ending, its status for the url file ("completed", "dead" or "failed") and the decks found
+    """
+    urlEnding = url.replace("https://www.mtgo.com/decklist/", "")
+    try:
+        driver.get(url)
+
+        # If decklists-list class if found then the driver must have been redirected due to the url being dead
+        WebDriverWait(driver, DRIVER_TIMEOUT).until(lambda driver: driver.find_elements(By.CLASS_NAME, "decklist-item-page") 
+                                                    or driver.find_elements(By.CLASS_NAME, "decklist-title"))
+        
+        content = driver.find_elements(By.CLASS_NAME, 'decklist')
+        if len(content) == 0:
+            print(f"No decks found at {url} Please retry it")
+            return urlEnding, "failed", []
+        elif driver.find_elements(By.CLASS_NAME, 'decklists-page'):
+            print("WAS REDIRECTED " + url)
+            status = "dead"
+            # raise Exception("ERORR: was redirected")
+        else:
+            print(f"Gathering {len(content)} decks from", url)
+            status = "completed"
+
+        return urlEnding, status, [parseDecklist(decklist.text, urlEnding) for decklist in content]
+
+    except selenium.common.exceptions.TimeoutException:
+        print(f"Failed to reach {url} Please retry it") # DEBUG
+        return urlEnding, "failed", []
+    except selenium.common.exceptions.WebDriverException:
+        # e.g. the browser crashed. Only this event fails, the worker keeps going
+        print(f"Browser error while loading {url} Please retry it")
+        return urlEnding, "failed", []
+
+
+def parseDecklist(text: str, urlEnding: str) -> dict:
+    """
+    Converts the text of one decklist element on an event page into a deck entry
+    """
+    deckContents = text.split("\n")
+    deckDate = dateFromUrl(urlEnding)
+    player = deckContents[0]
+    player = unidecode(player.split(" ")[0])
+    deck = {"player": player, "url": urlEnding, 'date': deckDate, "main": {}, "side": {}}
+    
+    md = True
+    for i in range(9, len(deckContents)):
+        if "Sideboard" in deckContents[i]:
+            md = False
             continue
+        for t in CARD_TYPE_SEPARATORS:
+            if t in deckContents[i]:
+                break
+        else:
+            quantity = deckContents[i].split(" ", 1)[0]
 
-        for decklist in content:
-            deckContents = decklist.text
-            deckContents = deckContents.split("\n")
-            deckDate = dateFromUrl(urlEnding)
-            player = deckContents[0]
-            player = unidecode(player.split(" ")[0])
-            deck = {"player": player, "url": urlEnding, 'date': deckDate, "main": {}, "side": {}}
-            
-            md = True
-            for i in range(9, len(deckContents)):
-                if "Sideboard" in deckContents[i]:
-                    md = False
-                    continue
-                for t in CARD_TYPE_SEPARATORS:
-                    if t in deckContents[i]:
-                        break
-                else:
-                    quantity = deckContents[i].split(" ", 1)[0]
-
-                    card = deckContents[i].split(" ", 1)[1] 
-
-                    card = unidecode(card) # convert all characters to English. Prevents key errors when matching with card_properties.json.
-                    card = card.lower().split("/")[0] # For DFCs only use the front name
-
-                    if md:
-                        deck["main"][card] = int(quantity)
-                    else:
-                        deck["side"][card] = int(quantity)
-            numDecks += 1
-            decks.append(deck)
+            card = deckContents[i].split(" ", 1)[1] 
 
-    createDatasetFileIfNotExist(datasetFile)
-    with open(datasetFile, "r") as f:
-        storedDecks = json.loads(f.read()) 
-        storedDecks += decks
+            card = unidecode(card) # convert all characters to English. Prevents key errors when matching with card_properties.json.
+            card = card.lower().split("/")[0] # For DFCs only use the front name
+
+            if md:
+                deck["main"][card] = int(quantity)
+            else:
+                deck["side"][card] = int(quantity)
+    return deck
 
-    with open(datasetFile, "wb") as f:
-        print(f"Saving {numDecks} decklists to {datasetFile}")
-        f.write(json.dumps(storedDecks))
 
+def saveDecks(datasetFile: str, decks: list[dict]) -> None:
+    # Only the new decks are written, see segment_log.py. The dataset's rollups are kept up to date with them
+    previousVersion = dataset_version.datasetVersion(datasetFile)
+    if partitions.isPartitionedDataset(datasetFile):
+        partitions.appendDecks(datasetFile, decks)
+    else:
+        segment_log.appendRecords(datasetFile, decks)
+    rollups.updateRollups(datasetFile, decks, previousVersion)
+
+
+def compactDataset(datasetFile: str, force: Optional[bool] = False) -> None:
+    """
+    Folds the segments appended by scrapeUrls back into the dataset and its url file
+    Without force this only happens once enough segments have accumulated
+    """
+    urlFileName = urlFileFor(datasetFile)
+    if force:
+        compact = segment_log.compact
+    else:
+        compact = segment_log.compactIfNeeded
+
+    previousVersion = dataset_version.datasetVersion(datasetFile)
+    if partitions.isPartitionedDataset(datasetFile):
+        partitions.compactPartitions(datasetFile, force)
+    else:
+        compact(datasetFile, key=utils.deckKey)
+    rollups.carryOver(datasetFile, previousVersion)
+    archetypes.carryOver(datasetFile, previousVersion)
+    compact(urlFileName, fold=applyUrlUpdates)
+
+
+def applyUrlUpdates(storedUrls: dict, updates: list[dict]) -> dict:
+    """
+    Replays url bookkeeping updates onto the contents of a url file. Each update may have the keys:
+    completed / dead / failedEvent: event url endings (dead may also hold listing months)
+    failedListing / resolvedListing: listing months
+    """
+    for update in updates:
+        completed = update.get("completed", [])
+        dead = update.get("dead", [])
+        alreadyCompleted = set(storedUrls["completed"])
+        storedUrls["completed"] += [url for url in completed if url not in alreadyCompleted]
+        storedUrls["failed"]["event"] = [url for url in storedUrls["failed"]["event"] if url not in completed and url not in dead]
+        storedUrls["failed"]["event"] = list(set(update.get("failedEvent", []) + storedUrls["failed"]["event"]))
+        storedUrls["failed"]["dead"] = list(set(dead + storedUrls["failed"]["dead"]))
+        storedUrls["failed"]["listing"] = [date for date in set(update.get("failedListing", []) + storedUrls["failed"]["listing"])
+                                           if date not in update.get("resolvedListing", [])]
+    return storedUrls
+
+
+def loadUrlFile(urlFileName: str) -> dict:
     createUrlFileIfNotExist(urlFileName)
-    with open(urlFileName, "r") as f:
-        storedUrls = json.loads(f.read())
-        storedUrls["completed"] += scrapedUrls
-        storedUrls["failed"]["event"] = [url for url in storedUrls["failed"]["event"] if url not in scrapedUrls and url not in deadUrls]
-        storedUrls["failed"]["event"] = list(set(erroredUrls + storedUrls["failed"]["event"]))
-        storedUrls["failed"]["dead"] = list(set(deadUrls + storedUrls["failed"]["dead"]))
-
-    numErrors = len(erroredUrls)
-    if numErrors > 0:
-        print(f"\nError: Failed to reach {numErrors} Url{'s' if (numErrors > 1) else ''}. Please try them again with 'python scrape.py <dataset> <format> -retry'\n")
+    return applyUrlUpdates(segment_log.readBase(urlFileName, None), segment_log.readRecords(urlFileName))
 
-    with open(urlFileName, "wb") as f:
-        f.write(json.dumps(storedUrls))
+
+def saveUrlUpdate(urlFileName: str, update: dict) -> None:
+    segment_log.appendRecords(urlFileName, [update])
 
 
 def dateFromUrl(url: str) -> date:
@@ -209,47 +364,43 @@ def dateFromUrl(url: str) -> date:
     day = int(deckDate[-1][:2])
     return date(year, month, day)
 
-def getNewUrls(datasetFile: str, format: str, date: str) -> list[str]:
+def getNewUrls(datasetFile: str, format: str, date: str, useHttp: Optional[bool] = True) -> list[str]:
     """
     Gets each event url from a page with all events from a month that has not yet been scraped
     The date should have the format "yyyy/mm"
+    With useHttp the listing is first fetched without a browser, see mtgo_http.py
     """
     format = format.title()
     listingUrl = f"https://www.mtgo.com/decklists/{date}?filter={format}"
-    datasetName = datasetFile.split("/")[-1].split(".")[0]
-    urlFileName = f"Data/{datasetName}_urls.json"
+    urlFileName = urlFileFor(datasetFile)
     foundUrls = []
     newUrls = []
 
-    createUrlFileIfNotExist(urlFileName)
-    with open(urlFileName, "r") as f:
-        storedUrls = json.loads(f.read())
+    storedUrls = loadUrlFile(urlFileName)
 
-    try:
-        driver.get(listingUrl)
-        wait = WebDriverWait(driver, DRIVER_TIMEOUT)
-        wait.until(EC.presence_of_element_located((By.CLASS_NAME, "decklists-list")))
-    except selenium.common.exceptions.TimeoutException:
-        print(f"Error: Unable to access {listingUrl}. Please try them again with 'python scrape.py <dataset> <format> -err'\n")
-        storedUrls["failed"]["listing"] = list(set([date] + storedUrls["failed"]["listing"]))
-        with open(urlFileName, "wb") as f:
-            f.write(json.dumps(storedUrls))
-        return []
-    
-    content = driver.find_elements(By.PARTIAL_LINK_TEXT, format)
+    if useHttp:
+        foundUrls = mtgo_http.fetchEventUrls(listingUrl, format) or []
 
-    if len(content) == 0:
-        print(f"Error: No {format} decklists found at {listingUrl}'")
-        storedUrls["failed"]["dead"] = list(set([date] + storedUrls["failed"]["dead"]))
-        if date in storedUrls["failed"]["listing"]:
-            storedUrls["failed"]["listing"].remove(date)
+    if not foundUrls:
+        try:
+            driver = getDriver()
+            driver.get(listingUrl)
+            wait = WebDriverWait(driver, DRIVER_TIMEOUT)
+            wait.until(EC.presence_of_element_located((By.CLASS_NAME, "decklists-list")))
+        except selenium.common.exceptions.TimeoutException:
+            print(f"Error: Unable to access {listingUrl}. Please try them again with 'python scrape.py <dataset> <format> -err'\n")
+            saveUrlUpdate(urlFileName, {"failedListing": [date]})
+            return []
+        
+        content = driver.find_elements(By.PARTIAL_LINK_TEXT, format)
 
-        with open(urlFileName, "wb") as f:
-            f.write(json.dumps(storedUrls))
-        return []
+        if len(content) == 0:
+            print(f"Error: No {format} decklists found at {listingUrl}'")
+            saveUrlUpdate(urlFileName, {"dead": [date], "resolvedListing": [date]})
+            return []
 
-    for l in content:
-        foundUrls.append(l.get_attribute("href"))
+        for l in content:
+            foundUrls.append(l.get_attribute("href"))
 
     for url in foundUrls:
         urlEnding = url.replace("https://www.mtgo.com/decklist/", "")
@@ -257,14 +408,12 @@ def getNewUrls(datasetFile: str, format: str, date: str) -> list[str]:
             newUrls.append(url)
 
     if date in storedUrls["failed"]["listing"]:
-        storedUrls["failed"]["listing"].remove(date)
-
-    with open(urlFileName, "wb") as f:
-            f.write(json.dumps(storedUrls))
+        saveUrlUpdate(urlFileName, {"resolvedListing": [date]})
 
     return newUrls
 
-def scrapeUrlsByMonth(datasetFile: str, format: str, skip: bool, grace: Optional[int] = 7, startDate: Optional[str] = None, endDate: Optional[str] = None) -> None:
+def scrapeUrlsByMonth(datasetFile: str, format: str, skip: bool, grace: Optional[int] = 7, startDate: Optional[str] = None, endDate: Optional[str] = None,
+                      workers: Optional[int] = 1, useHttp: Optional[bool] = True) -> None:
     """
     Scrape one or more months of data for one format, and add data to datasetFile
     date inputs should be like 'yyyy/mm'
@@ -275,8 +424,16 @@ def scrapeUrlsByMonth(datasetFile: str, format: str, skip: bool, grace: Optional
 
     format = format.capitalize()
 
-    dates = []
+    dates = monthsToScrape(grace, startDate, endDate)
 
+    for date in dates:
+        scrapeUrls(datasetFile, getNewUrls(datasetFile, format, date, useHttp), workers, useHttp)
+
+def monthsToScrape(grace: Optional[int] = 7, startDate: Optional[str] = None, endDate: Optional[str] = None) -> list[str]:
+    """
+    Returns every month between the start and end date as 'yyyy/mm'
+    Without a start date, scraping starts [grace] days ago. Without an end date, it ends this month
+    """
     if startDate == None:
         # scrape the previous [grace] days to prevent coverage issues with automated usage
         startDate = (datetime.today() - timedelta(days=grace)).strftime("%Y/%m")
@@ -286,36 +443,30 @@ def scrapeUrlsByMonth(datasetFile: str, format: str, skip: bool, grace: Optional
 
     if (startDate > endDate):
         print("Error: Start Date comes after End Date")
-        return
-
-    dates = utils.getDatesBetweenMonths(startDate, endDate)
+        return []
 
-    for date in dates:
-        scrapeUrls(datasetFile, getNewUrls(datasetFile, format, date))
+    return utils.getDatesBetweenMonths(startDate, endDate)
 
-def retryErroredUrls(dsPath: str, format: str):
-    urlPath = dsPath.replace(".json", "_urls.json")
-    with open(urlPath, "r") as f:
-        urls = json.loads(f.read())
+def retryErroredUrls(dsPath: str, format: str, workers: Optional[int] = 1, useHttp: Optional[bool] = True):
+    urlPath = urlFileFor(dsPath)
+    urls = loadUrlFile(urlPath)
     
     
     numFailedEvents = len(urls["failed"]["event"])
     numFailedListings = len(urls["failed"]["listing"])
 
     for date in urls["failed"]["listing"]:
-        scrapeUrls(dsPath, getNewUrls(dsPath, format, date))
+        scrapeUrls(dsPath, getNewUrls(dsPath, format, date, useHttp), workers, useHttp)
 
         # Get updated urls after listing retries have occurred
     if numFailedEvents > 0:
-        with open(urlPath, "r") as f:
-            urls = json.loads(f.read())
+        urls = loadUrlFile(urlPath)
     fullUrls = ["https://www.mtgo.com/decklist/" + urlEnding for urlEnding in urls["failed"]["event"]]
 
-    scrapeUrls(dsPath, fullUrls)
+    scrapeUrls(dsPath, fullUrls, workers, useHttp)
 
     # Get updated urls after retries have occurred
-    with open(urlPath, "r") as f:
-        urls = json.loads(f.read())
+    urls = loadUrlFile(urlPath)
 
     newNumEvents = len(urls["failed"]["event"])
     newNumListings = len(urls["failed"]["listing"])
@@ -329,13 +480,20 @@ def retryErroredUrls(dsPath: str, format: str):
     print(f"Events: {newNumEvents}")
 
 
+def urlFileFor(datasetFile: str) -> str:
+    datasetName = datasetFile.split("/")[-1].split(".")[0]
+    return f"Data/{datasetName}_urls.json"
+
 def createFileIfNotExist(filePath: str, content: any) -> None:
     if not path.isfile(filePath):
         with open(filePath, "wb+") as f:
             f.write(json.dumps(content))
 
 def createDatasetFileIfNotExist(datasetFile: str) -> None:
-    createFileIfNotExist(datasetFile, [])
+    if datasetFile.endswith(partitions.PARTITIONED_EXTENSION):
+        partitions.createPartitionedDataset(datasetFile)
+    else:
+        createFileIfNotExist(datasetFile, [])
 
 def createUrlFileIfNotExist(urlFile: str) -> None:
     createFileIfNotExist(urlFile, {"completed": [], "failed": {"listing": [], "event": [], "dead": []}})
@@ -0,0 +1,154 @@
+import orjson as json
+import os
+from os import path
+from typing import Callable
+
+'''
+Append-only storage next to a json file (the "base"):
+    <base>                  e.g. Data/modern.json, written only by compaction
+    <base>.segments/        NDJSON files, one json record per line, named by an increasing sequence number
+
+Writers add a new segment per batch instead of rewriting the base, so the cost of a write is proportional to the new data
+and a crash loses at most the batch being written. Segments are written to a temporary name, fsynced and renamed into place,
+so readers only ever see complete segments. Compaction folds the segments back into the base.
+
+Compaction swaps in the new base before removing the segments it folded. A COMPACTING marker is kept in the segment directory
+during that window; if a crash leaves it behind, readers and the next compaction drop segment records already in the base
+'''
+
+SEGMENTS_SUFFIX = ".segments"
+SEGMENT_EXTENSION = ".ndjson"
+COMPACTION_THRESHOLD = 256 # Number of segments before compactIfNeeded folds them into the base
+COMPACTING_MARKER = "COMPACTING"
+
+
+def segmentDir(basePath: str) -> str:
+    return basePath + SEGMENTS_SUFFIX
+
+
+def segmentFiles(basePath: str) -> list[str]:
+    directory = segmentDir(basePath)
+    if not path.isdir(directory):
+        return []
+    return [path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(SEGMENT_EXTENSION)]
+
+
+def segmentSignature(basePath: str) -> tuple[int, int]:
+    # Adding or removing a segment changes the directory's mtime and its file count
+    directory = segmentDir(basePath)
+    if not path.isdir(directory):
+        return 0, 0
+    return os.stat(directory).st_mtime_ns, len(os.listdir(directory))
+
+
+def fsyncDir(directory: str) -> None:
+    # Directory fsync makes the rename itself durable. Not available on Windows
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def writeFileAtomic(filePath: str, content: bytes, durable: bool = True) -> None:
+    # Readers never see a half written file: write next to it, flush it to disk and swap it in
+    # Without durable the flushes are skipped, for files that can be recomputed (e.g. caches) if a crash loses them
+    tmpPath = filePath + ".tmp"
+    with open(tmpPath, "wb") as f:
+        f.write(content)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmpPath, filePath)
+    if durable:
+        fsyncDir(path.dirname(path.abspath(filePath)))
+
+
+def appendRecords(basePath: str, records: list) -> None:
+    """
+    Durably appends records as a new segment of basePath
+    """
+    if not records:
+        return
+
+    directory = segmentDir(basePath)
+    os.makedirs(directory, exist_ok=True)
+    existing = segmentFiles(basePath)
+    sequence = int(path.basename(existing[-1]).split(".")[0]) + 1 if existing else 1
+    lines = b"".join(json.dumps(record) + b"\n" for record in records)
+    writeFileAtomic(path.join(directory, f"{sequence:08}{SEGMENT_EXTENSION}"), lines)
+
+
+def readRecords(basePath: str) -> list:
+    """
+    Returns every record in the segments of basePath, oldest first
+    """
+    return readSegments(segmentFiles(basePath))
+
+
+def readSegments(segments: list[str]) -> list:
+    records = []
+    for segment in segments:
+        with open(segment, "rb") as f:
+            records += [json.loads(line) for line in f.read().splitlines() if line]
+    return records
+
+
+def readBase(basePath: str, default: any) -> any:
+    if not path.isfile(basePath):
+        return default
+    with open(basePath, "rb") as f:
+        return json.loads(f.read())
+
+
+def interruptedCompaction(basePath: str) -> bool:
+    return path.isfile(path.join(segmentDir(basePath), COMPACTING_MARKER))
+
+
+def appendTable(base: list, records: list, key: Callable[[dict], any] = None, dedupe: bool = False) -> list:
+    if dedupe and key is not None:
+        stored = {key(record) for record in base}
+        records = [record for record in records if key(record) not in stored]
+    return base + records
+
+
+def readTable(basePath: str, key: Callable[[dict], any] = None) -> list:
+    """
+    Returns the base list followed by the records of every segment
+    key identifies a record, and is only used to recover from an interrupted compaction
+    """
+    return appendTable(readBase(basePath, []), readRecords(basePath), key, interruptedCompaction(basePath))
+
+
+def compact(basePath: str, fold: Callable[[any, list], any] = None, default: any = None, key: Callable[[dict], any] = None) -> None:
+    """
+    Rewrites the base as fold(base, records) and removes the folded segments
+    By default the base is a list and records are appended to it
+    """
+    segments = segmentFiles(basePath)
+    if not segments:
+        return
+
+    if fold is None:
+        dedupe = interruptedCompaction(basePath)
+        fold = lambda base, records: appendTable(base, records, key, dedupe)
+        default = []
+
+    # Only the listed segments are folded, so a segment appended meanwhile is neither folded nor removed
+    records = readSegments(segments)
+
+    markerPath = path.join(segmentDir(basePath), COMPACTING_MARKER)
+    writeFileAtomic(markerPath, b"")
+    writeFileAtomic(basePath, json.dumps(fold(readBase(basePath, default), records)))
+
+    # The base now holds these records, so removing them only after the swap cannot lose data
+    for segment in segments:
+        os.remove(segment)
+    os.remove(markerPath)
+
+
+def compactIfNeeded(basePath: str, fold: Callable[[any, list], any] = None, default: any = None, key: Callable[[dict], any] = None) -> None:
+    if len(segmentFiles(basePath)) >= COMPACTION_THRESHOLD:
+        compact(basePath, fold, default, key)
@@ -0,0 +1,268 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from typing import Optional
+import card_analyzer as ca
+import columnar
+import data_visualization as dv
+import dataset_version
+import deck_matrix
+import partitions
+import profiling
+import utils
+
+'''
+Runs a card prevalence, card group or chart search over shards of the dataset in a pool of worker processes, so large
+scans use every core:
+    output = sharded_queries.getCardPrevalence(ca.getDecks("Data/modern.parts", whitelist=["bolt"]), jobs=8)
+
+A partitioned dataset is sharded into runs of consecutive months, a columnar one into fixed-size ranges of decks.
+Workers only receive the search and their shard: each loads its own months (or memory-maps the columnar dataset), selects
+its decks and sends back per-card counts (or per-month group or card counts) of the cards it saw, which are merged in shard order
+into exactly what a single process would output
+A json dataset would be parsed whole by every worker, so its searches run in this process instead, as do searches
+answered by the query cache or the rollups
+'''
+
+SHARDS_PER_JOB = 4 # More shards than workers, so a worker that gets light months picks up more of them
+NOT_SEEN = np.iinfo(np.int64).max
+
+
+def jobsDefault() -> int:
+    return os.cpu_count() or 1
+
+
+def isShardable(dataset: str) -> bool:
+    return partitions.isPartitionedDataset(dataset) or columnar.isColumnarDataset(dataset)
+
+
+def planShards(query: dict, jobs: int) -> list[dict]:
+    """
+    Splits the dataset of a getDecks query into shards, in the order of its decks:
+    {"minDate", "maxDate": the shard's dates within the query's, "start", "end": its range of deck ids, or None}
+    """
+    dataset = query["dataset"]
+    numShards = max(jobs, 1) * SHARDS_PER_JOB
+    minDate, maxDate = ca.ordinalRange(query["minDate"], query["maxDate"])
+
+    if columnar.isColumnarDataset(dataset):
+        numDecks = len(ca.loadDataset(dataset))
+        bounds = np.linspace(0, numDecks, min(numShards, max(numDecks, 1)) + 1).astype(np.int64).tolist()
+        return [{"minDate": date.fromordinal(minDate), "maxDate": date.fromordinal(maxDate), "start": start, "end": end}
+                for start, end in zip(bounds[:-1], bounds[1:])]
+
+    # Consecutive months of about the same number of decks
+    manifest = partitions.loadManifest(dataset)["partitions"]
+    months = partitions.monthsInRange(dataset, query["minDate"], query["maxDate"])
+    if not months:
+        return []
+    decksBefore = np.cumsum([0] + [manifest[month]["numDecks"] for month in months[:-1]])
+    shardOf = (decksBefore * numShards // max(decksBefore[-1] + manifest[months[-1]]["numDecks"], 1)).tolist()
+    shards = []
+    for shard in sorted(set(shardOf)):
+        inShard = [month for month, i in zip(months, shardOf) if i == shard]
+        first = date(int(inShard[0][:4]), int(inShard[0][5:7]), 1)
+        last = (date(int(inShard[-1][:4]), int(inShard[-1][5:7]), 28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        shards.append({"minDate": date.fromordinal(max(minDate, first.toordinal())),
+                       "maxDate": date.fromordinal(min(maxDate, last.toordinal())), "start": None, "end": None})
+    return shards
+
+
+def shardDecks(query: dict, shard: dict) -> ca.DATASET_CHUNK_TYPE | columnar.ColumnarSample:
+    """
+    Selects the decks of a shard matching query, like ca.cachedSelectDeckIds without the cache
+    """
+    dataset = query["dataset"]
+    loaded = ca.loadDataset(dataset, shard["minDate"], shard["maxDate"])
+    # Only the shard's decks are looked up in the postings
+    deckRange = (shard["start"], shard["end"]) if shard["start"] is not None else None
+    ids = ca.getIndexedDeckIds(ca.searchIndexOf(loaded), query["whitelist"], query["blacklist"], query["player"],
+                               shard["minDate"], shard["maxDate"], query["searchIn"],
+                               utils.eventCategoryMask(query["eventType"]), deckRange=deckRange)
+    if query["archetype"]:
+        ids = ca.archetypeDeckIds(dataset, shard["minDate"], shard["maxDate"], ids, query["archetype"])
+    return ca.decksAt(loaded, ids.tolist())
+
+
+def shardPrevalence(query: dict, shard: dict) -> dict:
+    """
+    Runs in a worker: the prevalence counts of the cards in a shard's matching decks
+    firstAppearance is the card's first entry among the shard's entries, numEntries lets them be offset when merging
+    """
+    matrix = deck_matrix.deckMatrixOf(shardDecks(query, shard))
+    seen = np.zeros(matrix.numCards, dtype=bool)
+    decksContaining = {location: matrix.decksContaining(location) for location in ca.SEARCH_IN_DEFAULT}
+    for location in ca.SEARCH_IN_DEFAULT:
+        seen |= decksContaining[location] > 0
+    seen = np.flatnonzero(seen)
+    return {"numDecks": matrix.numDecks,
+            "cards": [matrix.cards[card] for card in seen.tolist()],
+            "numEntries": {location: len(matrix.cardIds[location]) for location in ca.SEARCH_IN_DEFAULT},
+            "decksContaining": {location: decksContaining[location][seen] for location in ca.SEARCH_IN_DEFAULT},
+            "totalCopies": {location: matrix.totalCopies(location)[seen] for location in ca.SEARCH_IN_DEFAULT},
+            "firstAppearance": {location: matrix.firstAppearance(location)[seen] for location in ca.SEARCH_IN_DEFAULT}}
+
+
+def shardGroupMetrics(query: dict, shard: dict, groups: dict[str, list[str]], searchIn: list[str], minCopies: int) -> tuple:
+    # Runs in a worker: ca.getGroupMetrics of a shard's matching decks
+    return ca.getGroupMetrics(shardDecks(query, shard), groups, searchIn, minCopies)
+
+
+def shardCardMonths(query: dict, shard: dict, cards: list[str], searchIn: list[str]) -> tuple:
+    # Runs in a worker: dv.getCardMonthlyCounts of a shard's matching decks
+    return dv.getCardMonthlyCounts(cards, shardDecks(query, shard), searchIn)
+
+
+def runShards(query: dict, jobs: int, work, *args) -> list:
+    """
+    Returns work(query, shard, *args) of every shard of query's dataset, in shard order, computed by jobs processes
+    """
+    shards = planShards(query, jobs)
+    # Missing archetypes are built once here rather than by every worker
+    if query["archetype"]:
+        ca.loadArchetypes(query["dataset"])
+    with profiling.span(f"{len(shards)} shards on {jobs} processes"):
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            return list(pool.map(work, [query] * len(shards), shards, *[[arg] * len(shards) for arg in args]))
+
+
+def mergePrevalence(parts: list[dict]) -> tuple[list[str], int, dict, dict, dict]:
+    """
+    Adds up the shardPrevalence of consecutive shards, in the form ca.formatPrevalence takes
+    """
+    cards = list(dict.fromkeys(card for part in parts for card in part["cards"]))
+    vocabulary = {card: i for i, card in enumerate(cards)}
+    numDecks = sum(part["numDecks"] for part in parts)
+    decksContaining = {}
+    totalCopies = {}
+    firstAppearance = {}
+    for location in ca.SEARCH_IN_DEFAULT:
+        decksContaining[location] = np.zeros(len(cards), dtype=np.int64)
+        totalCopies[location] = np.zeros(len(cards), dtype=np.int64)
+        firstAppearance[location] = np.full(len(cards), NOT_SEEN, dtype=np.int64)
+        entriesBefore = 0
+        for part in parts:
+            ids = np.fromiter(map(vocabulary.__getitem__, part["cards"]), dtype=np.int64, count=len(part["cards"]))
+            decksContaining[location][ids] += part["decksContaining"][location]
+            totalCopies[location][ids] += part["totalCopies"][location]
+            first = part["firstAppearance"][location]
+            # Shards are in sample order, so a card's first entry is in the first shard where it appears
+            first = np.where(first < part["numEntries"][location], first + entriesBefore, NOT_SEEN)
+            np.minimum.at(firstAppearance[location], ids, first)
+            entriesBefore += part["numEntries"][location]
+    return cards, numDecks, decksContaining, totalCopies, firstAppearance
+
+
+def mergeGroupMetrics(groups: dict[str, list[str]],
+                      parts: list[tuple]) -> tuple[list[str], np.ndarray, dict[str, dict[str, np.ndarray]]]:
+    """
+    Adds up the shardGroupMetrics of every shard by month (shards of a columnar dataset may share months)
+    """
+    months = sorted(set(month for partMonths, _, _ in parts for month in partMonths))
+    position = {month: i for i, month in enumerate(months)}
+    numDecks = np.zeros(len(months), dtype=np.int64)
+    metrics = {name: {metric: np.zeros(len(months), dtype=np.int64) for metric in ca.GROUP_METRICS} for name in groups}
+    for partMonths, partDecks, partMetrics in parts:
+        ids = np.array([position[month] for month in partMonths], dtype=np.int64)
+        numDecks[ids] += partDecks
+        for name, counts in partMetrics.items():
+            for metric in ca.GROUP_METRICS:
+                metrics[name][metric][ids] += counts[metric]
+    return months, numDecks, metrics
+
+
+def mergeCardMonths(cards: list[str], parts: list[tuple]) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """
+    Adds up the shardCardMonths of every shard by month, like mergeGroupMetrics
+    """
+    months = sorted(set(month for partMonths, _, _ in parts for month in partMonths))
+    position = {month: i for i, month in enumerate(months)}
+    totals = np.zeros(len(months), dtype=np.int64)
+    monthly = np.zeros((len(cards), len(months)), dtype=np.int64)
+    for partMonths, partTotals, partMonthly in parts:
+        ids = np.array([position[month] for month in partMonths], dtype=np.int64)
+        totals[ids] += partTotals
+        monthly[:, ids] += partMonthly
+    return months, totals, monthly
+
+
+def getCardPrevalence(sample, showTypes: Optional[list[str]] = None, showArchetypes: bool = False,
+                      jobs: Optional[int] = None) -> str:
+    """
+    ca.getCardPrevalence, scanning the decks of a getDecks sample in jobs processes (every core by default)
+    """
+    if jobs is None:
+        jobs = jobsDefault()
+    if not isinstance(sample, ca.DeckSample) or not isShardable(sample.query["dataset"]) or ca.rollupRows(sample) is not None:
+        return ca.getCardPrevalence(sample, showTypes, showArchetypes)
+
+    with profiling.span("getCardPrevalence"):
+        dataset = sample.query["dataset"]
+        output = ca.savedPrevalence(sample, showTypes, dataset_version.datasetVersion(dataset)) if ca.QUERY_CACHE_ENABLED else None
+        if output is None:
+            # The workers are what load the dataset here
+            version, parts = dataset_version.loadVersioned(dataset, lambda: runShards(sample.query, jobs, shardPrevalence))
+            with profiling.span("merge shards", len(parts)):
+                cards, numDecks, decksContaining, totalCopies, firstAppearance = mergePrevalence(parts)
+            output = "No decks in sample" if numDecks == 0 else \
+                ca.formatPrevalence(cards, numDecks, decksContaining, totalCopies, firstAppearance, showTypes)
+            if ca.QUERY_CACHE_ENABLED:
+                ca.savePrevalence(sample, showTypes, version, output)
+        if showArchetypes and len(sample) > 0:
+            output += ca.formatArchetypes(ca.getArchetypes(sample), len(sample))
+        return output
+
+
+def getGroupMetrics(sample,
+                    groups: dict[str, list[str]],
+                    searchIn: Optional[list[str]] = None,
+                    minCopies: int = ca.GROUP_MIN_COPIES_DEFAULT,
+                    jobs: Optional[int] = None) -> tuple[list[str], np.ndarray, dict[str, dict[str, np.ndarray]]]:
+    """
+    ca.getGroupMetrics, counting the decks of a getDecks sample in jobs processes (every core by default)
+    """
+    if jobs is None:
+        jobs = jobsDefault()
+    if searchIn is None:
+        searchIn = ca.SEARCH_IN_DEFAULT
+    if not isinstance(sample, ca.DeckSample) or not isShardable(sample.query["dataset"]):
+        return ca.getGroupMetrics(sample, groups, searchIn, minCopies)
+
+    parts = runShards(sample.query, jobs, shardGroupMetrics, groups, searchIn, minCopies)
+    with profiling.span("merge shards", len(parts)):
+        return mergeGroupMetrics(groups, parts)
+
+
+def getGroupPrevalence(sample,
+                       groups: dict[str, list[str]],
+                       searchIn: Optional[list[str]] = None,
+                       minCopies: int = ca.GROUP_MIN_COPIES_DEFAULT,
+                       jobs: Optional[int] = None) -> str:
+    """
+    ca.getGroupPrevalence, counting the decks of a getDecks sample in jobs processes (every core by default)
+    """
+    with profiling.span("getGroupPrevalence"):
+        months, numDecks, metrics = getGroupMetrics(sample, groups, searchIn, minCopies, jobs)
+    return ca.formatGroupPrevalence(groups, minCopies, months, numDecks, metrics)
+
+
+def getChartFrequencies(sample,
+                        cards: list[str],
+                        searchIn: Optional[list[str]] = None,
+                        jobs: Optional[int] = None) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+    """
+    dv.getChartFrequencies, counting the decks of a getDecks sample in jobs processes (every core by default)
+    """
+    if jobs is None:
+        jobs = jobsDefault()
+    if searchIn is None:
+        searchIn = ca.SEARCH_IN_DEFAULT
+    if not isinstance(sample, ca.DeckSample) or not isShardable(sample.query["dataset"]) or ca.rollupRows(sample) is not None:
+        return dv.getChartFrequencies(sample, cards, searchIn)
+
+    with profiling.span("getChartFrequencies"):
+        cards = list(dict.fromkeys(cards))
+        parts = runShards(sample.query, jobs, shardCardMonths, cards, searchIn)
+        with profiling.span("merge shards", len(parts)):
+            return dv.cardFrequenciesOf(cards, *mergeCardMonths(cards, parts))
@@ -0,0 +1,161 @@
+import orjson as json
+import argparse
+import numpy as np
+from datetime import *
+from typing import Optional
+import utils
+
+'''
+Generates realistic synthetic datasets, so the analyzer and the scraper's parsers can be measured offline (see benchmark.py)
+
+Decks come from events in date order, like a scraped dataset. Each deck belongs to an archetype: a set of core cards played
+as 3-4 ofs, topped up with flex cards drawn from the archetype's pool. Archetype popularity, flex cards, sideboard cards and
+players all follow Zipf-like distributions so a few are very common and most are rare, as in real metagames.
+A few real card names are mixed in so searches like "bolt" find something
+'''
+
+EVENTS = [("league", 5, 0.55), ("challenge-32", 32, 0.2), ("preliminary", 16, 0.15), ("showcase-challenge", 64, 0.05),
+          ("ptq", 64, 0.05)] # (url name, decks per event, share of events)
+REAL_CARDS = ["lightning bolt", "ragavan, nimble pilferer", "thoughtseize", "fable of the mirror-breaker", "force of negation",
+              "solitude", "fatal push", "prismatic ending", "urza's saga", "murktide regent"]
+CARD_TYPES = ["Creature — Human Wizard", "Instant", "Sorcery", "Artifact", "Enchantment", "Land", "Legendary Planeswalker — Karn",
+              "Basic Land — Island"]
+DEFAULT_NUM_CARDS = 3000
+DEFAULT_NUM_ARCHETYPES = 40
+DEFAULT_NUM_PLAYERS = 5000
+CORE_CARDS = 10
+FLEX_CARDS = 6
+SIDEBOARD_CARDS = 7
+ARCHETYPE_POOL = 40
+
+
+def zipfWeights(n: int, exponent: float = 1.1) -> np.ndarray:
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def cardNames(numCards: int) -> list[str]:
+    return REAL_CARDS + [f"synthetic card {i}" for i in range(numCards - len(REAL_CARDS))]
+
+
+def generateDecks(numDecks: int,
+                  startMonth: Optional[str] = "2023/01",
+                  months: Optional[int] = 24,
+                  seed: Optional[int] = 0,
+                  numCards: Optional[int] = DEFAULT_NUM_CARDS,
+                  numArchetypes: Optional[int] = DEFAULT_NUM_ARCHETYPES,
+                  numPlayers: Optional[int] = DEFAULT_NUM_PLAYERS) -> list[dict]:
+    """
+    Returns numDecks deck entries spread over months months from startMonth ('yyyy/mm'), in the dataset's format
+    The same arguments always give the same decks
+    """
+    rng = np.random.default_rng(seed)
+    cards = cardNames(numCards)
+    cardWeights = zipfWeights(numCards)
+
+    # Archetypes share popular cards, so card popularity stays skewed overall
+    archetypeCore = [rng.choice(numCards, CORE_CARDS, replace=False, p=cardWeights) for _ in range(numArchetypes)]
+    archetypePool = [rng.choice(numCards, ARCHETYPE_POOL, replace=False, p=cardWeights) for _ in range(numArchetypes)]
+    archetypeWeights = zipfWeights(numArchetypes, 0.9)
+    poolWeights = zipfWeights(ARCHETYPE_POOL)
+    playerWeights = zipfWeights(numPlayers, 0.8)
+
+    firstDay = date.fromisoformat(utils.getDatesBetweenMonths(startMonth, startMonth)[0].replace("/", "-") + "-01")
+    lastMonth = firstDay.month - 1 + months
+    endDay = date(firstDay.year + lastMonth // 12, lastMonth % 12 + 1, 1)
+    numDays = (endDay - firstDay).days
+
+    # Draw enough events for the worst case and keep just enough of them, so the decks span every month
+    eventShares = np.array([share for _, _, share in EVENTS])
+    eventSizes = np.array([size for _, size, _ in EVENTS])
+    eventTypes = rng.choice(len(EVENTS), numDecks // eventSizes.min() + 1, p=eventShares)
+    numEvents = int(np.searchsorted(np.cumsum(eventSizes[eventTypes]), numDecks)) + 1
+    eventTypes = eventTypes[:numEvents]
+    eventDays = np.sort(rng.integers(0, numDays, numEvents))
+
+    decks = []
+    for eventNumber, (eventType, day) in enumerate(zip(eventTypes.tolist(), eventDays.tolist())):
+        name, size, _ = EVENTS[eventType]
+        eventDate = date.fromordinal(firstDay.toordinal() + day)
+        url = f"modern-{name}-{eventDate.year}-{eventDate.month:02}-{eventDate.day:02}{10000000 + eventNumber}"
+        event = utils.eventMetadata(url)
+        size = min(size, numDecks - len(decks))
+
+        players = rng.choice(numPlayers, size, replace=False, p=playerWeights)
+        archetypes = rng.choice(numArchetypes, size, p=archetypeWeights)
+        flex = rng.choice(ARCHETYPE_POOL, (size, FLEX_CARDS), p=poolWeights)
+        side = rng.choice(numCards, (size, SIDEBOARD_CARDS), p=cardWeights)
+        coreQuantities = rng.integers(3, 5, (size, CORE_CARDS))
+        flexQuantities = rng.integers(1, 3, (size, FLEX_CARDS))
+        sideQuantities = rng.integers(1, 4, (size, SIDEBOARD_CARDS))
+
+        for i in range(size):
+            archetype = archetypes[i]
+            main = dict(zip((cards[c] for c in archetypeCore[archetype]), coreQuantities[i].tolist()))
+            for c, quantity in zip(archetypePool[archetype][flex[i]].tolist(), flexQuantities[i].tolist()):
+                main[cards[c]] = main.get(cards[c], 0) + quantity
+            sideboard = {}
+            for c, quantity in zip(side[i].tolist(), sideQuantities[i].tolist()):
+                sideboard[cards[c]] = sideboard.get(cards[c], 0) + quantity
+            decks.append({"player": f"Player{players[i]}", "url": url, "date": str(eventDate), "main": main, "side": sideboard,
+                          "event": event})
+    return decks
+
+
+def generateCardProperties(numCards: Optional[int] = DEFAULT_NUM_CARDS, seed: Optional[int] = 0) -> dict:
+    """
+    Returns a stand-in for Data/card_properties.json covering every generated card name
+    """
+    rng = np.random.default_rng(seed)
+    properties = {}
+    for card in cardNames(numCards):
+        cmc = int(rng.integers(0, 7))
+        properties[card] = {"displayName": card.title(), "type": CARD_TYPES[int(rng.integers(0, len(CARD_TYPES)))], "uri": "",
+                            "manaCost": "{" + str(cmc) + "}" if cmc else "", "cmc": cmc, "oracle": ""}
+    return properties
+
+
+def decklistText(deck: dict) -> str:
+    """
+    Renders a deck the way one decklist element of an event page reads, i.e. the input of scraper.parseDecklist
+    """
+    lines = [f"{deck['player']} (5-0)", "Decklist", "Visual", "Text", "Sort by:", "Type", "Rarity", "Cards", "Main Deck"]
+    lines.append(f"Creature ({sum(deck['main'].values())})")
+    lines += [f"{quantity} {card.title()}" for card, quantity in deck["main"].items()]
+    lines.append(f"Sideboard ({sum(deck['side'].values())})")
+    lines += [f"{quantity} {card.title()}" for card, quantity in deck["side"].items()]
+    return "\n".join(lines)
+
+
+def eventHtml(decks: list[dict]) -> str:
+    """
+    Renders decks as an event page embedding them as json, i.e. the input of mtgo_http.extractDecklists
+    """
+    def entries(cards: dict) -> list[dict]:
+        return [{"qty": str(quantity), "card_attributes": {"card_name": card.title()}} for card, quantity in cards.items()]
+
+    data = {"decklists": [{"player": deck["player"], "main_deck": entries(deck["main"]), "sideboard_deck": entries(deck["side"])}
+                          for deck in decks]}
+    return f"<html><script>window.MTGO.decklists.data = {json.dumps(data).decode()};</script></html>"
+
+
+def writeDataset(datasetPath: str, numDecks: int, months: Optional[int] = 24, seed: Optional[int] = 0,
+                 propertiesPath: Optional[str] = None) -> None:
+    with open(datasetPath, "wb") as f:
+        f.write(json.dumps(generateDecks(numDecks, months=months, seed=seed)))
+    if propertiesPath is not None:
+        with open(propertiesPath, "wb") as f:
+            f.write(json.dumps(generateCardProperties(seed=seed)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("synthetic_data", description="e.g. python synthetic_data.py Data/synthetic.json -decks 100000")
+    parser.add_argument("dataset", help="json dataset to write")
+    parser.add_argument("-decks", nargs="?", type=int, default=10000, help="# of decks. Default: 10000")
+    parser.add_argument("-months", nargs="?", type=int, default=24, help="# of months the decks are spread over. Default: 24")
+    parser.add_argument("-seed", nargs="?", type=int, default=0, help="Same seed, same dataset. Default: 0")
+    parser.add_argument("-props", nargs="?", help="Also write a matching card properties file here, e.g. Data/synthetic_card_properties.json")
+    args = parser.parse_args()
+
+    writeDataset(args.dataset, args.decks, args.months, args.seed, args.props)
+    print(f"Saved {args.decks} decklists to {args.dataset}")
@@ -0,0 +1,64 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+
+class StandInServer:
+    """
+    Local stand-in for www.mtgo.com on an ephemeral port
+    Each path answers with its queued (status, body) responses in order, repeating the last one; other paths are 404
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = [] # (path, time it was received)
+        self.delay = 0 # Seconds each response takes, so requests overlap
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        self.httpd.standIn = self
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def route(self, path: str, *responses: tuple[int, str]) -> None:
+        self.routes[path] = list(responses)
+
+    def requestsTo(self, path: str) -> list[float]:
+        return [received for requested, received in self.requests if requested == path]
+
+    def respond(self, path: str) -> tuple[int, str]:
+        with self.lock:
+            self.requests.append((path, time.monotonic()))
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+            responses = self.routes.get(path, [(404, "Not found")])
+            response = responses.pop(0) if len(responses) > 1 else responses[0]
+        time.sleep(self.delay)
+        with self.lock:
+            self.inFlight -= 1
+        return response
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, body = self.server.standIn.respond(self.path)
+        content = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def standInServer():
+    server = StandInServer()
+    thread = threading.Thread(target=server.httpd.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
@@ -0,0 +1,119 @@
+import asyncio
+import os
+from os import path
+import pytest
+import async_crawler
+import scraper
+import segment_log
+import utils
+
+'''
+Crawls a local stand-in server (see conftest.py) serving the saved pages in tests/fixtures
+'''
+
+FIXTURES = path.join(path.dirname(__file__), "fixtures")
+CHALLENGE = "modern-challenge-32-2024-01-0112609437"
+LEAGUE = "modern-league-2024-01-016258"
+DATASET = "Data/stand_in.json"
+
+
+def readFixture(name: str) -> str:
+    with open(path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.fixture(autouse=True)
+def fastBackoff(monkeypatch):
+    monkeypatch.setattr(async_crawler, "BACKOFF_SECONDS", 0.01)
+
+
+@pytest.fixture
+def dataDir(tmp_path, monkeypatch):
+    # Url files are always written to Data/ in the working directory
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("Data")
+
+
+def fetch(crawler: async_crawler.Crawler, urls: list[str]) -> list:
+    async def fetchAll():
+        return await asyncio.gather(*(crawler.fetch(url) for url in urls))
+    return asyncio.run(fetchAll())
+
+
+def testFetchRetriesRateLimitedAndServerErrors(standInServer):
+    standInServer.route("/event", (429, ""), (503, ""), (500, ""), (200, "page"))
+    [response] = fetch(async_crawler.Crawler(retries=3, requestsPerSecond=1000), [standInServer.url + "/event"])
+    assert response.text == "page"
+    assert len(standInServer.requestsTo("/event")) == 4
+
+
+def testFetchGivesUpAfterRetries(standInServer):
+    standInServer.route("/event", (502, ""))
+    assert fetch(async_crawler.Crawler(retries=2, requestsPerSecond=1000), [standInServer.url + "/event"]) == [None]
+    assert len(standInServer.requestsTo("/event")) == 3
+
+
+def testFetchDoesNotRetryMissingPages(standInServer):
+    assert fetch(async_crawler.Crawler(retries=3, requestsPerSecond=1000), [standInServer.url + "/missing"]) == [None]
+    assert len(standInServer.requestsTo("/missing")) == 1
+
+
+def testFetchBacksOff(standInServer, monkeypatch):
+    standInServer.route("/event", (503, ""), (503, ""), (200, "page"))
+    monkeypatch.setattr(async_crawler, "BACKOFF_SECONDS", 0.1)
+    fetch(async_crawler.Crawler(retries=2, requestsPerSecond=1000), [standInServer.url + "/event"])
+    first, second, third = standInServer.requestsTo("/event")
+    # Waits BACKOFF_SECONDS, then twice as long
+    assert second - first >= 0.09
+    assert third - second >= 0.18
+
+
+def testRateLimitPerHost(standInServer):
+    for i in range(6):
+        standInServer.route(f"/event{i}", (200, "page"))
+    fetch(async_crawler.Crawler(concurrency=6, requestsPerSecond=20), [f"{standInServer.url}/event{i}" for i in range(6)])
+    received = sorted(received for _, received in standInServer.requests)
+    # 6 requests at 20 per second start over at least 5 intervals of 50ms
+    assert received[-1] - received[0] >= 0.2
+
+
+def testConcurrencyLimit(standInServer):
+    standInServer.delay = 0.1
+    for i in range(6):
+        standInServer.route(f"/event{i}", (200, "page"))
+    responses = fetch(async_crawler.Crawler(concurrency=2, requestsPerSecond=1000),
+                      [f"{standInServer.url}/event{i}" for i in range(6)])
+    assert all(response.status_code == 200 for response in responses)
+    assert standInServer.maxInFlight == 2
+
+
+def testCrawlMonthsRecordsUrls(standInServer, dataDir):
+    standInServer.route("/decklists/2024/01?filter=Modern", (200, readFixture("mtgo_listing.html")))
+    standInServer.route("/decklists/2024/02?filter=Modern", (500, ""))
+    standInServer.route(f"/decklist/{CHALLENGE}", (200, readFixture("mtgo_event.html")))
+    standInServer.route(f"/decklist/{LEAGUE}", (503, ""))
+    asyncio.run(async_crawler.crawlMonths(DATASET, "modern", ["2024/01", "2024/02"], standInServer.url, 4, 1000))
+
+    decks = segment_log.readTable(DATASET)
+    assert [deck["player"] for deck in decks] == ["Karl", "Julio_Santos"]
+    assert all(deck["url"] == CHALLENGE and deck["event"] == utils.eventMetadata(CHALLENGE) for deck in decks)
+    storedUrls = scraper.loadUrlFile(scraper.urlFileFor(DATASET))
+    assert storedUrls["completed"] == [CHALLENGE]
+    assert storedUrls["failed"]["event"] == [LEAGUE]
+    assert storedUrls["failed"]["listing"] == ["2024/02"]
+    # The pioneer event on the listing is never fetched
+    assert [requested for requested, _ in standInServer.requests if "pioneer" in requested] == []
+
+    # A later crawl only fetches the events that are not completed yet
+    standInServer.route(f"/decklist/{LEAGUE}", (200, readFixture("mtgo_event.html")))
+    standInServer.route("/decklists/2024/02?filter=Modern", (200, readFixture("mtgo_listing.html").replace("2024-01", "2024-02")))
+    standInServer.route(f"/decklist/{CHALLENGE.replace('2024-01', '2024-02')}", (200, readFixture("mtgo_event.html")))
+    standInServer.route(f"/decklist/{LEAGUE.replace('2024-01', '2024-02')}", (200, readFixture("mtgo_event.html")))
+    asyncio.run(async_crawler.crawlMonths(DATASET, "modern", ["2024/01", "2024/02"], standInServer.url, 4, 1000))
+
+    assert len(standInServer.requestsTo(f"/decklist/{CHALLENGE}")) == 1
+    assert len(segment_log.readTable(DATASET)) == 8
+    storedUrls = scraper.loadUrlFile(scraper.urlFileFor(DATASET))
+    assert sorted(storedUrls["completed"]) == sorted([CHALLENGE, LEAGUE, CHALLENGE.replace("2024-01", "2024-02"),
+                                                      LEAGUE.replace("2024-01", "2024-02")])
+    assert storedUrls["failed"] == {"listing": [], "event": [], "dead": []}
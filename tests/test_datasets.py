@@ -0,0 +1,215 @@
+import numpy as np
+import orjson as json
+import os
+import pytest
+from datetime import date
+from os import path
+import archetypes
+import batch_queries
+import card_analyzer as ca
+import columnar
+import cooccurrence
+import data_visualization as dv
+import partitions
+import query_cache
+import scraper
+import segment_log
+import sharded_queries
+import synthetic_data
+
+'''
+The same synthetic decks stored as json, columnar (.cols) and partitioned (.parts) must give the same answer to every search,
+whether it is computed, read back from the query cache or the rollups, or run over shards in worker processes
+'''
+
+NUM_DECKS = 3000
+FORMATS = ["json", "cols", "parts"]
+QUERIES = [{},
+           {"whitelist": ["bolt"]},
+           {"whitelist": ["bolt", "synthetic card 1"], "blacklist": ["thoughtseize"]},
+           {"blacklist": ["ragavan"], "searchIn": ["side"]},
+           {"player": "player1"},
+           {"minDate": date(2023, 3, 10), "maxDate": date(2023, 5, 20)},
+           {"eventType": ["league"]},
+           {"whitelist": ["fatal push"], "eventType": ["scheduled"], "searchIn": ["main"]},
+           {"archetype": ["synthetic card 96"]}]
+GROUPS = {"bolts": ["Lightning Bolt", "Fatal Push"], "threats": ["Ragavan, Nimble Pilferer", "Murktide Regent", "Solitude"]}
+CHART_CARDS = ["lightning bolt", "thoughtseize", "synthetic card 3"]
+
+
+def writeDatasets(directory: str, decks: list[dict]) -> dict[str, str]:
+    """
+    Writes decks in every format, returns the dataset path of each
+    """
+    jsonPath = path.join(directory, "decks.json")
+    with open(jsonPath, "wb") as f:
+        f.write(json.dumps(decks))
+    return {"json": jsonPath, "cols": columnar.convertJsonToColumnar(jsonPath),
+            "parts": partitions.partitionJsonDataset(jsonPath)}
+
+
+def clearCaches(datasets: dict[str, str]) -> None:
+    # Cold start: nothing loaded or saved by an earlier search
+    ca.clearDatasetCache()
+    query_cache.clearMemory()
+    cooccurrence._memory.clear()
+    for dataset in datasets.values():
+        directory = query_cache.cacheDir(dataset)
+        for name in os.listdir(directory) if path.isdir(directory) else []:
+            os.remove(path.join(directory, name))
+
+
+@pytest.fixture(scope="module")
+def cardProperties(tmp_path_factory):
+    propertiesPath = str(tmp_path_factory.mktemp("properties") / "card_properties.json")
+    with open(propertiesPath, "wb") as f:
+        f.write(json.dumps(synthetic_data.generateCardProperties()))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(ca, "CARD_PROPERTIES_PATH", propertiesPath)
+        yield propertiesPath
+
+
+@pytest.fixture(scope="module")
+def datasets(tmp_path_factory, cardProperties):
+    return writeDatasets(str(tmp_path_factory.mktemp("datasets")), synthetic_data.generateDecks(NUM_DECKS, months=6))
+
+
+@pytest.fixture
+def coldDatasets(datasets):
+    clearCaches(datasets)
+    yield datasets
+    clearCaches(datasets)
+
+
+def renderedDecks(dataset: str, query: dict) -> list[str]:
+    return list(ca.renderDecks(ca.getDecks(dataset, **query)))
+
+
+def prevalence(dataset: str, query: dict) -> str:
+    return ca.getCardPrevalence(ca.getDecks(dataset, **query), ["Creature", "Instant"], showArchetypes=True)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def testGetDecksMatchesAcrossFormats(coldDatasets, query):
+    expected = renderedDecks(coldDatasets["json"], query)
+    assert expected
+    for format in FORMATS:
+        assert renderedDecks(coldDatasets[format], query) == expected, format
+        # Warm: the deck ids come from the query cache
+        query_cache.clearMemory()
+        assert renderedDecks(coldDatasets[format], query) == expected, format
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def testGetCardPrevalenceMatchesAcrossFormats(coldDatasets, query):
+    expected = prevalence(coldDatasets["json"], query)
+    for format in FORMATS:
+        assert prevalence(coldDatasets[format], query) == expected, format
+    for format in FORMATS:
+        query_cache.clearMemory()
+        ca.clearDatasetCache()
+        assert prevalence(coldDatasets[format], query) == expected, format
+
+
+def testCachedPrevalenceIsNotRecomputed(coldDatasets, monkeypatch):
+    for format in FORMATS:
+        expected = prevalence(coldDatasets[format], {"whitelist": ["bolt"]})
+        monkeypatch.setattr(ca, "computeCardPrevalence", lambda *args: pytest.fail("cached output was recomputed"))
+        query_cache.clearMemory()
+        assert prevalence(coldDatasets[format], {"whitelist": ["bolt"]}) == expected
+        monkeypatch.undo()
+
+
+def testUncachedPrevalenceMatchesCached(coldDatasets, monkeypatch):
+    cached = [prevalence(coldDatasets[format], query) for format in FORMATS for query in QUERIES]
+    monkeypatch.setattr(ca, "QUERY_CACHE_ENABLED", False)
+    assert [prevalence(coldDatasets[format], query) for format in FORMATS for query in QUERIES] == cached
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def testShardedPrevalenceMatches(coldDatasets, monkeypatch, query):
+    monkeypatch.setattr(ca, "QUERY_CACHE_ENABLED", False)
+    expected = ca.getCardPrevalence(ca.getDecks(coldDatasets["json"], **query), ["Creature", "Instant"])
+    for format in ["cols", "parts"]:
+        sample = ca.getDecks(coldDatasets[format], **query)
+        assert sharded_queries.getCardPrevalence(sample, ["Creature", "Instant"], jobs=2) == expected, format
+
+
+def testShardedGroupsAndChartsMatch(coldDatasets):
+    query = {"whitelist": ["bolt"], "searchIn": ["main"]}
+    groups = ca.getGroupPrevalence(ca.getDecks(coldDatasets["json"], **query), GROUPS, ["main"], 2)
+    chart = dv.getChartFrequencies(ca.getDecks(coldDatasets["json"], **query), CHART_CARDS, ["main"])
+    for format in ["cols", "parts"]:
+        assert ca.getGroupPrevalence(ca.getDecks(coldDatasets[format], **query), GROUPS, ["main"], 2) == groups, format
+        assert sharded_queries.getGroupPrevalence(ca.getDecks(coldDatasets[format], **query), GROUPS, ["main"], 2, jobs=2) == groups
+        sharded = sharded_queries.getChartFrequencies(ca.getDecks(coldDatasets[format], **query), CHART_CARDS, ["main"], jobs=2)
+        for card in CHART_CARDS:
+            assert np.array_equal(sharded[card][0], chart[card][0]), format
+            assert np.allclose(sharded[card][1], chart[card][1]), format
+
+
+def testRollupChartsMatchScans(coldDatasets, monkeypatch):
+    # An unfiltered search is answered from the rollups unless they are turned off
+    for format in FORMATS:
+        rollup = dv.getChartFrequencies(ca.getDecks(coldDatasets[format]), CHART_CARDS)
+        assert ca.rollupRows(ca.getDecks(coldDatasets[format])) is not None
+        monkeypatch.setattr(ca, "rollupRows", lambda sample: None)
+        scanned = dv.getChartFrequencies(ca.getDecks(coldDatasets[format]), CHART_CARDS)
+        monkeypatch.undo()
+        for card in CHART_CARDS:
+            assert np.array_equal(rollup[card][0], scanned[card][0]), format
+            assert np.allclose(rollup[card][1], scanned[card][1]), format
+
+
+def testBatchMatchesSingleQueries(coldDatasets):
+    for format in FORMATS:
+        queries = [dict(query, dataset=coldDatasets[format], showTypes=["Land"]) for query in QUERIES]
+        expected = [ca.getCardPrevalence(ca.getDecks(coldDatasets[format], **query), ["Land"]) for query in QUERIES]
+        clearCaches(coldDatasets)
+        assert batch_queries.getCardPrevalences(queries) == expected, format
+
+
+def testPlayedWithMatchesAcrossFormats(coldDatasets):
+    expected = ca.getPlayedWith(ca.getDecks(coldDatasets["json"], whitelist=["bolt"]), "bolt")
+    for format in FORMATS:
+        assert ca.getPlayedWith(ca.getDecks(coldDatasets[format], whitelist=["bolt"]), "bolt") == expected, format
+        cooccurrence._memory.clear()
+        assert ca.getPlayedWith(ca.getDecks(coldDatasets[format], whitelist=["bolt"]), "bolt") == expected, format
+
+
+def testArchetypesMatchAcrossFormats(coldDatasets):
+    labels = [archetypes.labelsInRange(ca.loadArchetypes(coldDatasets[format]), coldDatasets[format], None, None)
+              for format in FORMATS]
+    assert all(np.array_equal(labels[0], other) for other in labels[1:])
+
+
+def testAppendAndCompact(tmp_path, monkeypatch, cardProperties):
+    # Decks saved by the scraper, before and after compaction, read the same as a dataset written with all of them at once
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("Data")
+    decks = synthetic_data.generateDecks(NUM_DECKS, months=6, seed=1)
+    # The earlier months are saved last, so a json dataset keeps them after the later ones and a partitioned one does not
+    saved = [decks[2000:]] + [decks[start:start + 700] for start in range(0, 2000, 700)]
+    written = writeDatasets(str(tmp_path), [deck for batch in saved for deck in batch])
+    os.mkdir("appended")
+    appended = writeDatasets("appended", saved[0])
+    for format in ["json", "parts"]:
+        ca.getCardPrevalence(ca.getDecks(appended[format])) # Builds the rollups, which are then kept up to date
+        for batch in saved[1:]:
+            scraper.saveDecks(appended[format], batch)
+
+    def assertSameDecks():
+        clearCaches(written)
+        clearCaches(appended)
+        for query in QUERIES:
+            for format in ["json", "parts"]:
+                assert renderedDecks(appended[format], query) == renderedDecks(written[format], query), (format, query)
+                assert prevalence(appended[format], query) == prevalence(written[format], query), (format, query)
+
+    assertSameDecks()
+    for format in ["json", "parts"]:
+        scraper.compactDataset(appended[format], force=True)
+    assert segment_log.segmentFiles(appended["json"]) == []
+    assert all(segment_log.segmentFiles(partitions.partitionPath(appended["parts"], month)) == []
+               for month in partitions.monthsInRange(appended["parts"]))
+    assertSameDecks()
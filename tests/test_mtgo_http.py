@@ -0,0 +1,51 @@
+from datetime import date
+from os import path
+import mtgo_http
+
+'''
+Parses saved MTGO pages (tests/fixtures), trimmed to a few decklists
+'''
+
+FIXTURES = path.join(path.dirname(__file__), "fixtures")
+URL_ENDING = "modern-challenge-32-2024-01-0112609437"
+DECK_DATE = date(2024, 1, 1)
+
+
+def readFixture(name: str) -> str:
+    with open(path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def testExtractDecklists():
+    decks = mtgo_http.extractDecklists(readFixture("mtgo_event.html"), URL_ENDING, DECK_DATE)
+
+    assert [deck["player"] for deck in decks] == ["Karl", "Julio_Santos"]
+    assert all(deck["url"] == URL_ENDING and deck["date"] == DECK_DATE for deck in decks)
+    assert decks[0]["main"] == {"ragavan, nimble pilferer": 4,
+                                "lightning bolt": 4, # Two printings of the same card are added up
+                                "fable of the mirror-breaker": 3, # DFCs keep their front name
+                                "lorien revealed": 4,
+                                "mountain": 9}
+    assert decks[0]["side"] == {"wear": 2, "blood moon": 1}
+    assert decks[1]["main"] == {"thoughtseize": 4, "murktide regent": 4}
+    assert decks[1]["side"] == {}
+
+
+def testExtractDecklistsWithoutDecklists():
+    # e.g. an event whose decklists are not published yet, so the caller falls back to Selenium
+    assert mtgo_http.extractDecklists(readFixture("mtgo_event_no_decklists.html"), URL_ENDING, DECK_DATE) is None
+
+
+def testExtractDecklistsMalformedJson():
+    assert mtgo_http.extractDecklists(readFixture("mtgo_event_malformed.html"), URL_ENDING, DECK_DATE) is None
+
+
+def testExtractEventUrls():
+    urls = mtgo_http.extractEventUrls(readFixture("mtgo_listing.html"), "Modern")
+    assert urls == ["https://www.mtgo.com/decklist/modern-challenge-32-2024-01-0112609437",
+                    "https://www.mtgo.com/decklist/modern-league-2024-01-016258"]
+
+
+def testExtractEventUrlsOtherHost():
+    urls = mtgo_http.extractEventUrls(readFixture("mtgo_listing.html"), "Pioneer", "http://127.0.0.1:8000")
+    assert urls == ["http://127.0.0.1:8000/decklist/pioneer-league-2024-01-016257"]
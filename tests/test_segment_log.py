@@ -0,0 +1,87 @@
+import os
+import segment_log
+
+
+def testAppendAndRead(tmp_path):
+    base = str(tmp_path / "base.json")
+    segment_log.appendRecords(base, [1, 2])
+    segment_log.appendRecords(base, [])
+    segment_log.appendRecords(base, [3])
+    assert len(segment_log.segmentFiles(base)) == 2
+    assert segment_log.readTable(base) == [1, 2, 3]
+
+
+def testCompactFoldsSegmentsIntoBase(tmp_path):
+    base = str(tmp_path / "base.json")
+    segment_log.writeFileAtomic(base, b"[0]")
+    segment_log.appendRecords(base, [1, 2])
+    segment_log.appendRecords(base, [3])
+    segment_log.compact(base)
+    assert segment_log.readBase(base, None) == [0, 1, 2, 3]
+    assert segment_log.segmentFiles(base) == []
+    segment_log.appendRecords(base, [4])
+    assert segment_log.readTable(base) == [0, 1, 2, 3, 4]
+
+
+def testCompactWithFold(tmp_path):
+    base = str(tmp_path / "counts.json")
+    segment_log.appendRecords(base, [{"a": 1}, {"b": 2}])
+    segment_log.appendRecords(base, [{"a": 3}])
+
+    def addCounts(counts: dict, records: list[dict]) -> dict:
+        for record in records:
+            for name, count in record.items():
+                counts[name] = counts.get(name, 0) + count
+        return counts
+
+    segment_log.compact(base, addCounts, {})
+    assert segment_log.readBase(base, None) == {"a": 4, "b": 2}
+
+
+def testSegmentAppendedDuringCompactionIsKept(tmp_path, monkeypatch):
+    base = str(tmp_path / "base.json")
+    segment_log.appendRecords(base, [1, 2])
+    segment_log.appendRecords(base, [3])
+    segmentFiles = segment_log.segmentFiles
+    appended = []
+
+    # A scrape appends right after compaction listed the segments it folds
+    def listThenAppend(basePath):
+        found = segmentFiles(basePath)
+        if not appended:
+            appended.append(True)
+            segment_log.appendRecords(base, [4])
+        return found
+
+    monkeypatch.setattr(segment_log, "segmentFiles", listThenAppend)
+    segment_log.compact(base)
+    monkeypatch.undo()
+    assert segment_log.readTable(base) == [1, 2, 3, 4]
+    segment_log.compact(base)
+    assert segment_log.readTable(base) == [1, 2, 3, 4]
+
+
+def testInterruptedCompactionDoesNotDuplicate(tmp_path, monkeypatch):
+    base = str(tmp_path / "base.json")
+    key = lambda record: record["id"]
+    segment_log.appendRecords(base, [{"id": 1}, {"id": 2}])
+    segment_log.appendRecords(base, [{"id": 3}])
+
+    # Crash after the new base is swapped in, before the folded segments are removed
+    def crash(segment):
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(segment_log.os, "remove", crash)
+    try:
+        segment_log.compact(base, key=key)
+    except KeyboardInterrupt:
+        pass
+    monkeypatch.undo()
+    assert segment_log.interruptedCompaction(base)
+    assert segment_log.readTable(base, key) == [{"id": 1}, {"id": 2}, {"id": 3}]
+
+    segment_log.appendRecords(base, [{"id": 4}])
+    segment_log.compact(base, key=key)
+    assert not segment_log.interruptedCompaction(base)
+    assert os.listdir(segment_log.segmentDir(base)) == []
+    assert segment_log.readTable(base, key) == [{"id": 1}, {"id": 2}, {"id": 3}, {"id": 4}]
@@ -0,0 +1,51 @@
+import threading
+import numpy as np
+
+'''
+Trigram index over a list of names (e.g. the card or player vocabulary), resolving a substring to the ids of the names
+containing it without scanning every name:
+    trigram -> sorted ids of the names containing it
+A name contains the term only if it contains each of the term's trigrams, so intersecting their id lists gives candidates
+that are then checked with `in`. Terms shorter than a trigram fall back to a scan of the names
+
+The names list may grow (e.g. compact_decks vocabularies), new names are indexed by the next search
+'''
+
+GRAM = 3
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+class TrigramIndex:
+    def __init__(self, names: list[str], lower: bool = False):
+        """
+        With lower, names are matched in lower case (search terms must already be)
+        """
+        self.names = names
+        self.lower = lower
+        self._searched: list[str] = []
+        self._grams: dict[str, list[int]] = {}
+        self._lock = threading.Lock()
+
+    def update(self) -> None:
+        with self._lock:
+            for id in range(len(self._searched), len(self.names)):
+                name = self.names[id].lower() if self.lower else self.names[id]
+                self._searched.append(name)
+                for gram in trigrams(name):
+                    self._grams.setdefault(gram, []).append(id)
+
+    def search(self, term: str) -> np.ndarray:
+        """
+        Returns the sorted ids of the names containing term
+        """
+        self.update()
+        searched = self._searched
+        if len(term) < GRAM:
+            return np.array([id for id, name in enumerate(searched) if term in name], dtype=np.int32)
+
+        lists = sorted((self._grams.get(gram, []) for gram in trigrams(term)), key=len)
+        candidates = set(lists[0]).intersection(*lists[1:])
+        return np.array(sorted(id for id in candidates if term in searched[id]), dtype=np.int32)
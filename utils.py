@@ -1,3 +1,15 @@
+# Event kinds (see eventMetadata) in each category. Events of any other kind are in none
+EVENT_TYPES = { "league": ["league", "gold", "daily"],
+                "scheduled": ["prelim", "preliminary", "challenge", "showcase-challenge", "super-challenge", "ptq", "pro-tour-qualifier",
+                              "championship", "qualifier", "super-qualifier", "showcase-qualifier", "playoff", "finals",
+                              "last-chance", "last-chance-qualifier"]}
+EVENT_KIND_CATEGORIES = {}
+for category, kinds in EVENT_TYPES.items():
+    for kind in kinds:
+        EVENT_KIND_CATEGORIES.setdefault(kind, []).append(category)
+# Each category gets a bit, so the categories of an event are one integer and a getDecks eventType filter is one mask
+EVENT_CATEGORY_CODES = {category: 1 << i for i, category in enumerate(EVENT_TYPES)}
+
 def getDatesBetweenMonths(startDate: str, endDate: str) -> list[str]:
     '''
     Returns a list of every month between the start and end date (inclusive)
@@ -30,4 +42,58 @@ def getDatesBetweenMonths(startDate: str, endDate: str) -> list[str]:
         for month in range(yearStartMonth, yearEndMonth + 1):
             dates.append(f"{year}/{month:02}")
 
-    return dates
\ No newline at end of file
+    return dates
+
+def deckKey(deck: dict) -> tuple[str, str]:
+    # A player appears at most once per event, so (event url, player) identifies a deck
+    return deck["url"], deck["player"]
+
+
+def eventCategories(url: str) -> list[str]:
+    """
+    Returns the EVENT_TYPES categories a deck's event url belongs to, by the event's kind
+    """
+    return EVENT_KIND_CATEGORIES.get(eventName(url)[0], [])
+
+
+def eventCategoryCode(url: str) -> int:
+    # Bitwise or of the EVENT_CATEGORY_CODES of eventCategories(url)
+    code = 0
+    for category in eventCategories(url):
+        code |= EVENT_CATEGORY_CODES[category]
+    return code
+
+
+def eventCategoryMask(eventType: list[str]) -> int:
+    """
+    Returns the mask matching the codes of events in any of the eventType categories (e.g. ["league", "scheduled"])
+    """
+    mask = 0
+    for category in eventType:
+        mask |= EVENT_CATEGORY_CODES[category]
+    return mask
+
+
+def eventName(urlEnding: str) -> tuple[str, int | None]:
+    """
+    Returns the kind and size of an event from its url ending, e.g. ('challenge', 32) for 'modern-challenge-32-2024-01-0712608411'
+    """
+    name = urlEnding.split("-")[1:-3]
+    size = None
+    if len(name) > 1 and name[-1].isdigit():
+        size = int(name.pop())
+    return "-".join(name), size
+
+
+def eventMetadata(urlEnding: str) -> dict:
+    """
+    Parses an event url ending, e.g. 'modern-challenge-32-2024-01-0712608411', into:
+    {"format": "modern", "kind": "challenge", "size": 32, "id": 12608411, "date": "2024-01-07", "categories": eventCategoryCode}
+    size is None for events without one in their url (e.g. leagues), id is None if the url does not end with one
+    """
+    parts = urlEnding.split("-")
+    kind, size = eventName(urlEnding)
+    day = parts[-1][:2]
+    eventId = parts[-1][2:]
+    return {"format": parts[0], "kind": kind, "size": size, "id": int(eventId) if eventId.isdigit() else None,
+            "date": f"{parts[-3]}-{parts[-2]}-{day}", "categories": eventCategoryCode(urlEnding)}